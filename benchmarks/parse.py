@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""Measure parse throughput of the Moha front ends on generated sources.
+
+Compares the hand-written parser (``moha.vm.grammar.parser``) with the
+parser generated from the EBNF grammar (``moha.vm.grammar.v0_2_0``)::
+
+    $ python benchmarks/parse.py                  # 200 generated functions
+    $ python benchmarks/parse.py --functions 2000 --repeat 5
+    $ python benchmarks/parse.py --parser handwritten libs/std/data.mo
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FUNCTION = '''def f%(i)d(a, b) {
+    total = 0;
+    items = [a, b, %(i)d, 0x%(i)x, "item %(i)d"];
+    point = {"x": a, y: b * 2 - 1, "scale": def(self, k) { return self.x * k; }};
+    do (total < a && !(b == %(i)d)) {
+        total = total + (a << 1) %% 7 | b & 3 ^ ~a;
+        point.x = point["x"] + items[0];
+    }
+    if (total >= 10 || a in items) { return point.scale(total); } (total < 10) { pass; }
+    for (item in items) { print(item); }
+    del point.y;
+    return f%(i)d;
+}
+print(f%(i)d(%(i)d, -2));
+'''
+
+def generate(functions):
+    """Return a Moha program made of ``functions`` generated functions."""
+    return ''.join(FUNCTION % {'i': i} for i in range(functions))
+
+def parsers():
+    from moha.vm.grammar import parser, v0_2_0
+    return {
+        'handwritten': parser.parse,
+        'ebnf': lambda source: v0_2_0.to_ast.transform(v0_2_0._parse(source)),
+    }
+
+def measure(parse, source, repeat):
+    """Return the best time of ``repeat`` parses of ``source``."""
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        parse(source)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def main(argv):
+    argparser = argparse.ArgumentParser(description='Measure Moha parse throughput.')
+    argparser.add_argument('file', nargs='?', help='parse this file instead of a generated source')
+    argparser.add_argument('--functions', type=int, default=200, help='generated functions (default: 200)')
+    argparser.add_argument('--repeat', type=int, default=3, help='parses per parser, the best is kept')
+    argparser.add_argument('--parser', action='append', choices=['handwritten', 'ebnf'],
+                           help='parser to measure (default: both)')
+    args = argparser.parse_args(argv)
+
+    if args.file:
+        with open(args.file) as f:
+            source = f.read()
+    else:
+        source = generate(args.functions)
+    available = parsers()
+    names = args.parser or sorted(available)
+    print('%d bytes, %d lines' % (len(source), source.count('\n')))
+    print('%-12s %10s %12s' % ('parser', 'time', 'throughput'))
+    for name in names:
+        elapsed = measure(available[name], source, args.repeat)
+        print('%-12s %9.3fs %8.1fkB/s' % (name, elapsed, len(source) / 1024.0 / elapsed))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
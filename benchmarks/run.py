@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""Run the Moha benchmarks and compare them against a stored baseline.
+
+Every benchmark is run in a fresh process, on the untranslated interpreter
+(``python targetmoha.py``) and on the translated ``bin/moha`` if it has been
+built. The best wall-clock time of ``--repeat`` runs and the peak resident
+memory are recorded::
+
+    $ python benchmarks/run.py --save-baseline     # record benchmarks/baseline.json
+    $ python benchmarks/run.py                     # compare against it
+    $ python benchmarks/run.py --vm bin fib occur  # only some benchmarks
+
+Exits with status 1 if a benchmark fails or is slower (or uses more memory)
+than the baseline by more than ``--threshold``.
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCHMARKS = os.path.join(ROOT, 'benchmarks')
+DEFAULT_BASELINE = os.path.join(BENCHMARKS, 'baseline.json')
+
+VMS = {
+    'python': [sys.executable, os.path.join(ROOT, 'targetmoha.py')],
+    'bin': [os.path.join(ROOT, 'bin', 'moha')],
+}
+
+def available_vms():
+    return [name for name in sorted(VMS) if os.path.exists(VMS[name][-1])]
+
+def benchmark_names():
+    return sorted(os.path.basename(path)[:-3] for path in glob.glob(os.path.join(BENCHMARKS, '*.mo')))
+
+def run_once(vm, name):
+    """Run one benchmark and return (seconds, peak rss in kB, exit status)."""
+    argv = VMS[vm] + [os.path.join(BENCHMARKS, name + '.mo')]
+    with open(os.devnull, 'w') as devnull:
+        start = time.time()
+        proc = subprocess.Popen(argv, stdout=devnull, stderr=devnull, cwd=ROOT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        elapsed = time.time() - start
+    # the child was reaped by wait4, keep Popen from waiting for it again
+    proc.returncode = status
+    if os.WIFSIGNALED(status):
+        return elapsed, rusage.ru_maxrss, -os.WTERMSIG(status)
+    return elapsed, rusage.ru_maxrss, os.WEXITSTATUS(status)
+
+def run(vm, name, repeat):
+    best_time, best_rss = None, None
+    for _ in range(repeat):
+        elapsed, rss, status = run_once(vm, name)
+        if status != 0:
+            return {'status': 'failed', 'exit': status}
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+        best_rss = rss if best_rss is None else min(best_rss, rss)
+    return {'status': 'ok', 'time': best_time, 'maxrss_kb': best_rss}
+
+def compare(results, baseline, threshold):
+    """Return a list of human readable regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for vm, benchmarks in sorted(results.items()):
+        for name, result in sorted(benchmarks.items()):
+            if result['status'] != 'ok':
+                regressions.append('%s/%s: failed with exit status %d' % (vm, name, result['exit']))
+                continue
+            base = baseline.get(vm, {}).get(name)
+            if base is None or base['status'] != 'ok':
+                continue
+            for key, unit in (('time', 's'), ('maxrss_kb', 'kB')):
+                if result[key] > base[key] * (1 + threshold):
+                    regressions.append('%s/%s: %s %.3f%s -> %.3f%s (+%.1f%%)' % (
+                        vm, name, key, base[key], unit, result[key], unit,
+                        (result[key] / float(base[key]) - 1) * 100))
+    return regressions
+
+def format_results(results, baseline):
+    lines = ['%-8s %-12s %10s %10s %12s' % ('vm', 'benchmark', 'time', 'baseline', 'maxrss')]
+    for vm, benchmarks in sorted(results.items()):
+        for name, result in sorted(benchmarks.items()):
+            if result['status'] != 'ok':
+                lines.append('%-8s %-12s %10s' % (vm, name, 'FAILED'))
+                continue
+            base = baseline.get(vm, {}).get(name, {})
+            base_time = '%9.3fs' % base['time'] if base.get('status') == 'ok' else '-'
+            lines.append('%-8s %-12s %9.3fs %10s %10dkB' % (
+                vm, name, result['time'], base_time, result['maxrss_kb']))
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Run the Moha benchmark suite.')
+    parser.add_argument('benchmarks', nargs='*', help='benchmarks to run (default: all)')
+    parser.add_argument('--vm', action='append', choices=sorted(VMS),
+                        help='interpreter to benchmark (default: all that exist)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best is kept')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='baseline JSON file')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results as the new baseline')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='allowed slowdown before a regression is reported (default: 0.1)')
+    args = parser.parse_args(argv)
+
+    names = args.benchmarks or benchmark_names()
+    vms = args.vm or available_vms()
+    results = {}
+    for vm in vms:
+        results[vm] = dict((name, run(vm, name, args.repeat)) for name in names)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_results(results, baseline))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        for vm, benchmarks in results.items():
+            baseline.setdefault(vm, {}).update(benchmarks)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print('REGRESSION %s' % regression)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Thin client for ``moha serve``.
+
+Sends a script to a running server and streams its output::
+
+    $ bin/moha serve /tmp/moha.sock &
+    $ bin/moha-client script.mo                 # uses $MOHA_SOCKET or /tmp/moha.sock
+    $ bin/moha-client --socket /tmp/moha.sock --stop
+
+Exits with the exit status of the script.
+"""
+
+import argparse
+import os
+import socket
+import sys
+
+DEFAULT_SOCKET = '/tmp/moha.sock'
+
+def encode(*strings):
+    return ''.join('%d:%s' % (len(string), string) for string in strings)
+
+class MessageReader(object):
+    """Splits the server's byte stream into (kind, payload) messages."""
+
+    def __init__(self):
+        self.buffer = ''
+
+    def feed(self, data):
+        self.buffer += data
+        messages = []
+        while True:
+            items, pos = [], 0
+            for _ in range(2):
+                colon = self.buffer.find(':', pos)
+                if colon < 0:
+                    return messages
+                end = colon + 1 + int(self.buffer[pos:colon])
+                if end > len(self.buffer):
+                    return messages
+                items.append(self.buffer[colon + 1:end])
+                pos = end
+            self.buffer = self.buffer[pos:]
+            messages.append((items[0], items[1]))
+
+def request(socket_path, *command):
+    """Send ``command`` and yield the server's messages as they arrive."""
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        conn.connect(socket_path)
+        conn.sendall(encode(*command))
+        conn.shutdown(socket.SHUT_WR)
+        reader = MessageReader()
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                break
+            for message in reader.feed(data):
+                yield message
+    finally:
+        conn.close()
+
+def run(socket_path, script, stdout=sys.stdout, stderr=sys.stderr):
+    """Run ``script`` on the server and return its exit status."""
+    status = 1
+    for kind, payload in request(socket_path, 'run', os.path.abspath(script)):
+        if kind == 'o':
+            stdout.write(payload)
+            stdout.flush()
+        elif kind == 'e':
+            stderr.write(payload + '\n')
+        elif kind == 'x':
+            status = int(payload)
+    return status
+
+def stop(socket_path):
+    for _ in request(socket_path, 'stop'):
+        pass
+    return 0
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='moha-client', description='Run a script on a moha server.')
+    parser.add_argument('script', nargs='?', help='script to run')
+    parser.add_argument('--socket', default=os.environ.get('MOHA_SOCKET', DEFAULT_SOCKET),
+                        help='server socket (default: $MOHA_SOCKET or %s)' % DEFAULT_SOCKET)
+    parser.add_argument('--stop', action='store_true', help='stop the server')
+    args = parser.parse_args(argv)
+    if args.stop:
+        return stop(args.socket)
+    if args.script is None:
+        parser.error('a script is required')
+    try:
+        return run(args.socket, args.script)
+    except socket.error as e:
+        sys.stderr.write('moha-client: cannot reach %s: %s\n' % (args.socket, e))
+        return 2
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
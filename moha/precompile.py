@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""Precompile trees of Moha modules into bytecode artifacts.
+
+Walks the given directories (or files), follows ``import`` statements to
+the modules they load, and compiles every module that has no up to date
+artifact across a pool of processes::
+
+    $ bin/moha-compile examples libs
+    $ bin/moha-compile --jobs 4 --force app/
+
+``load_module`` then runs the ``.moc`` artifact written next to each
+source instead of parsing and compiling it. Artifacts are stamped with
+the size and modification time of their source, so deploys must keep
+modification times (``cp -p``, ``rsync -t``, tar) for them to be used.
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.parsing import ParseError
+
+from moha.vm.artifact import artifact_path, write_artifact, is_fresh, read_imports, ArtifactError
+from moha.vm.grammar.parser import parse
+from moha.vm.objects import Sys, String
+from moha.vm.runtime import find_module, compile_ast, read_source
+from moha.vm.utils import read_file
+
+IMPORTS = ('import_module', 'import_members_from_module')
+
+def module_imports(tree):
+    """Names of the modules imported by a parsed module, e.g. ['std/data', './lib']."""
+    names = []
+    for node in tree.children:
+        if node.symbol in IMPORTS:
+            literal = node.children[len(node.children) - 1].additional_info
+            names.append(literal[1:len(literal) - 1])
+    return names
+
+class Result(object):
+
+    def __init__(self, path, imports=None, parse=0.0, compile=0.0, error=None, fresh=False):
+        self.path = path
+        self.imports = imports or []
+        self.parse = parse
+        self.compile = compile
+        self.error = error
+        self.fresh = fresh
+
+def compile_module(job):
+    """Compile one module and write its artifact. Runs in a pool worker."""
+    path, force = job
+    source = ''
+    try:
+        if not force and is_fresh(path):
+            try:
+                return Result(path, read_imports(read_file(artifact_path(path))), fresh=True)
+            except ArtifactError:
+                # damaged after its header: compile it again
+                pass
+        start = time.time()
+        source = read_source(path)
+        tree = parse(source)
+        parsed = time.time()
+        imports = module_imports(tree)
+        # writing the artifact compiles every function body
+        write_artifact(path, compile_ast(path, tree), imports)
+        return Result(path, imports, parsed - start, time.time() - parsed)
+    except ParseError as e:
+        return Result(path, error=e.nice_error_message(path, source))
+    except LexerError as e:
+        return Result(path, error=e.nice_error_message(path))
+    except Exception as e:
+        return Result(path, error='%s: %s' % (e.__class__.__name__, e))
+
+def find_sources(paths):
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                sources.extend(os.path.join(dirpath, name) for name in sorted(filenames) if name.endswith('.mo'))
+        else:
+            sources.append(path)
+    return sources
+
+def resolve(module_sys, importer, name):
+    return os.path.normpath(find_module(module_sys, importer, String(name)))
+
+class Precompiler(object):
+    """Compiles modules and the modules they import, collecting the import graph."""
+
+    def __init__(self, env_path, jobs, force=False):
+        self.sys = Sys()
+        self.sys.set_env_path(env_path)
+        self.jobs = jobs
+        self.force = force
+        self.results = {}
+        self.graph = {}
+
+    def run(self, sources):
+        pending = [os.path.normpath(source) for source in sources]
+        pool = multiprocessing.Pool(self.jobs) if self.jobs > 1 else None
+        try:
+            while pending:
+                jobs = [(path, self.force) for path in pending if path not in self.results]
+                results = pool.map(compile_module, jobs) if pool else map(compile_module, jobs)
+                pending = []
+                for result in results:
+                    self.results[result.path] = result
+                    deps = [resolve(self.sys, result.path, name) for name in result.imports]
+                    self.graph[result.path] = deps
+                    pending.extend(dep for dep in deps if dep not in self.results and os.path.exists(dep))
+                pending = sorted(set(pending))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return [self.results[path] for path in self.order()]
+
+    def order(self):
+        """Modules with their imports first; modules in an import cycle keep path order."""
+        ordered, seen = [], set()
+        def visit(path):
+            if path in seen or path not in self.results:
+                return
+            seen.add(path)
+            for dep in self.graph.get(path, []):
+                visit(dep)
+            ordered.append(path)
+        for path in sorted(self.results):
+            visit(path)
+        return ordered
+
+def report(results):
+    lines = ['%10s %10s  %s' % ('parse', 'compile', 'module')]
+    for r in results:
+        if r.error is not None:
+            lines.append('%10s %10s  %s' % ('FAILED', '', r.path))
+            lines.extend('    ' + line for line in r.error.split('\n'))
+        elif r.fresh:
+            lines.append('%10s %10s  %s' % ('fresh', '', r.path))
+        else:
+            lines.append('%9.3fms %9.3fms  %s' % (r.parse * 1000, r.compile * 1000, r.path))
+    compiled = len([r for r in results if r.error is None and not r.fresh])
+    failed = len([r for r in results if r.error is not None])
+    lines.append('%d compiled, %d up to date, %d failed' % (compiled, len(results) - compiled - failed, failed))
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog='moha-compile', description='Precompile Moha modules into .moc artifacts.')
+    parser.add_argument('paths', nargs='+', help='directories to walk or .mo files')
+    parser.add_argument('--jobs', '-j', type=int, default=multiprocessing.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--force', action='store_true', help='recompile modules with up to date artifacts')
+    parser.add_argument('--env-path', default=os.getcwd(),
+                        help='directory holding libs/, as for bin/moha (default: current directory)')
+    parser.add_argument('--quiet', '-q', action='store_true', help='only report failures')
+    args = parser.parse_args(argv)
+
+    results = Precompiler(args.env_path, args.jobs, args.force).run(find_sources(args.paths))
+    if args.quiet:
+        for r in results:
+            if r.error is not None:
+                print('%s: %s' % (r.path, r.error))
+    else:
+        print(report(results))
+    return 1 if [r for r in results if r.error is not None] else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
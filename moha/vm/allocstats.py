@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+from rpython.rlib.streamio import open_file_as_stream, StreamErrors
+
+from moha.vm import code as Code
+from moha.vm.tracer import Count, CountSort
+
+#: Whether allocation counting is compiled in. Like ``tracer.ENABLED`` this
+#: is a translation-time constant: ``rpython targetmoha.py --alloc-stats``
+#: and untranslated runs turn it on, otherwise every hook folds away.
+ENABLED = False
+
+#: Site used for allocations made outside of the interpreter loop, e.g.
+#: while loading a module or inside a builtin called from native code.
+NO_OPCODE = -1
+
+class AllocStats(object):
+    """Counts allocated objects per type and per allocating opcode."""
+
+    def __init__(self):
+        self.enabled = False
+        self.opcode = NO_OPCODE
+        self.types = {}
+        self.sites = {}
+        self.total = 0
+
+    def record(self, typename):
+        self.total += 1
+        self.types[typename] = self.types.get(typename, 0) + 1
+        try:
+            counts = self.sites[self.opcode]
+        except KeyError:
+            counts = {}
+            self.sites[self.opcode] = counts
+        counts[typename] = counts.get(typename, 0) + 1
+
+    def type_counts(self):
+        counts = [Count(typename, count) for typename, count in self.types.iteritems()]
+        CountSort(counts).sort()
+        return counts
+
+    def site_counts(self):
+        counts = []
+        for opcode, types in self.sites.iteritems():
+            site = '<runtime>' if opcode == NO_OPCODE else Code.pretty(opcode)
+            for typename, count in types.iteritems():
+                counts.append(Count('%s %s' % (site, typename), count))
+        CountSort(counts).sort()
+        return counts
+
+    def report(self, limit=20):
+        lines = ['allocations: %d' % self.total, 'types:']
+        for entry in self.type_counts():
+            lines.append('  %10d  %s' % (entry.count, entry.label))
+        lines.append('sites:')
+        for entry in self.site_counts()[:limit]:
+            lines.append('  %10d  %s' % (entry.count, entry.label))
+        lines.append('heap:')
+        lines.append('  peak rss  %s' % read_proc_status('VmHWM'))
+        lines.append('  rss       %s' % read_proc_status('VmRSS'))
+        return '\n'.join(lines)
+
+alloc_stats = AllocStats()
+
+def count_alloc(typename):
+    if ENABLED and alloc_stats.enabled:
+        alloc_stats.record(typename)
+
+def read_proc_status(field):
+    """Return a field of /proc/self/status, e.g. '10240 kB', or 'unknown'."""
+    try:
+        f = open_file_as_stream('/proc/self/status', 'r')
+        try:
+            status = f.readall()
+        finally:
+            f.close()
+    except StreamErrors:
+        return 'unknown'
+    for line in status.split('\n'):
+        if line.startswith(field + ':'):
+            return line[len(field) + 1:len(line)].strip()
+    return 'unknown'
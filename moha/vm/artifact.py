@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+"""Precompiled module artifacts.
+
+``moha-compile`` writes the bytecode of ``name.mo`` to ``name.moc``, with
+every function body compiled. ``load_module`` uses the artifact instead of
+parsing and compiling the source while the size and modification time
+recorded in it match the source file.
+
+An artifact is a header line followed by a stream of items: integers are
+written as ``<digits> ``, strings as ``<length>:<bytes>``::
+
+    MOHA-BC <format> <source mtime in ms> <source size>
+    <imported module names> <module bytecode>
+"""
+
+import os
+
+from moha.vm.objects import Bytecode, Function, Integer, String, Boolean, Null, ObjectTemplate, ExportTable
+from moha.vm.utils import SortedSet, read_file, write_file
+
+MAGIC = 'MOHA-BC'
+FORMAT = 3
+SUFFIX = 'c'
+
+class ArtifactError(Exception):
+    """Raised for a truncated or malformed artifact or image."""
+
+def artifact_path(filename):
+    return filename + SUFFIX
+
+def source_stamp(filename):
+    """(mtime in ms, size) of a source file."""
+    st = os.stat(filename)
+    return int(st.st_mtime * 1000), int(st.st_size)
+
+class Writer(object):
+
+    def __init__(self):
+        self.parts = []
+
+    def int(self, value):
+        self.parts.append('%d ' % value)
+
+    def str(self, value):
+        self.parts.append('%d:' % len(value))
+        self.parts.append(value)
+
+    def ints(self, values):
+        self.int(len(values))
+        for value in values:
+            self.int(value)
+
+    def strs(self, values):
+        self.int(len(values))
+        for value in values:
+            self.str(value)
+
+    def getvalue(self):
+        return ''.join(self.parts)
+
+def parse_int(digits):
+    try:
+        return int(digits)
+    except ValueError:
+        raise ArtifactError("malformed artifact")
+
+class Reader(object):
+
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos = pos
+
+    def int(self):
+        end = self.data.find(' ', self.pos)
+        if end < 0:
+            raise ArtifactError("truncated artifact")
+        value = parse_int(self.data[self.pos:end])
+        self.pos = end + 1
+        return value
+
+    def str(self):
+        end = self.data.find(':', self.pos)
+        if end < 0:
+            raise ArtifactError("truncated artifact")
+        start = end + 1
+        stop = start + parse_int(self.data[self.pos:end])
+        if stop < start or stop > len(self.data):
+            raise ArtifactError("truncated artifact")
+        self.pos = stop
+        return self.data[start:stop]
+
+    def ints(self):
+        return [self.int() for _ in range(self.int())]
+
+    def strs(self):
+        return [self.str() for _ in range(self.int())]
+
+def write_bytecode(w, bc):
+    w.str(bc.name)
+    w.ints(bc.code)
+    w.ints(bc.lines)
+    w.strs(bc.vars.keys)
+    w.strs(bc.names.keys)
+    w.int(len(bc.constants))
+    for const in bc.constants:
+        write_constant(w, const)
+    if bc.exports is None:
+        w.int(0)
+    else:
+        w.int(1)
+        w.str(bc.exports.name)
+        w.strs(bc.exports.names)
+        w.ints(bc.exports.slots)
+
+def write_constant(w, const):
+    if isinstance(const, Integer):
+        w.str('i')
+        w.int(const.intval)
+    elif isinstance(const, String):
+        w.str('s')
+        w.str(const.strval)
+    elif isinstance(const, Boolean):
+        w.str('b')
+        w.int(1 if const.boolval else 0)
+    elif isinstance(const, Null):
+        w.str('n')
+    elif isinstance(const, ObjectTemplate):
+        w.str('o')
+        w.strs(const.keys)
+    elif isinstance(const, Function) and const.get_bytecode() is not None:
+        w.str('f')
+        write_bytecode(w, const.get_bytecode())
+    else:
+        raise Exception("cannot write constant %s to an artifact" % const.str())
+
+def sorted_set(keys):
+    result = SortedSet()
+    for key in keys:
+        result.add(key)
+    return result
+
+def read_bytecode(r, filename):
+    name = r.str()
+    code = r.ints()
+    lines = r.ints()
+    vars = sorted_set(r.strs())
+    names = sorted_set(r.strs())
+    constants = [read_constant(r, filename) for _ in range(r.int())]
+    exports = None
+    if r.int():
+        export_name = r.str()
+        export_names = r.strs()
+        exports = ExportTable(export_name, export_names, r.ints())
+    return Bytecode(code, constants, vars, names, name, filename, lines, exports)
+
+def read_constant(r, filename):
+    tag = r.str()
+    if tag == 'i':
+        return Integer(r.int())
+    elif tag == 's':
+        return String(r.str())
+    elif tag == 'b':
+        return Boolean.from_raw(r.int() != 0)
+    elif tag == 'n':
+        return Null.singleton()
+    elif tag == 'o':
+        return ObjectTemplate(r.strs())
+    elif tag == 'f':
+        return Function(read_bytecode(r, filename))
+    raise ArtifactError("unknown constant in artifact: %s" % tag)
+
+def dump_module(bc, imports, mtime, size):
+    """Serialize the bytecode of a module compiled from a source with this stamp."""
+    w = Writer()
+    w.strs(imports)
+    write_bytecode(w, bc)
+    return '%s %d %d %d\n%s' % (MAGIC, FORMAT, mtime, size, w.getvalue())
+
+def read_header(data):
+    """Return (mtime, size, offset of the body), or None if ``data`` is not an artifact of this format."""
+    end = data.find('\n')
+    if end < 0:
+        return None
+    fields = data[0:end].split(' ')
+    if len(fields) != 4 or fields[0] != MAGIC or fields[1] != str(FORMAT):
+        return None
+    return parse_int(fields[2]), parse_int(fields[3]), end + 1
+
+def read_imports(data):
+    header = read_header(data)
+    if header is None:
+        return None
+    return Reader(data, header[2]).strs()
+
+def write_artifact(filename, bc, imports):
+    mtime, size = source_stamp(filename)
+    write_file(artifact_path(filename), dump_module(bc, imports, mtime, size))
+
+def load_artifact(filename):
+    """Bytecode of the module in ``filename`` from its artifact, or None if it has none or it is stale or damaged."""
+    path = artifact_path(filename)
+    try:
+        mtime, size = source_stamp(filename)
+        data = read_file(path)
+    except OSError:
+        return None
+    try:
+        header = read_header(data)
+        if header is None or header[0] != mtime or header[1] != size:
+            return None
+        r = Reader(data, header[2])
+        r.strs()
+        return read_bytecode(r, filename)
+    except ArtifactError:
+        # a damaged artifact is only a missed cache: compile the source
+        return None
+
+def is_fresh(filename):
+    """Whether ``filename`` has an artifact matching its current stamp."""
+    try:
+        mtime, size = source_stamp(filename)
+        data = read_file(artifact_path(filename))
+    except OSError:
+        return False
+    try:
+        header = read_header(data)
+    except ArtifactError:
+        return False
+    return header is not None and header[0] == mtime and header[1] == size
@@ -43,19 +43,32 @@ LOAD_VAR = 0
 STORE_VAR = 1
 DEL_VAR = 52
 LOAD_CONST = 2
+#: module global, then callers' variables, then builtin
 LOAD_GLOBAL = 16
+#: variable of an enclosing function, found in the callers' frames
+LOAD_NONLOCAL = 55
+#: variable bound by an import; resolves it if the import is still lazy
+LOAD_IMPORT = 57
 
 CALL_FUNC = 6
+#: push the receiver tos1 and its method named tos; the receiver is None
+#: unless the method is a native one shared by all instances
+LOAD_METHOD = 58
+#: like CALL_FUNC, passing the receiver below the function first
+CALL_METHOD = 59
 RETURN_VALUE = 5
 
 NOT = 28
 ABORT = 30
+#: tos = function of the template tos, bound to the current module globals
 MAKE_FUNCTION = 13
 CALL_CFFI = 15
 LOAD_ATTR = 18
 
 BUILD_ARRAY = 22
 BUILD_MAP = 19
+#: build an object with the keys of the template constant arg from the stack
+BUILD_OBJECT = 56
 STORE_MAP = 20
 MAP_GETITEM = 21
 MAP_SETITEM = 23
@@ -68,6 +81,11 @@ JUMP_IF_FALSE_OR_POP = 24
 JUMP_IF_TRUE_OR_POP = 29
 JUMP_RELATIVE_IF_FALSE = 47
 
+#: tos = iter(tos)
+GET_ITER = 53
+#: push next(tos), or pop tos and jump to arg once it is exhausted
+FOR_ITER = 54
+
 IMPORT_MODULE = 41
 IMPORT_MEMBER = 42
 EXPORT_MODULE = 43
@@ -1,20 +1,63 @@
 # -*- coding: utf-8 -*-
 
-from rpython.rlib.parsing.tree import RPythonVisitor
+from rpython.rlib.parsing.tree import RPythonVisitor, Symbol, Nonterminal
 from moha.vm import code
 from moha.vm.objects import *
 from moha.vm.utils import SortedSet, NOT_FOUND
 
+class FunctionBody(object):
+    """The AST of a function body, compiled when the function is first called."""
+
+    def __init__(self, name, arguments, block, filename, lineno, recursive, scopes):
+        self.name = name
+        self.arguments = arguments
+        self.block = block
+        self.filename = filename
+        self.lineno = lineno
+        self.recursive = recursive
+        self.scopes = scopes
+        self.bytecode = None
+
+    def get_bytecode(self):
+        if self.bytecode is None:
+            self.bytecode = self.compile()
+            self.block = None
+        return self.bytecode
+
+    def compile(self):
+        inner_ctx = Compiler(filename=self.filename, name=self.name, lineno=self.lineno,
+                             scopes=self.scopes, function=True)
+        for arg in self.arguments:
+            inner_ctx.register_var(arg)
+        if self.recursive:
+            inner_ctx.register_var(self.name)
+        inner_ctx.collect_imports(self.block)
+        inner_ctx.dispatch(self.block)
+        if len(inner_ctx.codes) < 2 or inner_ctx.codes[len(inner_ctx.codes) - 2] != code.RETURN_VALUE:
+            inner_ctx.emit(code.LOAD_CONST, inner_ctx.register_constant(Null.singleton()))
+            inner_ctx.emit(code.RETURN_VALUE)
+        return inner_ctx.create_bytecode()
+
 class Compiler(RPythonVisitor):
     """Compile AST to bytecode."""
 
-    def __init__(self, _globals=None):
+    def __init__(self, _globals=None, filename='', name='<module>', lineno=1, scopes=None, function=False):
+        self.filename = filename
+        self.name = name
+        self.lineno = lineno
+        self.lines = []
         self.codes = []
         self.consts = []
         self.vars = SortedSet()
         self.names = SortedSet()
-        self.exports = {}
+        self.export_name = None
+        self.export_members = None
         self.globals = _globals or SortedSet()
+        # variables of the enclosing functions, innermost last
+        self.scopes = scopes or []
+        self.function = function
+        # variables bound by import statements, loaded with LOAD_IMPORT
+        self.imports = SortedSet()
 
     def register_constant(self, v):
         self.consts.append(v)
@@ -38,12 +81,66 @@ class Compiler(RPythonVisitor):
     def lookup_global(self, name):
         return self.globals.get(name)
 
+    def is_nonlocal(self, name):
+        for scope in self.scopes:
+            if scope.include(name):
+                return True
+        return False
+
+    def inner_scopes(self):
+        if self.function:
+            return self.scopes + [self.vars]
+        return self.scopes
+
+    def mark_line(self, node):
+        """Attribute the instructions emitted next to the first line of ``node``."""
+        while isinstance(node, Nonterminal):
+            if not node.children:
+                return
+            node = node.children[0]
+        if isinstance(node, Symbol) and node.token is not None:
+            self.lineno = node.token.source_pos.lineno + 1
+
     def emit(self, bc, arg=0):
         self.codes.append(bc)
         self.codes.append(arg)
+        self.lines.append(self.lineno)
 
-    def create_bytecode(self):
-        return Bytecode(self.codes, self.consts[:], self.vars, self.names)
+    def create_bytecode(self, exports=None):
+        return Bytecode(self.codes[:], self.consts[:], self.vars, self.names,
+                        self.name, self.filename, self.lines[:], exports)
+
+    def create_export_table(self):
+        """Exports of a module; without an export statement every variable is exported."""
+        if self.export_members is None:
+            names = self.vars.keys[:]
+        else:
+            names = self.export_members
+        slots = []
+        for name in names:
+            slot = self.lookup_var(name)
+            if slot == NOT_FOUND:
+                raise Exception("cannot export undefined variable %s" % name)
+            slots.append(slot)
+        return ExportTable(self.export_name or self.filename, names, slots)
+
+    def collect_imports(self, node):
+        """Record the variables that import statements in ``node`` bind."""
+        if not isinstance(node, Nonterminal):
+            return
+        if node.symbol == 'import_members_from_module':
+            for member in node.children[0].children:
+                self.imports.add(member.additional_info)
+        elif node.symbol == 'import_module':
+            self.imports.add(self.module_var_name(node))
+        else:
+            for child in node.children:
+                self.collect_imports(child)
+
+    def module_var_name(self, node):
+        """The variable ``import "a/b";`` binds: the last part of the module path."""
+        packages = self.extract_string(node.children[0].additional_info).split('/')
+        return packages[len(packages) - 1]
 
     def extract_string(self, string_literal):
         string = str(string_literal)
@@ -54,7 +151,12 @@ class Compiler(RPythonVisitor):
 
     def visit_IDENTIFIER(self, node):
         if self.lookup_var(node.additional_info) == NOT_FOUND:
-            self.emit(code.LOAD_GLOBAL, self.register_name(node.additional_info))
+            if self.is_nonlocal(node.additional_info):
+                self.emit(code.LOAD_NONLOCAL, self.register_name(node.additional_info))
+            else:
+                self.emit(code.LOAD_GLOBAL, self.register_name(node.additional_info))
+        elif self.imports.include(node.additional_info):
+            self.emit(code.LOAD_IMPORT, self.register_var(node.additional_info))
         else:
             self.emit(code.LOAD_VAR, self.register_var(node.additional_info))
 
@@ -84,7 +186,9 @@ class Compiler(RPythonVisitor):
         self.emit(code.LOAD_CONST, self.register_constant(value))
 
     def visit_main(self, node):
+        self.collect_imports(node)
         for children in node.children:
+            self.mark_line(children)
             self.dispatch(children)
 
     def visit_statement(self, node):
@@ -108,34 +212,21 @@ class Compiler(RPythonVisitor):
         module_name = self.extract_string(node.children[0].additional_info)
         self.emit(code.LOAD_CONST, self.register_constant(String(module_name)))
         self.emit(code.IMPORT_MODULE)
-        packages = module_name.split('/')
-        var_name = packages[len(packages) - 1]
-        self.emit(code.STORE_VAR, self.register_var(var_name))
+        self.emit(code.STORE_VAR, self.register_var(self.module_var_name(node)))
+
+    def check_single_export(self):
+        if self.export_name is not None:
+            raise Exception("a module can only have one export statement")
 
     def visit_export_all_members_as_module(self, node):
-        pass
-        # module_name = self.extract_string(node.children[0].additional_info)
-        # if self.globals.include(module_name):
-            # print('[WARNING] module "%s" is overwritten.' % module_name)
-        # bytecode = self.create_bytecode()
-        # members = list(self.vars.keys)
-        # module = Module(module_name, members, bytecode)
-        # self.globals[module_name] = module
+        self.check_single_export()
+        self.export_name = self.extract_string(node.children[0].additional_info)
+        self.export_members = None
 
     def visit_export_selected_members_as_module(self, node):
-        pass
-        # module_name = self.extract_string(node.children[1].additional_info)
-        # if module_name in self.globals:
-            # print('[WARNING] module "%s" is overwritten.' % module_name)
-        # self.globals[module_name] = self.create_bytecode()
-
-        # module_name = self.extract_string(node.children[0].additional_info)
-        # if module_name in self.globals:
-            # print('[WARNING] module "%s" is overwritten.' % module_name)
-        # bytecode = self.create_bytecode()
-        # members = [chnode.additional_info for chnode in node.children[0].children]
-        # module = Module(module_name, members, bytecode)
-        # self.globals[module_name] = module
+        self.check_single_export()
+        self.export_name = self.extract_string(node.children[1].additional_info)
+        self.export_members = [member.additional_info for member in node.children[0].children]
 
     def visit_abort(self, node):
         self.dispatch(node.children[0])
@@ -189,6 +280,18 @@ class Compiler(RPythonVisitor):
             jmp_done_indexes.append(len(self.codes) - 1)
         self.codes[end_index] = len(self.codes)
 
+    def visit_for(self, node):
+        target, iterable, block = node.children
+        self.dispatch(iterable)
+        self.emit(code.GET_ITER)
+        begin = len(self.codes)
+        self.emit(code.FOR_ITER, 0)
+        end_index = len(self.codes) - 1
+        self.emit(code.STORE_VAR, self.register_var(target.additional_info))
+        self.visit_block(block)
+        self.emit(code.JMP, begin)
+        self.codes[end_index] = len(self.codes)
+
     def visit_if(self, node):
         jmp_true_indexes = []
         for guardcommand in node.children:
@@ -211,18 +314,12 @@ class Compiler(RPythonVisitor):
         def_name = node.children[0]
         def_arguments = node.children[1]
         def_block = node.children[2]
-        inner_ctx = Compiler()
-        for arg in def_arguments.children:
-            inner_ctx.register_var(arg.additional_info)
-        outer_index = self.register_var(def_name.additional_info)
-        inner_index = inner_ctx.register_var(def_name.additional_info)
-        inner_ctx.visit_block(def_block)
-        if inner_ctx.codes[len(inner_ctx.codes) - 2] != code.RETURN_VALUE:
-            inner_ctx.emit(code.LOAD_CONST, self.register_constant(Null.singleton()))
-            inner_ctx.emit(code.RETURN_VALUE)
-        bc = inner_ctx.create_bytecode()
-        fn = Function(bc)
+        arguments = [arg.additional_info for arg in def_arguments.children]
+        body = FunctionBody(def_name.additional_info, arguments, def_block,
+                            self.filename, self.lineno, True, self.inner_scopes())
+        fn = Function(body=body)
         self.emit(code.LOAD_CONST, self.register_constant(fn))
+        self.emit(code.MAKE_FUNCTION)
         self.emit(code.STORE_VAR, self.register_var(def_name.additional_info))
 
     def visit_unary_expression(self, node):
@@ -295,16 +392,31 @@ class Compiler(RPythonVisitor):
         atom = node.children[0]
         attrs = node.children[1:]
         self.dispatch(atom)
-        for attr in attrs:
-            self.dispatch(attr)
+        method_call = False
+        for i in range(len(attrs)):
+            attr = attrs[i]
+            if method_call:
+                self.emit_call(attr, code.CALL_METHOD)
+                method_call = False
+            elif (attr.symbol == 'identifier_selector' and i + 1 < len(attrs) and
+                    attrs[i + 1].symbol in ('arguments', 'primary_expression_rest')):
+                const = String(attr.children[0].additional_info)
+                self.emit(code.LOAD_CONST, self.register_constant(const))
+                self.emit(code.LOAD_METHOD)
+                method_call = True
+            else:
+                self.dispatch(attr)
+
+    def emit_call(self, node, opcode):
+        for arg in reversed(node.children):
+            self.dispatch(arg)
+        self.emit(opcode, len(node.children))
 
     def visit_primary_expression_rest(self, node):
-        self.emit(code.CALL_FUNC, 0)
+        self.emit_call(node, code.CALL_FUNC)
 
     def visit_arguments(self, node):
-        for arg in reversed(node.children):
-            self.dispatch(arg)
-        self.emit(code.CALL_FUNC, len(node.children))
+        self.emit_call(node, code.CALL_FUNC)
 
     def visit_index_selector(self, node):
         self.dispatch(node.children[0])
@@ -327,9 +439,24 @@ class Compiler(RPythonVisitor):
         self.emit(code.BUILD_ARRAY, len(node.children))
 
     def visit_object_literal(self, node):
-        self.emit(code.BUILD_MAP, len(node.children))
+        keys = SortedSet()
+        for entry in node.children:
+            keys.add(self.object_entry_key(entry))
+        if keys.size() == 0 or keys.size() != len(node.children):
+            # empty literal or duplicate keys: build it entry by entry
+            self.emit(code.BUILD_MAP, len(node.children))
+            for entry in node.children:
+                self.dispatch(entry)
+            return
         for entry in node.children:
-            self.dispatch(entry)
+            self.dispatch(entry.children[1])
+        self.emit(code.BUILD_OBJECT, self.register_constant(ObjectTemplate(keys.keys[:])))
+
+    def object_entry_key(self, entry):
+        key = entry.children[0].additional_info
+        if entry.symbol == 'object_string_entry':
+            return self.extract_string(key)
+        return key
 
     def visit_object_identifier_entry(self, node):
         key, value = node.children[0], node.children[1]
@@ -352,16 +479,12 @@ class Compiler(RPythonVisitor):
         self.emit(code.STORE_MAP)
 
     def visit_closure(self, node):
-        inner_ctx = Compiler()
-        for arg in node.children[0].children:
-            inner_ctx.register_var(arg.additional_info)
-        inner_ctx.dispatch(node.children[1])
-        if inner_ctx.codes[len(inner_ctx.codes) - 2] != code.RETURN_VALUE:
-            inner_ctx.emit(code.LOAD_CONST, inner_ctx.register_constant(Null.singleton()))
-            inner_ctx.emit(code.RETURN_VALUE)
-        bc = inner_ctx.create_bytecode()
-        w = Function(bc)
+        arguments = [arg.additional_info for arg in node.children[0].children]
+        body = FunctionBody('<closure>', arguments, node.children[1],
+                            self.filename, self.lineno, False, self.inner_scopes())
+        w = Function(body=body)
         self.emit(code.LOAD_CONST, self.register_constant(w))
+        self.emit(code.MAKE_FUNCTION)
 
     def visit_null_literal(self, node):
         self.emit(code.LOAD_CONST, self.register_constant(Null.singleton()))
@@ -372,10 +495,12 @@ class Compiler(RPythonVisitor):
 
     def visit_block(self, node):
         for statement in node.children:
+            self.mark_line(statement)
             self.dispatch(statement)
 
     def visit_guardcommand_body(self, node):
         for statement in node.children:
+            self.mark_line(statement)
             self.dispatch(statement)
 
     def visit_or_test(self, node):
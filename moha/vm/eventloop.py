@@ -0,0 +1,382 @@
+# -*- coding: utf-8 -*-
+"""The event loop behind the ``std/io`` module.
+
+Files, pipes and sockets are opened non-blocking and wrapped in a
+``Stream``. A stream operation is tried at once; when it would block, it
+becomes an ``IOWait`` that suspends only the calling task. When no task
+can run, the scheduler calls ``EventLoop.poll``, which blocks in poll(2)
+until one of the waited for descriptors is ready or the next ``sleep``
+is over, and wakes the tasks parked on those waits; a ready wait retries
+its operation.
+
+poll(2) reports regular files as always ready, so file reads and writes
+complete at once; host names are resolved with a blocking lookup.
+"""
+
+import os
+from errno import EAGAIN, EWOULDBLOCK, EINPROGRESS
+
+from rpython.rlib import rpoll, rposix
+from rpython.rlib.rsocket import RSocket, INETAddress, UNIXAddress, SocketError, SocketErrorWithErrno
+from rpython.rlib.rsocket import AF_INET, AF_UNIX, SOCK_STREAM, SOL_SOCKET, SO_ERROR, SO_REUSEADDR
+
+from moha.vm.allocstats import count_alloc
+from moha.vm.objects import W_Root, Function, String, Null
+from moha.vm.tasks import Wait
+from moha.vm.utils import monotonic_ns
+
+#: revents that end a wait whatever it waited for
+POLL_DONE = rpoll.POLLERR | rpoll.POLLHUP | rpoll.POLLNVAL
+
+MODES = {
+    'r': os.O_RDONLY,
+    'w': os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+    'a': os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+}
+
+def would_block(errno):
+    return errno == EAGAIN or errno == EWOULDBLOCK
+
+def set_nonblocking(fd):
+    rposix.set_status_flags(fd, rposix.get_status_flags(fd) | os.O_NONBLOCK)
+
+class EventLoop(object):
+    """Descriptors and timers that tasks are waiting for."""
+
+    def __init__(self):
+        self.waits = []
+        self.timers = []
+
+    def watch(self, wait):
+        if not wait.watched:
+            wait.watched = True
+            self.waits.append(wait)
+
+    def add_timer(self, wait):
+        if not wait.watched:
+            wait.watched = True
+            self.timers.append(wait)
+
+    def remove_timer(self, wait):
+        if wait.watched:
+            wait.watched = False
+            self.timers.remove(wait)
+
+    def pending(self):
+        return len(self.waits) > 0 or len(self.timers) > 0
+
+    def poll(self, block):
+        """Mark the waits whose descriptors are ready and the timers that are due,
+        and wake their tasks; returns whether there were any.
+
+        With ``block`` it waits until one is, or the next timer is due;
+        otherwise it only checks.
+        """
+        timeout = 0
+        if block:
+            timeout = -1
+            if self.timers:
+                deadline = self.timers[0].deadline
+                for timer in self.timers:
+                    if timer.deadline < deadline:
+                        deadline = timer.deadline
+                timeout = max(0, (deadline - monotonic_ns() + 999999) / 1000000)
+        fired = False
+        if self.waits or timeout != 0:
+            fired = self.poll_waits(timeout)
+        if self.timers:
+            fired = self.expire_timers() or fired
+        return fired
+
+    def poll_waits(self, timeout):
+        fds = {}
+        for wait in self.waits:
+            fds[wait.fd] = fds.get(wait.fd, 0) | wait.events
+        try:
+            events = rpoll.poll(fds, timeout)
+        except rpoll.PollError:
+            # interrupted; the caller polls again
+            return False
+        if not events:
+            return False
+        ready = {}
+        for fd, revents in events:
+            ready[fd] = revents
+        waiting = []
+        for wait in self.waits:
+            if ready.get(wait.fd, 0) & (wait.events | POLL_DONE):
+                wait.fired = True
+                wait.watched = False
+                wait.wake()
+            else:
+                waiting.append(wait)
+        self.waits = waiting
+        return True
+
+    def expire_timers(self):
+        now = monotonic_ns()
+        timers = []
+        for timer in self.timers:
+            if timer.deadline <= now:
+                timer.watched = False
+                timer.wake()
+            else:
+                timers.append(timer)
+        expired = len(timers) < len(self.timers)
+        self.timers = timers
+        return expired
+
+class LoopWait(Wait):
+    """A wait watched by the event loop, which wakes the task parked on it."""
+
+    task = None
+
+    def park(self, task):
+        self.task = task
+
+    def wake(self):
+        task = self.task
+        if task is not None:
+            self.task = None
+            task.wake()
+
+class IOWait(LoopWait):
+    """A stream operation waiting for its descriptor to become ready.
+
+    ``attempt`` tries the operation without blocking and calls ``finish``
+    or ``fail`` once it is over; until then the wait is watched by the loop.
+    An ``IOWait`` itself only waits until poll reports the descriptor ready
+    for ``events``, and returns null.
+    """
+
+    def __init__(self, loop, fd, events):
+        self.loop = loop
+        self.fd = fd
+        self.events = events
+        self.fired = False
+        self.watched = False
+        self.done = False
+        self.result = None
+        self.error = None
+
+    def start(self):
+        self.attempt()
+        if not self.done:
+            self.loop.watch(self)
+
+    def attempt(self):
+        if self.fired:
+            self.finish(Null.singleton())
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+
+    def fail(self, message):
+        self.done = True
+        self.error = message
+
+    def ready(self):
+        if not self.done and self.fired:
+            self.attempt()
+            self.fired = False
+        if not self.done:
+            self.loop.watch(self)
+        return self.done
+
+    def complete(self):
+        if self.error is not None:
+            raise Exception(self.error)
+        return self.result
+
+class ReadWait(IOWait):
+
+    def __init__(self, loop, stream, size):
+        IOWait.__init__(self, loop, stream.fd, rpoll.POLLIN)
+        self.size = size
+
+    def attempt(self):
+        try:
+            data = os.read(self.fd, self.size)
+        except OSError as e:
+            if not would_block(e.errno):
+                self.fail('read failed: %s' % os.strerror(e.errno))
+            return
+        self.finish(String(data))
+
+class WriteWait(IOWait):
+
+    def __init__(self, loop, stream, data):
+        IOWait.__init__(self, loop, stream.fd, rpoll.POLLOUT)
+        self.data = data
+        self.offset = 0
+
+    def attempt(self):
+        while self.offset < len(self.data):
+            try:
+                self.offset += os.write(self.fd, self.data[self.offset:])
+            except OSError as e:
+                if not would_block(e.errno):
+                    self.fail('write failed: %s' % os.strerror(e.errno))
+                return
+        self.finish(Null.singleton())
+
+class AcceptWait(IOWait):
+
+    def __init__(self, loop, stream):
+        IOWait.__init__(self, loop, stream.fd, rpoll.POLLIN)
+        self.stream = stream
+
+    def attempt(self):
+        sock = self.stream.sock
+        assert sock is not None
+        try:
+            fd, _ = sock.accept()
+        except SocketError as e:
+            if not (isinstance(e, SocketErrorWithErrno) and would_block(e.errno)):
+                self.fail('accept failed: %s' % e.get_msg())
+            return
+        conn = RSocket(sock.family, SOCK_STREAM, 0, fd)
+        conn.setblocking(False)
+        self.finish(Stream(conn.fd, self.stream.name, conn))
+
+class ConnectWait(IOWait):
+
+    def __init__(self, loop, stream, address):
+        IOWait.__init__(self, loop, stream.fd, rpoll.POLLOUT)
+        self.stream = stream
+        self.address = address
+        self.started = False
+
+    def attempt(self):
+        sock = self.stream.sock
+        assert sock is not None
+        if not self.started:
+            self.started = True
+            err = sock.connect_ex(self.address)
+            if err == EINPROGRESS or would_block(err):
+                return
+        else:
+            err = sock.getsockopt_int(SOL_SOCKET, SO_ERROR)
+        if err != 0:
+            self.stream.close()
+            self.fail('cannot connect to %s: %s' % (self.stream.name, os.strerror(err)))
+        else:
+            self.finish(self.stream)
+
+class SleepWait(LoopWait):
+
+    def __init__(self, loop, ms):
+        self.loop = loop
+        self.deadline = monotonic_ns() + ms * 1000000
+        self.watched = False
+
+    def ready(self):
+        if monotonic_ns() >= self.deadline:
+            self.loop.remove_timer(self)
+            return True
+        self.loop.add_timer(self)
+        return False
+
+class Stream(W_Root):
+    """A non-blocking file, pipe end or socket."""
+
+    def __init__(self, fd, name, sock=None):
+        count_alloc('Stream')
+        self.fd = fd
+        self.name = name
+        # sockets keep their RSocket, which owns the descriptor
+        self.sock = sock
+        self.closed = False
+
+    def check_open(self):
+        if self.closed:
+            raise Exception("%s is closed" % self.name)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.sock is not None:
+            self.sock.close()
+        else:
+            os.close(self.fd)
+
+    def port(self):
+        if self.sock is None or self.sock.family != AF_INET:
+            raise Exception("%s is not a TCP socket" % self.name)
+        address = self.sock.getsockname()
+        assert isinstance(address, INETAddress)
+        return address.get_port()
+
+    def get(self, key):
+        name = key.str()
+        if name not in ('read', 'write', 'close', 'accept', 'port'):
+            raise Exception("stream has no method %s" % name)
+        return Function(None, 'stream.' + name)
+
+    def str(self):
+        return '<stream %s>' % self.name
+
+def open_file(path, mode):
+    if mode not in MODES:
+        raise Exception("unknown file mode %s" % mode)
+    fd = os.open(path, MODES[mode] | os.O_NONBLOCK, 0666)
+    return Stream(fd, path)
+
+def open_pipe():
+    """The read and the write end of a new pipe."""
+    r, w = os.pipe()
+    set_nonblocking(r)
+    set_nonblocking(w)
+    return Stream(r, 'pipe'), Stream(w, 'pipe')
+
+def socket_address(family, host, port, path, action, name):
+    try:
+        if family == AF_INET:
+            return INETAddress(host, port)
+        return UNIXAddress(path)
+    except SocketError as e:
+        raise Exception("cannot %s %s: %s" % (action, name, e.get_msg()))
+
+def new_socket(family, action, name):
+    try:
+        return RSocket(family, SOCK_STREAM)
+    except SocketError as e:
+        raise Exception("cannot %s %s: %s" % (action, name, e.get_msg()))
+
+def listen_socket(family, host, port, path, name):
+    address = socket_address(family, host, port, path, "listen on", name)
+    sock = new_socket(family, "listen on", name)
+    try:
+        if family == AF_INET:
+            sock.setsockopt_int(SOL_SOCKET, SO_REUSEADDR, 1)
+        sock.bind(address)
+        sock.listen(128)
+        sock.setblocking(False)
+    except SocketError as e:
+        sock.close()
+        raise Exception("cannot listen on %s: %s" % (name, e.get_msg()))
+    return Stream(sock.fd, name, sock)
+
+def listen_tcp(host, port):
+    return listen_socket(AF_INET, host, port, '', '%s:%d' % (host, port))
+
+def listen_unix(path):
+    return listen_socket(AF_UNIX, '', 0, path, path)
+
+def connect_socket(loop, family, host, port, path, name):
+    address = socket_address(family, host, port, path, "connect to", name)
+    sock = new_socket(family, "connect to", name)
+    try:
+        sock.setblocking(False)
+    except SocketError as e:
+        sock.close()
+        raise Exception("cannot connect to %s: %s" % (name, e.get_msg()))
+    return ConnectWait(loop, Stream(sock.fd, name, sock), address)
+
+def connect_tcp(loop, host, port):
+    return connect_socket(loop, AF_INET, host, port, '', '%s:%d' % (host, port))
+
+def connect_unix(loop, path):
+    return connect_socket(loop, AF_UNIX, '', 0, path, path)
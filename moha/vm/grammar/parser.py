@@ -0,0 +1,560 @@
+# -*- coding: utf-8 -*-
+"""Hand-written lexer and recursive descent parser for Moha.
+
+It accepts the language described by ``v0_2_0.txt`` and builds the same
+trees as the generated ``rlib.parsing`` parser after its ``ToAST``
+transform, so the ``Compiler`` visitors work unchanged. Binary operators
+are parsed by precedence climbing over the ``BINARY_LEVELS`` table.
+"""
+
+from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.lexer import Token, SourcePos
+from rpython.rlib.parsing.parsing import ParseError as _ParseError, ErrorInformation
+from rpython.rlib.parsing.tree import Symbol, Nonterminal
+
+# Literal tokens of the grammar, in the order the generated lexer numbers
+# them, so that symbols are named alike, e.g. '__35_+'.
+LITERALS = [';', 'import', 'from', ',', 'export', '*', 'as', '{', '}', '(', ')',
+            'if', 'do', 'for', 'in', 'def', 'pass', 'return', 'abort', '=', 'del',
+            '||', '&&', '!', '==', '!=', '<', '<=', '>', '>=', '|', '^', '&',
+            '<<', '>>', '+', '-', '/', '%', '~', '.', '[', ']', ':', '&^',
+            'true', 'false', 'null']
+
+TOKEN_NAMES = {}
+for _index, _literal in enumerate(LITERALS):
+    TOKEN_NAMES[_literal] = '__%d_%s' % (_index, _literal)
+
+KEYWORDS = {}
+for _literal in LITERALS:
+    if _literal[0].isalpha():
+        KEYWORDS[_literal] = None
+
+OPERATOR_CHARS = ';,*{}()|^&=!<>+-~/%.[]:'
+
+def is_digit(c):
+    return '0' <= c <= '9'
+
+def is_identifier_start(c):
+    return c == '_' or 'a' <= c <= 'z' or 'A' <= c <= 'Z'
+
+def is_identifier_char(c):
+    return is_identifier_start(c) or is_digit(c)
+
+class ParseError(_ParseError):
+
+    def nice_error_message(self, filename="<unknown>", source=""):
+        result = ["  File %s, line %s" % (filename, self.source_pos.lineno + 1)]
+        if source:
+            result.append(source.split("\n")[self.source_pos.lineno])
+            result.append(" " * self.source_pos.columnno + "^")
+        else:
+            result.append("<couldn't get source>")
+        expected = ["'%s'" % reason for reason in self.errorinformation.failure_reasons]
+        if len(expected) > 1:
+            result.append("ParseError: expected %s or %s" % (
+                ", ".join(expected[:len(expected) - 1]), expected[len(expected) - 1]))
+        else:
+            result.append("ParseError: expected %s" % expected[0])
+        return "\n".join(result)
+
+class Lexer(object):
+
+    def __init__(self, source):
+        self.source = source
+        self.i = 0
+        self.lineno = 0
+        self.columnno = 0
+
+    def tokenize(self):
+        tokens = []
+        source = self.source
+        while True:
+            self.skip_whitespace()
+            if self.i >= len(source):
+                break
+            start = self.i
+            pos = SourcePos(self.i, self.lineno, self.columnno)
+            c = source[self.i]
+            if is_identifier_start(c):
+                end = self.i + 1
+                while end < len(source) and is_identifier_char(source[end]):
+                    end += 1
+                text = source[start:end]
+                name = TOKEN_NAMES[text] if text in KEYWORDS else 'IDENTIFIER'
+            elif is_digit(c) or (c == '-' and self.float_end(start + 1) > 0):
+                name, end = self.scan_number(start)
+            elif c == '"':
+                end = start + 1
+                while end < len(source) and source[end] != '"' and source[end] != '\\':
+                    end += 1
+                if end >= len(source) or source[end] != '"':
+                    raise LexerError(source, -1, pos)
+                end += 1
+                name = 'STRING_LITERAL'
+            elif c in OPERATOR_CHARS:
+                end = start + 1
+                if end < len(source) and source[start:end + 1] in TOKEN_NAMES:
+                    end += 1
+                name = TOKEN_NAMES[source[start:end]]
+            else:
+                raise LexerError(source, -1, pos)
+            assert end > start
+            tokens.append(Token(name, source[start:end], pos))
+            self.advance(end)
+        tokens.append(Token('EOF', 'EOF', SourcePos(self.i, self.lineno, self.columnno)))
+        return tokens
+
+    def skip_whitespace(self):
+        """Skip whitespace and comments, which run from '#' to the end of the line."""
+        source = self.source
+        end = self.i
+        while end < len(source):
+            c = source[end]
+            if c == '#':
+                while end < len(source) and source[end] != '\n':
+                    end += 1
+            elif c == ' ' or c == '\t' or c == '\r' or c == '\n':
+                end += 1
+            else:
+                break
+        self.advance(end)
+
+    def advance(self, end):
+        while self.i < end:
+            if self.source[self.i] == '\n':
+                self.lineno += 1
+                self.columnno = 0
+            else:
+                self.columnno += 1
+            self.i += 1
+
+    def digits_end(self, i, lo, hi):
+        while i < len(self.source) and lo <= self.source[i] <= hi:
+            i += 1
+        return i
+
+    def integer_end(self, i):
+        """End of ``0|[1-9][0-9]*`` at ``i``, or -1."""
+        if i >= len(self.source) or not is_digit(self.source[i]):
+            return -1
+        if self.source[i] == '0':
+            return i + 1
+        return self.digits_end(i, '0', '9')
+
+    def float_end(self, i):
+        """End of a float literal without its sign at ``i``, or -1."""
+        end = self.integer_end(i)
+        if end < 0 or end + 1 >= len(self.source) or self.source[end] != '.' \
+                or not is_digit(self.source[end + 1]):
+            return -1
+        end = self.digits_end(end + 1, '0', '9')
+        if end < len(self.source) and self.source[end] in 'eE':
+            exponent = end + 1
+            if exponent < len(self.source) and self.source[exponent] in '+-':
+                exponent += 1
+            if exponent < len(self.source) and is_digit(self.source[exponent]):
+                end = self.digits_end(exponent, '0', '9')
+        return end
+
+    def scan_number(self, start):
+        source = self.source
+        if source[start] == '-':
+            return 'FLOAT_LITERAL', self.float_end(start + 1)
+        end = self.float_end(start)
+        if end > 0:
+            return 'FLOAT_LITERAL', end
+        if source[start] == '0' and start + 2 < len(source):
+            prefix = source[start + 1]
+            if prefix in 'oO' and '0' <= source[start + 2] <= '7':
+                return 'OCTAL_LITERAL', self.digits_end(start + 2, '0', '7')
+            if prefix in 'bB' and '0' <= source[start + 2] <= '1':
+                return 'BIN_LITERAL', self.digits_end(start + 2, '0', '1')
+            if prefix in 'xX' and self.hex_end(start + 2) > start + 2:
+                return 'HEX_LITERAL', self.hex_end(start + 2)
+        return 'DECIMAL_LITERAL', self.integer_end(start)
+
+    def hex_end(self, i):
+        while i < len(self.source) and (is_digit(self.source[i]) or
+                                        'a' <= self.source[i] <= 'f' or
+                                        'A' <= self.source[i] <= 'F'):
+            i += 1
+        return i
+
+# Binary operator levels from the loosest to the tightest binding. Each
+# level becomes a node named after it holding its operands, and also its
+# operators if ``keeps_operators``.
+class BinaryLevel(object):
+
+    def __init__(self, symbol, operators, keeps_operators):
+        self.symbol = symbol
+        self.operators = operators
+        self.keeps_operators = keeps_operators
+
+BINARY_LEVELS = [
+    BinaryLevel('or_expr', ['|'], False),
+    BinaryLevel('xor_expr', ['^'], False),
+    BinaryLevel('and_expr', ['&'], False),
+    BinaryLevel('shift_expr', ['<<', '>>'], True),
+    BinaryLevel('arith_expr', ['+', '-'], True),
+    BinaryLevel('term', ['*', '/', '%'], True),
+]
+
+COMPARISON_OPERATORS = ['==', '!=', '<', '<=', '>', '>=', 'in']
+FACTOR_OPERATORS = ['+', '-', '~']
+LITERAL_TOKENS = ['DECIMAL_LITERAL', 'OCTAL_LITERAL', 'HEX_LITERAL', 'BIN_LITERAL',
+                  'FLOAT_LITERAL', 'STRING_LITERAL']
+
+class Parser(object):
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    # tokens
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        if index >= len(self.tokens):
+            index = len(self.tokens) - 1
+        return self.tokens[index]
+
+    def at(self, literal):
+        return self.peek().name == TOKEN_NAMES[literal]
+
+    def at_any(self, literals):
+        for literal in literals:
+            if self.at(literal):
+                return True
+        return False
+
+    def error(self, expected):
+        token = self.peek()
+        return ParseError(token.source_pos, ErrorInformation(self.pos, expected))
+
+    def expect(self, literal):
+        if not self.at(literal):
+            raise self.error([literal])
+        self.pos += 1
+
+    def symbol(self):
+        token = self.peek()
+        self.pos += 1
+        return Symbol(token.name, token.source, token)
+
+    def identifier(self):
+        if self.peek().name != 'IDENTIFIER':
+            raise self.error(['IDENTIFIER'])
+        return self.symbol()
+
+    def string(self):
+        if self.peek().name != 'STRING_LITERAL':
+            raise self.error(['STRING_LITERAL'])
+        return self.symbol()
+
+    def identifiers(self, symbol):
+        names = [self.identifier()]
+        while self.at(','):
+            self.pos += 1
+            names.append(self.identifier())
+        return Nonterminal(symbol, names)
+
+    # module
+
+    def parse_main(self):
+        children = []
+        while self.at('import'):
+            children.append(self.parse_import())
+        while not self.at('export') and self.peek().name != 'EOF':
+            children.append(self.parse_statement())
+        if self.at('export'):
+            children.append(self.parse_export())
+        if self.peek().name != 'EOF':
+            raise self.error(['EOF'])
+        return Nonterminal('main', children)
+
+    def parse_import(self):
+        self.expect('import')
+        if self.peek().name == 'STRING_LITERAL':
+            node = Nonterminal('import_module', [self.string()])
+        else:
+            members = self.identifiers('import_members')
+            self.expect('from')
+            node = Nonterminal('import_members_from_module', [members, self.string()])
+        self.expect(';')
+        return node
+
+    def parse_export(self):
+        self.expect('export')
+        if self.at('*'):
+            self.pos += 1
+            self.expect('as')
+            node = Nonterminal('export_all_members_as_module', [self.string()])
+        else:
+            members = self.identifiers('export_members')
+            self.expect('as')
+            node = Nonterminal('export_selected_members_as_module', [members, self.string()])
+        self.expect(';')
+        return node
+
+    # statements
+
+    def parse_statement(self):
+        if self.at('if') or self.at('do'):
+            return self.parse_guarded()
+        elif self.at('for'):
+            return self.parse_for()
+        elif self.at('def') and self.peek(1).name == 'IDENTIFIER':
+            return self.parse_def()
+        elif self.at('pass'):
+            self.pos += 1
+            node = Nonterminal('pass', [])
+        elif self.at('return'):
+            self.pos += 1
+            children = [] if self.at(';') else [self.parse_expression()]
+            node = Nonterminal('return', children)
+        elif self.at('abort'):
+            self.pos += 1
+            node = Nonterminal('abort', [self.parse_expression()])
+        elif self.at('del'):
+            self.pos += 1
+            children = [self.identifier(), self.parse_selector()]
+            while self.at('.') or self.at('['):
+                children.append(self.parse_selector())
+            node = Nonterminal('unbound', children)
+        elif self.at('{') or self.peek().name == 'IDENTIFIER':
+            # An expression statement is tried first, as in the grammar:
+            # '{' may start an object literal or a block, and an
+            # identifier an expression or the target of an assignment.
+            start = self.pos
+            try:
+                return self.parse_expression_statement()
+            except ParseError as e:
+                self.pos = start
+                try:
+                    if self.at('{'):
+                        return self.parse_block()
+                    node = self.parse_assignment()
+                except ParseError as other:
+                    if other.errorinformation.pos >= e.errorinformation.pos:
+                        raise
+                    raise e
+        else:
+            return self.parse_expression_statement()
+        self.expect(';')
+        return node
+
+    def parse_expression_statement(self):
+        node = Nonterminal('statement', [self.parse_expression()])
+        self.expect(';')
+        return node
+
+    def parse_assignment(self):
+        children = [self.identifier()]
+        while self.at('.') or self.at('['):
+            children.append(self.parse_selector())
+        left = Nonterminal('assignment_left', children)
+        self.expect('=')
+        return Nonterminal('assignment', [left, self.parse_expression()])
+
+    def parse_block(self):
+        self.expect('{')
+        statements = [self.parse_statement()]
+        while not self.at('}'):
+            statements.append(self.parse_statement())
+        self.pos += 1
+        return Nonterminal('block', statements)
+
+    def parse_guarded(self):
+        symbol = 'if' if self.at('if') else 'do'
+        self.pos += 1
+        commands = [self.parse_guardcommand()]
+        while self.at('('):
+            commands.append(self.parse_guardcommand())
+        return Nonterminal(symbol, commands)
+
+    def parse_guardcommand(self):
+        self.expect('(')
+        guard = self.parse_expression()
+        self.expect(')')
+        return Nonterminal('guardcommand', [guard, self.parse_block()])
+
+    def parse_for(self):
+        self.expect('for')
+        self.expect('(')
+        target = self.identifier()
+        self.expect('in')
+        iterable = self.parse_expression()
+        self.expect(')')
+        return Nonterminal('for', [target, iterable, self.parse_block()])
+
+    def parse_def(self):
+        self.expect('def')
+        name = self.identifier()
+        self.expect('(')
+        if self.at(')'):
+            arguments = Nonterminal('def_arguments', [])
+        else:
+            arguments = self.identifiers('def_arguments')
+        self.expect(')')
+        return Nonterminal('def', [name, arguments, self.parse_block()])
+
+    # expressions
+
+    def parse_expression(self):
+        return self.parse_logical('or_test', '||')
+
+    def parse_logical(self, symbol, operator):
+        if symbol == 'or_test':
+            first = self.parse_logical('and_test', '&&')
+        else:
+            first = self.parse_not_test()
+        if not self.at(operator):
+            return first
+        children = [first]
+        while self.at(operator):
+            self.pos += 1
+            if symbol == 'or_test':
+                children.append(self.parse_logical('and_test', '&&'))
+            else:
+                children.append(self.parse_not_test())
+        return Nonterminal(symbol, children)
+
+    def parse_not_test(self):
+        if self.at('!'):
+            self.pos += 1
+            return Nonterminal('not_test', [self.parse_not_test()])
+        left = self.parse_binary(0)
+        if not self.at_any(COMPARISON_OPERATORS):
+            return left
+        op = self.symbol()
+        return Nonterminal('comparison', [left, op, self.parse_binary(0)])
+
+    def parse_binary(self, level):
+        if level == len(BINARY_LEVELS):
+            return self.parse_factor()
+        info = BINARY_LEVELS[level]
+        first = self.parse_binary(level + 1)
+        if not self.at_any(info.operators):
+            return first
+        children = [first]
+        while self.at_any(info.operators):
+            if info.keeps_operators:
+                children.append(self.symbol())
+            else:
+                self.pos += 1
+            children.append(self.parse_binary(level + 1))
+        return Nonterminal(info.symbol, children)
+
+    def parse_factor(self):
+        if self.at_any(FACTOR_OPERATORS):
+            op = self.symbol()
+            return Nonterminal('factor', [op, self.parse_factor()])
+        atom = self.parse_atom()
+        if not (self.at('.') or self.at('[') or self.at('(')):
+            return atom
+        children = [atom]
+        while self.at('.') or self.at('[') or self.at('('):
+            if self.at('('):
+                self.pos += 1
+                if self.at(')'):
+                    children.append(Nonterminal('primary_expression_rest', []))
+                else:
+                    children.append(self.parse_expressions('arguments'))
+                self.expect(')')
+            else:
+                children.append(self.parse_selector())
+        return Nonterminal('primary_expression', children)
+
+    def parse_selector(self):
+        if self.at('.'):
+            self.pos += 1
+            return Nonterminal('identifier_selector', [self.identifier()])
+        self.expect('[')
+        index = self.parse_expression()
+        self.expect(']')
+        return Nonterminal('index_selector', [index])
+
+    def parse_expressions(self, symbol):
+        expressions = [self.parse_expression()]
+        while self.at(','):
+            self.pos += 1
+            expressions.append(self.parse_expression())
+        return Nonterminal(symbol, expressions)
+
+    def parse_atom(self):
+        name = self.peek().name
+        if name == 'IDENTIFIER' or name in LITERAL_TOKENS:
+            return self.symbol()
+        elif self.at('null'):
+            return Nonterminal('null_literal', [self.symbol()])
+        elif self.at('true') or self.at('false'):
+            return Nonterminal('boolean_literal', [self.symbol()])
+        elif self.at('['):
+            self.pos += 1
+            if self.at(']'):
+                self.pos += 1
+                return Nonterminal('array_literal', [])
+            node = self.parse_expressions('array_literal')
+            self.expect(']')
+            return node
+        elif self.at('{'):
+            return self.parse_object()
+        elif self.at('('):
+            self.pos += 1
+            node = self.parse_expression()
+            self.expect(')')
+            return node
+        elif self.at('def'):
+            return self.parse_closure()
+        raise self.error(['expression'])
+
+    def parse_object(self):
+        self.expect('{')
+        entries = []
+        if not self.at('}'):
+            entries.append(self.parse_object_entry())
+            while self.at(','):
+                if self.peek(1).name == TOKEN_NAMES['}']:
+                    # the grammar keeps a trailing comma in the tree
+                    entries.append(self.symbol())
+                    break
+                self.pos += 1
+                entries.append(self.parse_object_entry())
+        self.expect('}')
+        return Nonterminal('object_literal', entries)
+
+    def parse_object_entry(self):
+        if self.peek().name == 'STRING_LITERAL':
+            symbol = 'object_string_entry'
+        elif self.peek().name == 'IDENTIFIER':
+            symbol = 'object_identifier_entry'
+        else:
+            raise self.error(['IDENTIFIER', 'STRING_LITERAL'])
+        key = self.symbol()
+        self.expect(':')
+        if self.at('def'):
+            value = self.parse_closure()
+        else:
+            value = self.parse_expression()
+        return Nonterminal(symbol, [key, value])
+
+    def parse_closure(self):
+        self.expect('def')
+        self.expect('(')
+        args = self.identifiers('args')
+        self.expect(')')
+        return Nonterminal('closure', [args, self.parse_block()])
+
+def parse(source):
+    """Parse ``source`` into a tree; raises ParseError or LexerError."""
+    return Parser(Lexer(source).tokenize()).parse_main()
+
+def parse_source(filename, source):
+    try:
+        return parse(source)
+    except ParseError as e:
+        print(e.nice_error_message(filename, source))
+        raise
+    except LexerError as e:
+        print(e.nice_error_message(filename))
+        raise
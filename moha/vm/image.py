@@ -0,0 +1,264 @@
+# -*- coding: utf-8 -*-
+"""Heap images of the module registry.
+
+``moha --snapshot=<image> warmup.mo`` runs a warm-up script and writes
+every module it loaded, the script included, to an image: their export
+tables, exported values and, through the functions they define, their
+bytecode and module globals. ``moha --image=<image> main.mo`` reads the
+image back into ``sys.modules`` before running, so imports of those
+modules are satisfied without reading, compiling or executing anything.
+
+The image uses the item encoding of artifacts. Objects, arrays,
+functions, modules, globals and bytecode are numbered when first written
+and referenced by number afterwards, so sharing and cycles survive.
+"""
+
+from moha.vm.artifact import Writer, Reader, ArtifactError, write_bytecode, read_bytecode, source_stamp
+from moha.vm.objects import LazyImport, Globals, Function, Memo, Module, ExportTable
+from moha.vm.objects import Object, Array, String, Integer, Boolean, Null
+from moha.vm.utils import SortedSet, read_file, write_file
+
+MAGIC = 'MOHA-IMAGE'
+FORMAT = 3
+
+class ImageWriter(object):
+
+    def __init__(self):
+        self.w = Writer()
+        self.objects = {}
+        self.globals = {}
+        self.bytecodes = {}
+
+    def first_visit(self, obj):
+        """Write a reference and return False if ``obj`` has been written already."""
+        if obj in self.objects:
+            self.w.str('r')
+            self.w.int(self.objects[obj])
+            return False
+        self.objects[obj] = len(self.objects)
+        return True
+
+    def value(self, w_value):
+        if isinstance(w_value, LazyImport):
+            w_value = w_value.resolve()
+        w = self.w
+        if w_value is None:
+            w.str('u')
+        elif isinstance(w_value, Integer):
+            w.str('i')
+            w.int(w_value.intval)
+        elif isinstance(w_value, String):
+            w.str('s')
+            w.str(w_value.strval)
+        elif isinstance(w_value, Boolean):
+            w.str('b')
+            w.int(1 if w_value.boolval else 0)
+        elif isinstance(w_value, Null):
+            w.str('n')
+        elif isinstance(w_value, Array):
+            if self.first_visit(w_value):
+                w.str('a')
+                w.int(len(w_value.array))
+                for item in w_value.array:
+                    self.value(item)
+        elif isinstance(w_value, Module):
+            if self.first_visit(w_value):
+                w.str('m')
+                w.str(w_value.exports.name)
+                w.strs(w_value.exports.names)
+                w.ints(w_value.exports.slots)
+                for item in w_value.values:
+                    self.value(item)
+        elif isinstance(w_value, Memo) or (isinstance(w_value, Function) and w_value.is_instancefunc()):
+            raise Exception("cannot snapshot %s" % w_value.str())
+        elif isinstance(w_value, Function):
+            if self.first_visit(w_value):
+                self.function(w_value)
+        elif isinstance(w_value, Object):
+            if self.first_visit(w_value):
+                w.str('o')
+                w.int(len(w_value.dictionary))
+                for key, item in w_value.dictionary.iteritems():
+                    w.str(key)
+                    self.value(item)
+        else:
+            raise Exception("cannot snapshot %s" % w_value.str())
+
+    def function(self, w_func):
+        w = self.w
+        if w_func.interpfunc:
+            w.str('B')
+            w.str(w_func.interpfunc)
+            return
+        w.str('f')
+        self.bytecode(w_func.get_bytecode())
+        self.module_globals(w_func.globals)
+        self.value(w_func.obj)
+
+    def bytecode(self, bc):
+        if bc in self.bytecodes:
+            self.w.int(self.bytecodes[bc])
+            return
+        self.bytecodes[bc] = len(self.bytecodes)
+        self.w.int(-1)
+        self.w.str(bc.filename)
+        write_bytecode(self.w, bc)
+
+    def module_globals(self, globals):
+        w = self.w
+        if globals is None:
+            w.int(-2)
+        elif globals in self.globals:
+            w.int(self.globals[globals])
+        else:
+            self.globals[globals] = len(self.globals)
+            w.int(-1)
+            w.strs(globals.names.keys)
+            w.int(len(globals.values))
+            for item in globals.values:
+                self.value(item)
+
+def check_reference(index, count):
+    if index >= count:
+        raise ArtifactError("reference to an unknown item in image")
+    return index
+
+class ImageReader(object):
+
+    def __init__(self, data, pos):
+        self.r = Reader(data, pos)
+        self.objects = []
+        self.globals = []
+        self.bytecodes = []
+
+    def value(self):
+        r = self.r
+        tag = r.str()
+        if tag == 'u':
+            return None
+        elif tag == 'i':
+            return Integer(r.int())
+        elif tag == 's':
+            return String(r.str())
+        elif tag == 'b':
+            return Boolean.from_raw(r.int() != 0)
+        elif tag == 'n':
+            return Null.singleton()
+        elif tag == 'r':
+            return self.objects[check_reference(r.int(), len(self.objects))]
+        elif tag == 'a':
+            array = Array()
+            self.objects.append(array)
+            for _ in range(r.int()):
+                array.array.append(self.value())
+            return array
+        elif tag == 'm':
+            name = r.str()
+            names = r.strs()
+            exports = ExportTable(name, names, r.ints())
+            module = Module(exports, [None] * len(names))
+            self.objects.append(module)
+            for index in range(len(names)):
+                module.values[index] = self.value()
+            return module
+        elif tag == 'B':
+            w_func = Function(None, r.str())
+            self.objects.append(w_func)
+            return w_func
+        elif tag == 'f':
+            w_func = Function()
+            self.objects.append(w_func)
+            w_func.bytecode = self.bytecode()
+            w_func.globals = self.module_globals()
+            w_value = self.value()
+            if w_value is not None:
+                w_func.obj = w_value
+            return w_func
+        elif tag == 'o':
+            obj = Object()
+            self.objects.append(obj)
+            for _ in range(r.int()):
+                key = r.str()
+                obj.dictionary[key] = self.value()
+            return obj
+        raise ArtifactError("unknown value in image: %s" % tag)
+
+    def bytecode(self):
+        index = self.r.int()
+        if index >= 0:
+            return self.bytecodes[check_reference(index, len(self.bytecodes))]
+        filename = self.r.str()
+        bc = read_bytecode(self.r, filename)
+        self.bytecodes.append(bc)
+        return bc
+
+    def module_globals(self):
+        index = self.r.int()
+        if index == -2:
+            return None
+        if index >= 0:
+            return self.globals[check_reference(index, len(self.globals))]
+        names = SortedSet()
+        for name in self.r.strs():
+            names.add(name)
+        globals = Globals(names, [None] * self.r.int())
+        self.globals.append(globals)
+        for slot in range(len(globals.values)):
+            globals.values[slot] = self.value()
+        return globals
+
+def write_image(sys, path):
+    """Write the modules of ``sys.modules`` to the image file ``path``."""
+    writer = ImageWriter()
+    paths = sys.modules.keys()
+    writer.w.int(len(paths))
+    for module_path in paths:
+        mtime, size = source_stamp(module_path)
+        writer.w.str(module_path)
+        writer.w.int(mtime)
+        writer.w.int(size)
+        writer.value(sys.modules[module_path])
+    write_file(path, '%s %d\n%s' % (MAGIC, FORMAT, writer.w.getvalue()))
+
+def read_image(sys, path):
+    """Register the modules of the image file ``path`` in ``sys.modules``.
+
+    Returns False, registering nothing, if the image cannot be read, is
+    damaged or of another format, or one of its modules has changed since
+    it was written.
+    """
+    try:
+        data = read_file(path)
+    except OSError:
+        return False
+    end = data.find('\n')
+    if end < 0 or data[0:end] != '%s %d' % (MAGIC, FORMAT):
+        return False
+    try:
+        modules = read_modules(ImageReader(data, end + 1))
+    except ArtifactError:
+        return False
+    if modules is None:
+        return False
+    for module_path, module in modules.iteritems():
+        sys.modules[module_path] = module
+    return True
+
+def read_modules(reader):
+    """The modules of an image by path, or None if one of them has changed."""
+    modules = {}
+    for _ in range(reader.r.int()):
+        module_path = reader.r.str()
+        mtime = reader.r.int()
+        size = reader.r.int()
+        try:
+            stamp = source_stamp(module_path)
+        except OSError:
+            return None
+        if stamp[0] != mtime or stamp[1] != size:
+            return None
+        module = reader.value()
+        if not isinstance(module, Module):
+            raise ArtifactError("not a module in image")
+        modules[module_path] = module
+    return modules
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+from rpython.rlib.jit import JitHookInterface
+
+class LoopStats(object):
+
+    def __init__(self, location):
+        self.location = location
+        self.traces = 0
+        self.bridges = 0
+        self.aborts = 0
+
+class JitStats(object):
+    """Per source loop counters collected from the JIT hooks.
+
+    Loops are keyed by ``printable_loc`` of the loop header, which names its
+    file, line, function and pc. Bridges are
+    compiled for guards that fail often, so they are attributed to the
+    loop that owns the failing guard.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.loops = {}
+        self.locations = {}
+        self.traces = 0
+        self.bridges = 0
+        self.aborts = 0
+
+    def get(self, location):
+        try:
+            return self.loops[location]
+        except KeyError:
+            stats = LoopStats(location)
+            self.loops[location] = stats
+            return stats
+
+    def on_trace(self, number, location):
+        self.traces += 1
+        self.locations[number] = location
+        self.get(location).traces += 1
+
+    def on_bridge(self, number):
+        self.bridges += 1
+        location = self.locations.get(number, '?')
+        self.get(location).bridges += 1
+
+    def on_abort(self, location):
+        self.aborts += 1
+        self.get(location).aborts += 1
+
+    def report(self):
+        lines = ['jit: %d traces, %d bridges, %d aborts' % (self.traces, self.bridges, self.aborts)]
+        for location, stats in self.loops.iteritems():
+            lines.append('  %s: %d traces, %d bridges, %d aborts' % (
+                location, stats.traces, stats.bridges, stats.aborts))
+        return '\n'.join(lines)
+
+jit_stats = JitStats()
+
+class MohaJitHooks(JitHookInterface):
+
+    def after_compile(self, debug_info):
+        if jit_stats.enabled:
+            jit_stats.on_trace(debug_info.looptoken.number, debug_info.get_greenkey_repr())
+
+    def after_compile_bridge(self, debug_info):
+        if jit_stats.enabled:
+            jit_stats.on_bridge(debug_info.looptoken.number)
+
+    def on_abort(self, reason, jitdriver, greenkey, greenkey_repr, logops, operations):
+        if jit_stats.enabled:
+            jit_stats.on_abort(greenkey_repr)
+
+jit_hooks = MohaJitHooks()
@@ -1,10 +1,30 @@
 # -*- coding: utf-8 -*-
 
+from rpython.rlib import jit
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.objectmodel import compute_hash, compute_identity_hash
+from rpython.rlib.rarithmetic import intmask
+
 from moha.vm import code as Code
+from moha.vm.allocstats import count_alloc
+from moha.vm.utils import LRUCache
 
 class W_Root(object):
     def str(self):
         return ''
+    def hash(self):
+        return compute_identity_hash(self)
+    def equals(self, other):
+        """Value equality used for hashing, e.g. by memo()."""
+        return self is other
+    def iter(self):
+        raise Exception("%s is not iterable" % self.str())
+    def method(self, key):
+        """Native method named ``key`` shared by every instance, or None.
+
+        It takes the instance as its first argument.
+        """
+        return None
 
 class Type(object):
     def __init__(self, typeval):
@@ -18,6 +38,9 @@ class Null(W_Root):
     def __repr__(self):
         return 'null'
 
+    def hash(self):
+        return 0
+
     @classmethod
     def singleton(cls):
         return null
@@ -26,6 +49,7 @@ null = Null()
 
 class Boolean(W_Root):
     def __init__(self, boolval):
+        count_alloc('Boolean')
         self.boolval = boolval
     def str(self):
         return 'true' if self.boolval else 'false'
@@ -35,6 +59,8 @@ class Boolean(W_Root):
         return Boolean.from_raw(self.boolval == other.boolval)
     def is_true(self):
         return self.boolval
+    def hash(self):
+        return 1 if self.boolval else 2
     @classmethod
     def from_raw(cls, b):
         if b:
@@ -50,8 +76,10 @@ def length_string(string):
     return string.length()
 
 class Object(W_Root):
-    def __init__(self):
-        self.dictionary = {}
+    def __init__(self, dictionary=None):
+        count_alloc('Object')
+        count_alloc('dict')
+        self.dictionary = dictionary if dictionary is not None else {}
     def build_map(self, data):
         size = len(data) / 2
         kv = {}
@@ -65,11 +93,35 @@ class Object(W_Root):
         return Boolean.from_raw(key.str() in self.dictionary)
     def delete(self, key):
         del self.dictionary[key.str()]
+    def iter(self):
+        return KeyIterator(self.dictionary.keys())
     def str(self):
         return '{%s}' % ','.join(['%s:%s' % (key, value.str()) for key, value in self.dictionary.iteritems()])
 
+class ObjectTemplate(W_Root):
+    """Keys of an object literal, known at compile time.
+
+    ``layout`` maps every key to null. Copying it allocates a dictionary
+    with room for all keys, which is then filled without resizing.
+    """
+    _immutable_fields_ = ['keys[*]']
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.layout = {}
+        for key in keys:
+            self.layout[key] = null
+
+    def instantiate(self):
+        return Object(self.layout.copy())
+
+    def str(self):
+        return '<template %s>' % ','.join(self.keys)
+
 class String(Object):
     def __init__(self, strval):
+        count_alloc('String')
+        count_alloc('dict')
         self.strval = strval
         self.dictionary = {'index': Function(None, None, instancefunc_2=index_string),
                 'length': Function(None, None, instancefunc_1=length_string),
@@ -81,8 +133,22 @@ class String(Object):
         return Integer(len(self.strval))
     def eq(self, other):
         return Boolean.from_raw(self.strval == other.str())
+    def lt(self, other):
+        if not isinstance(other, String):
+            raise Exception("wrong type")
+        return Boolean.from_raw(self.strval < other.strval)
+    def gt(self, other):
+        if not isinstance(other, String):
+            raise Exception("wrong type")
+        return Boolean.from_raw(self.strval > other.strval)
     def add(self, other):
         return String(self.strval + other.str())
+    def hash(self):
+        return compute_hash(self.strval)
+    def equals(self, other):
+        return isinstance(other, String) and self.strval == other.strval
+    def iter(self):
+        return StringIterator(self.strval)
 
     def __repr__(self):
         return "%s" % self.strval
@@ -100,19 +166,192 @@ def index_array(array, index):
     return array.index(index)
 def length_array(array):
     return array.length()
+def sort_array(array):
+    return array.sort()
+def sum_array(array):
+    return array.sum()
+def min_array(array):
+    return array.min()
+def max_array(array):
+    return array.max()
+def dot_array(array, other):
+    return array.dot(other)
+def add_array(array, other):
+    return array.elementwise_add(other)
+def mul_array(array, other):
+    return array.elementwise_mul(other)
+def fill_array(array, value):
+    return array.fill(value)
+
+def _int_lt(a, b):
+    assert isinstance(a, Integer) and isinstance(b, Integer)
+    return a.intval < b.intval
+
+def _string_lt(a, b):
+    assert isinstance(a, String) and isinstance(b, String)
+    return a.strval < b.strval
+
+def _value_lt(a, b):
+    return a.lt(b).is_true()
+
+IntegerSort = make_timsort_class(lt=_int_lt)
+StringSort = make_timsort_class(lt=_string_lt)
+ValueSort = make_timsort_class(lt=_value_lt)
+
+class SortItem(object):
+    """An array element decorated with its precomputed sort key."""
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+
+def _item_int_lt(a, b):
+    return _int_lt(a.key, b.key)
+
+def _item_string_lt(a, b):
+    return _string_lt(a.key, b.key)
+
+def _item_value_lt(a, b):
+    return _value_lt(a.key, b.key)
+
+ItemIntegerSort = make_timsort_class(lt=_item_int_lt)
+ItemStringSort = make_timsort_class(lt=_item_string_lt)
+ItemValueSort = make_timsort_class(lt=_item_value_lt)
+
+def all_instances(values, cls):
+    for value in values:
+        if not isinstance(value, cls):
+            return False
+    return True
+
+def sort_values(values):
+    """Sort a list of W_Root in place. The sort is stable.
+
+    Arrays of integers or of strings compare their raw values directly;
+    anything else goes through ``lt``.
+    """
+    if all_instances(values, Integer):
+        IntegerSort(values).sort()
+    elif all_instances(values, String):
+        StringSort(values).sort()
+    else:
+        ValueSort(values).sort()
+
+def sort_values_by_keys(values, keys):
+    """Sort ``values`` in place by the parallel list ``keys``. The sort is stable."""
+    items = [SortItem(keys[i], values[i]) for i in range(len(values))]
+    if all_instances(keys, Integer):
+        ItemIntegerSort(items).sort()
+    elif all_instances(keys, String):
+        ItemStringSort(items).sort()
+    else:
+        ItemValueSort(items).sort()
+    for i in range(len(items)):
+        values[i] = items[i].value
+
+def min_int(values):
+    result = 0
+    index = 0
+    while index < len(values):
+        value = values[index]
+        assert isinstance(value, Integer)
+        if index == 0 or value.intval < result:
+            result = value.intval
+        index += 1
+    return result
+
+def max_int(values):
+    result = 0
+    index = 0
+    while index < len(values):
+        value = values[index]
+        assert isinstance(value, Integer)
+        if index == 0 or value.intval > result:
+            result = value.intval
+        index += 1
+    return result
+
+def dot_int(left, right):
+    total = 0
+    index = 0
+    while index < len(left):
+        a = left[index]
+        b = right[index]
+        assert isinstance(a, Integer) and isinstance(b, Integer)
+        total += a.intval * b.intval
+        index += 1
+    return total
+
+def elementwise_add(values, other):
+    """``values[i] + other[i]`` for an array ``other``, ``values[i] + other`` otherwise."""
+    length = len(values)
+    result = [None] * length
+    index = 0
+    if isinstance(other, Array):
+        while index < length:
+            a = values[index]
+            b = other.array[index]
+            if isinstance(a, Integer) and isinstance(b, Integer):
+                result[index] = Integer(a.intval + b.intval)
+            else:
+                result[index] = a.add(b)
+            index += 1
+    elif isinstance(other, Integer):
+        scalar = other.intval
+        while index < length:
+            a = values[index]
+            if isinstance(a, Integer):
+                result[index] = Integer(a.intval + scalar)
+            else:
+                result[index] = a.add(other)
+            index += 1
+    else:
+        while index < length:
+            result[index] = values[index].add(other)
+            index += 1
+    return result
+
+def elementwise_mul(values, other):
+    """``values[i] * other[i]`` for an array ``other``, ``values[i] * other`` otherwise."""
+    length = len(values)
+    result = [None] * length
+    index = 0
+    if isinstance(other, Array):
+        while index < length:
+            a = values[index]
+            b = other.array[index]
+            if isinstance(a, Integer) and isinstance(b, Integer):
+                result[index] = Integer(a.intval * b.intval)
+            else:
+                result[index] = a.mul(b)
+            index += 1
+    elif isinstance(other, Integer):
+        scalar = other.intval
+        while index < length:
+            a = values[index]
+            if isinstance(a, Integer):
+                result[index] = Integer(a.intval * scalar)
+            else:
+                result[index] = a.mul(other)
+            index += 1
+    else:
+        while index < length:
+            result[index] = values[index].mul(other)
+            index += 1
+    return result
 
 class Array(Object):
     def __init__(self, array=None):
+        count_alloc('Array')
+        count_alloc('dict')
         self.array = array or []
-        self.dictionary = {'push': Function(None, None, instancefunc_2=push_array),
-                'pop': Function(None, None, instancefunc_1=pop_array),
-                'index': Function(None, None, instancefunc_2=index_array),
-                'length': Function(None, None, instancefunc_1=length_array),
-                }
+        self.dictionary = {}
     def get(self, i):
         if isinstance(i, Integer):
             return self.index(i)
-        return self.dictionary[i.str()]
+        # Methods are shared by all arrays and bound on access.
+        return array_methods[i.str()].bind(self)
+    def method(self, key):
+        return array_methods.get(key.str(), None)
     def copy(self, array):
         for item in array:
             self.array.append(item)
@@ -125,6 +364,8 @@ class Array(Object):
         return self.array.pop()
     def has(self, elem):
         return Boolean.from_raw(elem in self.array)
+    def iter(self):
+        return ArrayIterator(self.array)
     def eq(self, other):
         if not isinstance(other, Array):
             return Boolean.from_raw(False)
@@ -136,15 +377,184 @@ class Array(Object):
         return Boolean.from_raw(True)
     def length(self):
         return Integer(len(self.array))
+    def hash(self):
+        x = 0x345678
+        for elem in self.array:
+            x = intmask((x * 1000003) ^ elem.hash())
+        return x
+    def equals(self, other):
+        if not isinstance(other, Array) or len(other.array) != len(self.array):
+            return False
+        for index, elem in enumerate(self.array):
+            if not elem.equals(other.array[index]):
+                return False
+        return True
+    def sort(self):
+        sort_values(self.array)
+        return Null.singleton()
+
+    # Bulk numeric operations. Arrays of integers are processed with raw
+    # machine integers and only the result is boxed; other element types
+    # fall back to the generic add/mul/lt/gt protocol.
+
+    def sum(self):
+        values = self.array
+        total = 0
+        index = 0
+        while index < len(values):
+            value = values[index]
+            if not isinstance(value, Integer):
+                return self.generic_sum(Integer(total), index)
+            total += value.intval
+            index += 1
+        return Integer(total)
+    def generic_sum(self, acc, index):
+        values = self.array
+        if index == 0 and values:
+            acc = values[0]
+            index = 1
+        while index < len(values):
+            acc = acc.add(values[index])
+            index += 1
+        return acc
+    def min(self):
+        values = self.array
+        if not values:
+            raise Exception("min() of empty array")
+        if all_instances(values, Integer):
+            return Integer(min_int(values))
+        result = values[0]
+        for value in values:
+            if value.lt(result).is_true():
+                result = value
+        return result
+    def max(self):
+        values = self.array
+        if not values:
+            raise Exception("max() of empty array")
+        if all_instances(values, Integer):
+            return Integer(max_int(values))
+        result = values[0]
+        for value in values:
+            if value.gt(result).is_true():
+                result = value
+        return result
+    def dot(self, other):
+        if not isinstance(other, Array):
+            raise Exception("dot() expects an array")
+        if len(self.array) != len(other.array):
+            raise Exception("dot() of arrays with different lengths")
+        if all_instances(self.array, Integer) and all_instances(other.array, Integer):
+            return Integer(dot_int(self.array, other.array))
+        return Array(elementwise_mul(self.array, other)).generic_sum(Integer(0), 0)
+    def elementwise_add(self, other):
+        if isinstance(other, Array) and len(self.array) != len(other.array):
+            raise Exception("add() of arrays with different lengths")
+        return Array(elementwise_add(self.array, other))
+    def elementwise_mul(self, other):
+        if isinstance(other, Array) and len(self.array) != len(other.array):
+            raise Exception("mul() of arrays with different lengths")
+        return Array(elementwise_mul(self.array, other))
+    def fill(self, value):
+        index = 0
+        while index < len(self.array):
+            self.array[index] = value
+            index += 1
+        return Null.singleton()
     def str(self):
         return '[%s]' % ','.join([a.str() for a in self.array])
     def set(self, key, value):
         self.array[key.intval] = value
 
 
+def map_iterator(iterator, fn):
+    return MapIterator(iterator, fn)
+def filter_iterator(iterator, fn):
+    return FilterIterator(iterator, fn)
+
+class Iterator(W_Root):
+    """Lazy iterator. ``next`` returns None once the iterator is exhausted.
+
+    ``ctx`` is the interpreter's execution context; iterators that apply
+    Moha functions call back into the interpreter through it.
+    """
+    def iter(self):
+        return self
+    def next(self, ctx):
+        return None
+    def get(self, key):
+        name = key.str()
+        if name == 'map':
+            return Function(None, None, instancefunc_2=map_iterator)
+        elif name == 'filter':
+            return Function(None, None, instancefunc_2=filter_iterator)
+        raise Exception("iterator has no attribute %s" % name)
+    def str(self):
+        return '<iterator>'
+
+class ArrayIterator(Iterator):
+    def __init__(self, array):
+        count_alloc('ArrayIterator')
+        self.array = array
+        self.index = 0
+    def next(self, ctx):
+        if self.index >= len(self.array):
+            return None
+        elem = self.array[self.index]
+        self.index += 1
+        return elem
+
+class StringIterator(Iterator):
+    def __init__(self, strval):
+        count_alloc('StringIterator')
+        self.strval = strval
+        self.index = 0
+    def next(self, ctx):
+        if self.index >= len(self.strval):
+            return None
+        char = self.strval[self.index]
+        self.index += 1
+        return String(char)
+
+class KeyIterator(Iterator):
+    def __init__(self, keys):
+        count_alloc('KeyIterator')
+        self.keys = keys
+        self.index = 0
+    def next(self, ctx):
+        if self.index >= len(self.keys):
+            return None
+        key = self.keys[self.index]
+        self.index += 1
+        return String(key)
+
+class MapIterator(Iterator):
+    def __init__(self, source, fn):
+        count_alloc('MapIterator')
+        self.source = source.iter()
+        self.fn = fn
+    def next(self, ctx):
+        elem = self.source.next(ctx)
+        if elem is None:
+            return None
+        return ctx.call(self.fn, [elem])
+
+class FilterIterator(Iterator):
+    def __init__(self, source, fn):
+        count_alloc('FilterIterator')
+        self.source = source.iter()
+        self.fn = fn
+    def next(self, ctx):
+        while True:
+            elem = self.source.next(ctx)
+            if elem is None or ctx.call(self.fn, [elem]).is_true():
+                return elem
+
+
 class Integer(W_Root):
 
     def __init__(self, intval):
+        count_alloc('Integer')
         self.intval = int(intval)
 
     def __repr__(self):
@@ -192,12 +602,19 @@ class Integer(W_Root):
     def is_true(self):
         return self.intval != 0
 
+    def hash(self):
+        return self.intval
+
+    def equals(self, other):
+        return isinstance(other, Integer) and self.intval == other.intval
+
     def str(self):
         return str(self.intval)
 
 
 class Float(W_Root):
     def __init__(self, floatval):
+        count_alloc('Float')
         assert(isinstance(floatval, float))
         self.floatval = floatval
 
@@ -210,11 +627,22 @@ class Float(W_Root):
     def neg(self):
         return Float(-1 * self.floatval)
 
+    def hash(self):
+        return compute_hash(self.floatval)
+
+    def equals(self, other):
+        return isinstance(other, Float) and self.floatval == other.floatval
+
     def add(self, other):
         if not isinstance(other, Float):
             raise Exception("wrong type")
         return Float(self.floatval + other.floatval)
 
+    def mul(self, other):
+        if not isinstance(other, Float):
+            raise Exception("wrong type")
+        return Float(self.floatval * other.floatval)
+
     def lt(self, other):
         if not isinstance(other, Float):
             raise Exception("wrong type")
@@ -232,9 +660,17 @@ class Float(W_Root):
         return str(self.floatval)
 
 class Function(W_Root):
+    """A callable: bytecode, a builtin, or a native instance method.
 
-    def __init__(self, bytecode=None, interpfunc=None, instancefunc_0=None, instancefunc_1=None, instancefunc_2=None, instancefunc_3=None, obj=None):
+    Functions defined in Moha source may start out with only ``body``, the
+    AST of their body, and are compiled on first call by ``get_bytecode``.
+    """
+
+    def __init__(self, bytecode=None, interpfunc=None, instancefunc_0=None, instancefunc_1=None, instancefunc_2=None, instancefunc_3=None, obj=None, body=None, globals=None):
+        count_alloc('Function')
         self.bytecode = bytecode
+        self.body = body
+        self.globals = globals
         self.interpfunc = interpfunc
         self.obj = obj
         self.instancefunc_0 = instancefunc_0
@@ -242,30 +678,225 @@ class Function(W_Root):
         self.instancefunc_2 = instancefunc_2
         self.instancefunc_3 = instancefunc_3
 
+    def get_bytecode(self):
+        if self.bytecode is None and self.body is not None:
+            self.bytecode = self.body.get_bytecode()
+            self.body = None
+        return self.bytecode
+
+    def bind(self, obj):
+        return Function(self.get_bytecode(), self.interpfunc, self.instancefunc_0,
+                        self.instancefunc_1, self.instancefunc_2, self.instancefunc_3, obj)
+
+    def is_instancefunc(self):
+        return bool(self.instancefunc_0 or self.instancefunc_1 or self.instancefunc_2 or self.instancefunc_3)
+
     def __repr__(self):
         return '<func>'
 
     def str(self):
         return '<func>'
 
+array_methods = {'push': Function(None, None, instancefunc_2=push_array),
+        'pop': Function(None, None, instancefunc_1=pop_array),
+        'index': Function(None, None, instancefunc_2=index_array),
+        'length': Function(None, None, instancefunc_1=length_array),
+        'sort': Function(None, None, instancefunc_1=sort_array),
+        'sum': Function(None, None, instancefunc_1=sum_array),
+        'min': Function(None, None, instancefunc_1=min_array),
+        'max': Function(None, None, instancefunc_1=max_array),
+        'dot': Function(None, None, instancefunc_2=dot_array),
+        'add': Function(None, None, instancefunc_2=add_array),
+        'mul': Function(None, None, instancefunc_2=mul_array),
+        'fill': Function(None, None, instancefunc_2=fill_array),
+        }
+
+class MemoKey(object):
+    """Call arguments compared by value."""
+
+    def __init__(self, args):
+        self.args = args
+        x = 0x345678
+        for arg in args:
+            x = intmask((x * 1000003) ^ arg.hash())
+        self.hashval = x
+
+def memo_key_eq(a, b):
+    if a.hashval != b.hashval or len(a.args) != len(b.args):
+        return False
+    for index, arg in enumerate(a.args):
+        if not arg.equals(b.args[index]):
+            return False
+    return True
+
+def memo_key_hash(key):
+    return key.hashval
+
+def memo_hits(memo):
+    return Integer(memo.hits)
+def memo_misses(memo):
+    return Integer(memo.misses)
+def memo_size(memo):
+    return Integer(memo.cache.size())
+def memo_clear(memo):
+    memo.cache.clear()
+    return Null.singleton()
+
+class Memo(Function):
+    """A function whose results are cached in a bounded LRU.
+
+    Arguments are hashed with value semantics, so equal integers, strings
+    and arrays share a cache entry.
+    """
+
+    def __init__(self, fn, capacity):
+        Function.__init__(self)
+        count_alloc('Memo')
+        self.fn = fn
+        self.cache = LRUCache(capacity, memo_key_eq, memo_key_hash)
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        result = self.cache.get(key)
+        if result is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return result
+
+    def get(self, key):
+        return memo_methods[key.str()].bind(self)
+
+    def method(self, key):
+        return memo_methods.get(key.str(), None)
+
+    def __repr__(self):
+        return '<memo>'
+
+    def str(self):
+        return '<memo>'
+
+memo_methods = {'hits': Function(None, None, instancefunc_1=memo_hits),
+        'misses': Function(None, None, instancefunc_1=memo_misses),
+        'size': Function(None, None, instancefunc_1=memo_size),
+        'clear': Function(None, None, instancefunc_1=memo_clear),
+        }
+
 class CallableArgs(W_Root):
 
     def __init__(self, args):
+        count_alloc('CallableArgs')
         self.args = args
 
+class LazyImport(W_Root):
+    """Placeholder bound by an import in --lazy-imports mode.
+
+    It stands for the member ``name`` of ``module``, itself usually a lazy
+    module (``LazyModule`` in ``runtime``). Loads of the variables an import
+    binds (``LOAD_IMPORT``), global loads and module member reads resolve
+    it, loading the module if needed, and overwrite the variable with the
+    result.
+    """
+
+    def __init__(self, module, name):
+        self.module = module
+        self.name = name
+
+    def resolve(self):
+        module = self.module
+        if isinstance(module, LazyImport):
+            module = module.resolve()
+        return module.get(self.name)
+
+class Globals(object):
+    """Top-level variables of a module, indexed by slot.
+
+    ``values`` is the variable list of the module's frame. ``versions``
+    has a counter per slot that changes whenever the slot is rebound, so
+    a cache of a global value only needs to compare the counter of its
+    slot, and rebinding one variable leaves the others' caches valid.
+    """
+    _immutable_fields_ = ['names', 'values', 'versions']
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+        self.versions = [0] * len(values)
+
+    def store(self, slot, value):
+        if self.values[slot] is not value:
+            self.values[slot] = value
+            self.versions[slot] += 1
+
+class GlobalCache(object):
+
+    def __init__(self, globals, slot):
+        self.globals = globals
+        self.slot = slot
+        self.version = -1
+        self.value = None
+
+class ExportTable(object):
+    """Exported member names of a module and the variable slot of each."""
+    _immutable_fields_ = ['name', 'names[*]', 'slots[*]']
+
+    def __init__(self, name, names, slots):
+        self.name = name
+        self.names = names
+        self.slots = slots
+        self.indexes = {}
+        for index, member in enumerate(names):
+            self.indexes[member] = index
+
+    @jit.elidable
+    def lookup(self, name):
+        return self.indexes.get(name, -1)
+
 class Module(W_Root):
+    """A loaded module. Only the exported values are kept alive."""
 
-    def __init__(self, frame):
-        self.frame = frame
+    def __init__(self, exports, values):
+        count_alloc('Module')
+        self.exports = exports
+        self.values = values
 
-    def get(self, varname):
-        index = self.frame.bytecode.vars.keys_to_index[varname.str()]
-        return self.frame.vars[index]
+    def get(self, key):
+        return self.member(self.exports.lookup(key.str()))
+
+    def member(self, index):
+        if index < 0:
+            raise Exception("module does not export this member")
+        val = self.values[index]
+        if isinstance(val, LazyImport):
+            val = val.resolve()
+            self.values[index] = val
+        return val
+
+    def str(self):
+        return '<module %s>' % self.exports.name
 
 class Sys(W_Root):
+    _immutable_fields_ = ['profiler?', 'tracer?', 'timer?', 'dump_bytecode?', 'lazy_imports?',
+                          'code_cache?', 'output?', 'scheduler?',
+                          'event_loop?', 'stdin?']
 
     def __init__(self):
         self.data = {}
+        self.profiler = None
+        self.tracer = None
+        self.timer = None
+        self.dump_bytecode = False
+        self.lazy_imports = False
+        self.modules = {}
+        # set by `moha serve`: bytecode shared between scripts, and where print writes
+        self.code_cache = None
+        self.output = None
+        # created by the first spawn and the first I/O operation
+        self.scheduler = None
+        self.event_loop = None
+        # the reader of io.stdin(), shared so that no buffered input is lost
+        self.stdin = None
 
     def get_cwd(self):
         return self.data['cwd']
@@ -293,14 +924,102 @@ class Sys(W_Root):
         return '%s/libs' % env_path
 
 class Bytecode(object):
-    _immutable_fields_ = ['code', 'constants[*]', 'numvars']
+    _immutable_fields_ = ['code[*]', 'constants[*]', 'numvars', 'vars', 'names',
+                          'name', 'filename', 'lines[*]', 'exports']
 
-    def __init__(self, code, constants, vars, names):
+    def __init__(self, code, constants, vars, names, name='<module>', filename='', lines=None, exports=None):
         self.code = code
         self.constants = constants
         self.vars = vars
         self.names = names
         self.numvars = self.vars.size()
+        self.name = name
+        self.filename = filename
+        self.lines = lines or []
+        self.exports = exports
+        # per instruction: the export table a member site was linked
+        # against and the slot of the member in it
+        self.member_tables = None
+        self.member_slots = None
+        self.global_caches = None
+
+    def load_global(self, pc, globals):
+        """Value of the module global read by the LOAD_GLOBAL at ``pc``.
+
+        Returns None if the module has no such variable or it is unbound.
+        The slot is cached per instruction and the value per version of
+        the slot.
+        """
+        if self.global_caches is None:
+            self.global_caches = [None] * (len(self.code) / 2)
+        cache = self.global_caches[pc / 2]
+        if cache is None or cache.globals is not globals:
+            cache = GlobalCache(globals, globals.names.get(self.name_at(self.code[pc + 1])))
+            self.global_caches[pc / 2] = cache
+        if cache.slot < 0:
+            return None
+        version = globals.versions[cache.slot]
+        if cache.version != version:
+            cache.value = globals.values[cache.slot]
+            cache.version = version
+        return cache.value
+
+    def link_members(self, pc, exports):
+        """Resolve the member sites that read the module imported at ``pc``.
+
+        Called when the IMPORT_MODULE at ``pc`` has loaded a module with
+        ``exports``. The members of an import statement must be exported;
+        ``module.member`` reads in this bytecode are linked if they are.
+        """
+        code = self.code
+        i = pc + 2
+        while i + 2 < len(code) and code[i] == Code.LOAD_CONST and code[i + 2] == Code.IMPORT_MEMBER:
+            name = self.constants[code[i + 1]].str()
+            slot = exports.lookup(name)
+            if slot < 0:
+                raise Exception("module %s does not export %s" % (exports.name, name))
+            self.link_member(i + 2, exports, slot)
+            i += 4
+        if i < len(code) and code[i] == Code.STORE_VAR:
+            var = code[i + 1]
+            for j in range(0, len(code) - 4, 2):
+                if (code[j] == Code.LOAD_IMPORT and code[j + 1] == var and
+                        code[j + 2] == Code.LOAD_CONST and
+                        (code[j + 4] == Code.MAP_GETITEM or code[j + 4] == Code.LOAD_METHOD)):
+                    slot = exports.lookup(self.constants[code[j + 3]].str())
+                    if slot >= 0:
+                        self.link_member(j + 4, exports, slot)
+
+    def link_member(self, pc, exports, slot):
+        if self.member_tables is None:
+            self.member_tables = [None] * (len(self.code) / 2)
+            self.member_slots = [-1] * (len(self.code) / 2)
+        self.member_tables[pc / 2] = exports
+        self.member_slots[pc / 2] = slot
+
+    def member_slot(self, pc, exports, key):
+        """Index of the module member named ``key`` in ``exports``.
+
+        Sites are normally linked when their module is imported; a site
+        reached with another module, e.g. in a function or after a lazy
+        import, is linked on its first run.
+        """
+        if self.member_tables is not None and self.member_tables[pc / 2] is exports:
+            return self.member_slots[pc / 2]
+        slot = exports.lookup(key.str())
+        self.link_member(pc, exports, slot)
+        return slot
+
+    def line_at(self, pc):
+        """Source line of the instruction at ``pc``, 0 if unknown."""
+        index = pc / 2
+        if 0 <= index < len(self.lines):
+            return self.lines[index]
+        return 0
+
+    @jit.elidable
+    def name_at(self, index):
+        return self.names.keys[index]
 
     def __repr__(self):
         return '<bytecode>'
@@ -318,5 +1037,15 @@ class Bytecode(object):
                 line += " (%s)" % self.constants[arg]
             elif attrname == 'LOAD_VAR' or attrname == 'STORE_VAR':
                 line += " (%s)" % self.vars.keys[arg]
+            elif attrname == 'LOAD_GLOBAL':
+                line += " (%s)" % self.names.keys[arg]
             lines.append(line)
         return '\n'.join(lines)
+
+    def dump_tree(self):
+        """Dump this bytecode followed by the bytecode of nested functions."""
+        lines = ['== %s (%s:%d) ==' % (self.name, self.filename, self.line_at(0)), self.dump()]
+        for const in self.constants:
+            if isinstance(const, Function) and const.get_bytecode() is not None:
+                lines.append(const.get_bytecode().dump_tree())
+        return '\n'.join(lines)
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+class ModuleTimings(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.read = 0.0
+        self.parse = 0.0
+        self.compile = 0.0
+        self.execute = 0.0
+        self.last = time.time()
+
+    def lap(self):
+        now = time.time()
+        elapsed = now - self.last
+        self.last = now
+        return elapsed
+
+class PhaseTimer(object):
+    """Wall-clock time spent reading, parsing, compiling and executing modules.
+
+    Execution time is exclusive: time spent loading modules imported while a
+    module runs is charged to the imported modules, not to the importer.
+    """
+
+    def __init__(self):
+        self.modules = []
+        self.nested = []
+
+    def start(self, filename):
+        timings = ModuleTimings(filename)
+        self.modules.append(timings)
+        self.nested.append(0.0)
+        return timings
+
+    def finish(self, timings):
+        nested = self.nested.pop()
+        elapsed = timings.lap()
+        timings.execute = elapsed - nested
+        total = timings.read + timings.parse + timings.compile + elapsed
+        if self.nested:
+            self.nested[len(self.nested) - 1] += total
+
+    def report(self):
+        lines = ['%10s %10s %10s %10s  %s' % ('read', 'parse', 'compile', 'execute', 'module')]
+        for t in self.modules:
+            lines.append('%9.3fms %9.3fms %9.3fms %9.3fms  %s' % (
+                t.read * 1000, t.parse * 1000, t.compile * 1000, t.execute * 1000, t.filename))
+        return '\n'.join(lines)
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from rpython.rlib.streamio import open_file_as_stream
+
+def frame_label(bc, pc):
+    return '%s (%s:%d)' % (bc.name, bc.filename, bc.line_at(pc))
+
+class Profiler(object):
+    """Sampling profiler over the interpreter's frame stack.
+
+    Every ``interval`` instructions the current stack is sampled and
+    charged with the wall-clock time since the previous sample, in
+    microseconds. Stacks are kept in the collapsed format read by
+    flamegraph tools: one ``caller;callee count`` line per distinct stack.
+    """
+
+    def __init__(self, interval=1000):
+        self.interval = interval
+        self.countdown = interval
+        self.last = time.time()
+        self.stacks = {}
+
+    def tick(self, frame_stack, bc, pc):
+        self.countdown -= 1
+        if self.countdown <= 0:
+            self.countdown = self.interval
+            self.sample(frame_stack, bc, pc)
+
+    def sample(self, frame_stack, bc, pc):
+        now = time.time()
+        weight = int((now - self.last) * 1000000)
+        self.last = now
+        if weight <= 0:
+            weight = 1
+        labels = []
+        for caller in frame_stack:
+            # callers are suspended just after their CALL_FUNC
+            labels.append(frame_label(caller[1], caller[2] - 2))
+        labels.append(frame_label(bc, pc))
+        stack = ';'.join(labels)
+        self.stacks[stack] = self.stacks.get(stack, 0) + weight
+
+    def collapsed(self):
+        lines = []
+        for stack, weight in self.stacks.iteritems():
+            lines.append('%s %d' % (stack, weight))
+        lines.sort()
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        f = open_file_as_stream(path, 'w')
+        f.write(self.collapsed())
+        f.close()
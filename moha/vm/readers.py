@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Buffered readers for streaming files and stdin, and memory-mapped files.
+
+A ``Reader`` reads its file a block at a time into one buffer that its
+line and chunk iterators share, so a script streams input of any size in
+memory bounded by the block size and the longest line or chunk it asks
+for. A line or chunk longer than a block is joined from its blocks once,
+so reading it takes time linear in its length. Iterating a reader yields
+its lines without the newline.
+
+A ``MappedFile`` maps a whole file with rmmap for random access: slices
+are copied out of the page cache only when they are read.
+"""
+
+import os
+
+from rpython.rlib import rmmap
+
+from moha.vm.allocstats import count_alloc
+from moha.vm.objects import W_Root, Iterator, Function, String
+
+#: bytes read from the file at a time
+BLOCK_SIZE = 65536
+
+class Reader(W_Root):
+
+    def __init__(self, fd, name, block_size=BLOCK_SIZE):
+        count_alloc('Reader')
+        self.fd = fd
+        self.name = name
+        self.block_size = block_size
+        # unread input is buffer[pos:]
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        self.closed = False
+
+    def check_open(self):
+        if self.closed:
+            raise Exception("%s is closed" % self.name)
+
+    def available(self):
+        return len(self.buffer) - self.pos
+
+    def fill(self):
+        """Replace the consumed buffer with the next block; False at the end of the file."""
+        self.check_open()
+        if self.eof:
+            return False
+        try:
+            data = os.read(self.fd, self.block_size)
+        except OSError as e:
+            raise Exception("cannot read %s: %s" % (self.name, os.strerror(e.errno)))
+        if not data:
+            self.eof = True
+            return False
+        self.buffer = data
+        self.pos = 0
+        return True
+
+    def take(self, length):
+        start = self.pos
+        stop = start + length
+        assert start >= 0 and stop >= start
+        self.pos = stop
+        return self.buffer[start:stop]
+
+    def read_line(self):
+        """The next line without its newline, or None at the end of the file."""
+        end = self.buffer.find('\n', self.pos)
+        if end >= 0:
+            line = self.take(end - self.pos)
+            self.pos += 1
+            return line
+        # the line goes on in the next blocks: keep its parts, search only
+        # each new block, and join them once
+        parts = []
+        while True:
+            if self.available() > 0:
+                parts.append(self.take(self.available()))
+            if not self.fill():
+                if not parts:
+                    return None
+                return ''.join(parts)
+            end = self.buffer.find('\n')
+            if end >= 0:
+                parts.append(self.take(end))
+                self.pos += 1
+                return ''.join(parts)
+
+    def read(self, size):
+        """Up to ``size`` bytes, fewer only at the end of the file; None there."""
+        if self.available() >= size:
+            return self.take(size)
+        parts = []
+        needed = size
+        while True:
+            if self.available() >= needed:
+                parts.append(self.take(needed))
+                break
+            needed -= self.available()
+            parts.append(self.take(self.available()))
+            if not self.fill():
+                break
+        data = ''.join(parts)
+        if not data:
+            return None
+        return data
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.buffer = ''
+            self.pos = 0
+            if self.fd != 0:
+                os.close(self.fd)
+
+    def iter(self):
+        return LineIterator(self)
+
+    def get(self, key):
+        name = key.str()
+        if name not in ('lines', 'chunks', 'read', 'read_line', 'close'):
+            raise Exception("reader has no method %s" % name)
+        return Function(None, 'reader.' + name)
+
+    def str(self):
+        return '<reader %s>' % self.name
+
+class LineIterator(Iterator):
+
+    def __init__(self, reader):
+        count_alloc('LineIterator')
+        self.reader = reader
+
+    def next(self, ctx):
+        line = self.reader.read_line()
+        if line is None:
+            return None
+        return String(line)
+
+class ChunkIterator(Iterator):
+
+    def __init__(self, reader, size):
+        count_alloc('ChunkIterator')
+        self.reader = reader
+        self.size = size
+
+    def next(self, ctx):
+        chunk = self.reader.read(self.size)
+        if chunk is None:
+            return None
+        return String(chunk)
+
+def open_reader(path):
+    return Reader(os.open(path, os.O_RDONLY, 0), path)
+
+class MappedFile(W_Root):
+    """A file mapped into memory, read by offset."""
+
+    def __init__(self, path):
+        count_alloc('MappedFile')
+        self.name = path
+        self.map = None
+        fd = os.open(path, os.O_RDONLY, 0)
+        try:
+            # an empty file cannot be mapped; it has nothing to read anyway
+            if os.fstat(fd).st_size > 0:
+                self.map = rmmap.mmap(fd, 0, access=rmmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        self.closed = False
+
+    def check_open(self):
+        if self.closed:
+            raise Exception("%s is closed" % self.name)
+
+    def size(self):
+        self.check_open()
+        if self.map is None:
+            return 0
+        return self.map.len()
+
+    def read(self, offset, length):
+        """Bytes from ``offset``, cut at the end of the file."""
+        size = self.size()
+        if offset < 0 or length < 0:
+            raise Exception("offset and length must not be negative")
+        if offset >= size:
+            return ''
+        return self.map.getslice(offset, min(length, size - offset))
+
+    def find(self, needle, start):
+        """Offset of ``needle`` at or after ``start``, or -1."""
+        size = self.size()
+        if size == 0 or start >= size:
+            return -1
+        return self.map.find(needle, max(start, 0), size)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            if self.map is not None:
+                self.map.close()
+                self.map = None
+
+    def iter(self):
+        return MappedLineIterator(self)
+
+    def get(self, key):
+        name = key.str()
+        if name not in ('size', 'read', 'find', 'lines', 'close'):
+            raise Exception("mapped file has no method %s" % name)
+        return Function(None, 'mapped.' + name)
+
+    def str(self):
+        return '<mapped file %s>' % self.name
+
+class MappedLineIterator(Iterator):
+
+    def __init__(self, mapped):
+        count_alloc('MappedLineIterator')
+        self.mapped = mapped
+        self.pos = 0
+
+    def next(self, ctx):
+        size = self.mapped.size()
+        if self.pos >= size:
+            return None
+        end = self.mapped.find('\n', self.pos)
+        if end < 0:
+            end = size
+        line = self.mapped.read(self.pos, end - self.pos)
+        self.pos = end + 1
+        return String(line)
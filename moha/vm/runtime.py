@@ -2,49 +2,570 @@
 
 import os
 from rpython.rlib import jit
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.rmmap import RMMapError
 from rpython.rlib.objectmodel import we_are_translated
-from rpython.rlib.streamio import open_file_as_stream
+from rpython.rlib.rpath import rnormpath
 
 from moha.vm import code as Code
-from moha.vm.objects import Function, Boolean, Null, Object, Array, Module, Sys, Bytecode, String
-from moha.vm.grammar.v0_2_0 import parse_source
+from moha.vm import tracer
+from moha.vm import allocstats
+from moha.vm.allocstats import alloc_stats, count_alloc
+from moha.vm.objects import LazyImport, Globals, Function, Boolean, Null, Object, Array, Module, Sys, Bytecode, String, Integer, Float
+from moha.vm.objects import Iterator, MapIterator, FilterIterator, sort_values, sort_values_by_keys
+from moha.vm.objects import Memo, MemoKey, ObjectTemplate
+from moha.vm.grammar.parser import parse, parse_source
+from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.parsing import ParseError
 from moha.vm.compiler import Compiler
+from moha.vm.artifact import load_artifact
+from moha.vm.tasks import Task, Channel, ChannelIterator, Scheduler, RESUME_CALL, RESUME_ITER
+from moha.vm.tasks import YieldWait, SendWait, TakenWait, RecvWait, JoinWait
+from moha.vm.eventloop import EventLoop, Stream, ReadWait, WriteWait, AcceptWait, SleepWait
+from moha.vm.eventloop import open_file, open_pipe, listen_tcp, listen_unix, connect_tcp, connect_unix
+from moha.vm.readers import Reader, LineIterator, ChunkIterator, MappedFile, MappedLineIterator, open_reader
+from moha.vm.utils import monotonic_ns, read_file
+
+class AbortError(Exception):
+    """Raised by an ``abort`` statement; ends the program with its message."""
+
+    def __init__(self, message):
+        self.message = message
 
 def builtin_str(s):
     return String(s.str())
 
-def builtin_print(s):
-    print(s.str())
+def builtin_print(sys, s):
+    if sys.output is None:
+        print(s.str())
+    else:
+        sys.output.write(s.str() + '\n')
     return Null.singleton()
 
 def builtin_id(s):
     return Integer(s.hash())
 
+def builtin_iter(iterable):
+    return iterable.iter()
+
+def builtin_collect(ctx, iterable):
+    if isinstance(iterable, Array):
+        return Array(iterable.array[:])
+    result = []
+    it = iterable.iter()
+    while True:
+        elem = it.next(ctx)
+        if elem is None:
+            break
+        result.append(elem)
+    return Array(result)
+
+def builtin_map(ctx, fn, iterable):
+    if not isinstance(iterable, Array):
+        return builtin_collect(ctx, MapIterator(iterable, fn))
+    length = len(iterable.array)
+    result = [None] * length
+    index = 0
+    while index < length:
+        result[index] = ctx.call(fn, [iterable.array[index]])
+        index += 1
+    return Array(result)
+
+def builtin_filter(ctx, fn, iterable):
+    return builtin_collect(ctx, FilterIterator(iterable, fn))
+
+def builtin_reduce(ctx, fn, iterable, initial):
+    it = iterable.iter()
+    acc = initial
+    if acc is None:
+        acc = it.next(ctx)
+        if acc is None:
+            raise Exception("reduce() of empty iterable with no initial value")
+    while True:
+        elem = it.next(ctx)
+        if elem is None:
+            break
+        acc = ctx.call(fn, [acc, elem])
+    return acc
+
+def builtin_each(ctx, fn, iterable):
+    it = iterable.iter()
+    while True:
+        elem = it.next(ctx)
+        if elem is None:
+            break
+        ctx.call(fn, [elem])
+    return Null.singleton()
+
+def builtin_sort(ctx, iterable, key):
+    values = builtin_collect(ctx, iterable).array
+    if key is None:
+        sort_values(values)
+    else:
+        keys = [ctx.call(key, [value]) for value in values]
+        sort_values_by_keys(values, keys)
+    return Array(values)
+
+def builtin_range(start, stop):
+    if not isinstance(start, Integer) or not isinstance(stop, Integer):
+        raise Exception("range() expects integers")
+    length = stop.intval - start.intval
+    if length < 0:
+        length = 0
+    result = [None] * length
+    index = 0
+    while index < length:
+        result[index] = Integer(start.intval + index)
+        index += 1
+    return Array(result)
+
+def builtin_memo(fn, capacity):
+    if not isinstance(fn, Function):
+        raise Exception("memo() expects a function")
+    if not isinstance(capacity, Integer) or capacity.intval <= 0:
+        raise Exception("memo() expects a positive capacity")
+    return Memo(fn, capacity.intval)
+
+def builtin_clock():
+    return Float(monotonic_ns() / 1000000000.0)
+
+def builtin_monotonic_ns():
+    return Integer(monotonic_ns())
+
+TimingSort = make_timsort_class()
+
+def percentile(samples, p):
+    """Nearest-rank percentile of sorted ``samples``."""
+    rank = (len(samples) * p + 99) / 100
+    return samples[max(rank, 1) - 1]
+
+def builtin_bench(ctx, fn, iterations, warmup):
+    """Call ``fn`` ``warmup`` times, then time ``iterations`` calls.
+
+    The warmup calls give the JIT a chance to compile ``fn`` before it is
+    measured. Timings are returned in nanoseconds.
+    """
+    if not isinstance(iterations, Integer) or iterations.intval <= 0:
+        raise Exception("bench() expects a positive number of iterations")
+    if not isinstance(warmup, Integer) or warmup.intval < 0:
+        raise Exception("bench() expects a non-negative warmup")
+    index = 0
+    while index < warmup.intval:
+        ctx.call(fn, [])
+        index += 1
+    samples = [0] * iterations.intval
+    total = 0
+    index = 0
+    while index < iterations.intval:
+        start = monotonic_ns()
+        ctx.call(fn, [])
+        samples[index] = monotonic_ns() - start
+        total += samples[index]
+        index += 1
+    TimingSort(samples).sort()
+    result = Object()
+    result.dictionary['iterations'] = iterations
+    result.dictionary['warmup'] = warmup
+    result.dictionary['mean'] = Integer(total / len(samples))
+    result.dictionary['min'] = Integer(samples[0])
+    result.dictionary['max'] = Integer(samples[len(samples) - 1])
+    result.dictionary['p50'] = Integer(percentile(samples, 50))
+    result.dictionary['p90'] = Integer(percentile(samples, 90))
+    result.dictionary['p99'] = Integer(percentile(samples, 99))
+    return result
+
+def builtin_spawn(ctx, fn, args):
+    sys = ctx.sys
+    if sys.scheduler is None:
+        sys.scheduler = Scheduler()
+    # the spawned function still sees the locals of the frames it was spawned from
+    callers = ctx.frame_stack[:]
+    if ctx.callers is not None:
+        callers = ctx.callers + callers
+    task = Task(fn, args, ctx.filename, callers)
+    sys.scheduler.spawn(task)
+    return task
+
+def builtin_channel(capacity):
+    if not isinstance(capacity, Integer) or capacity.intval < 0:
+        raise Exception("channel capacity must be a non-negative integer")
+    return Channel(capacity.intval)
+
+def builtin_send(ctx, channel, value, suspendable):
+    if not isinstance(channel, Channel):
+        raise Exception("%s is not a channel" % channel.str())
+    if channel.capacity > 0:
+        wait_for(ctx, SendWait(channel, value), suspendable)
+    else:
+        wait_for(ctx, TakenWait(channel, channel.put(value)), suspendable)
+    return Null.singleton()
+
+def builtin_recv(ctx, channel, suspendable):
+    if not isinstance(channel, Channel):
+        raise Exception("%s is not a channel" % channel.str())
+    value = wait_for(ctx, RecvWait(channel), suspendable)
+    if value is None:
+        return Null.singleton()
+    return value
+
+def builtin_close(channel):
+    if not isinstance(channel, Channel):
+        raise Exception("%s is not a channel" % channel.str())
+    channel.close()
+    return Null.singleton()
+
+def builtin_join(ctx, task, suspendable):
+    if not isinstance(task, Task):
+        raise Exception("%s is not a task" % task.str())
+    result = wait_for(ctx, JoinWait(task), suspendable)
+    if result is None:
+        return Null.singleton()
+    return result
+
+def event_loop(sys):
+    if sys.event_loop is None:
+        sys.event_loop = EventLoop()
+    return sys.event_loop
+
+def string_arg(w_value, what):
+    if not isinstance(w_value, String):
+        raise Exception("%s must be a string" % what)
+    return w_value.strval
+
+def int_arg(w_value, what):
+    if not isinstance(w_value, Integer):
+        raise Exception("%s must be an integer" % what)
+    return w_value.intval
+
+def stream_arg(w_value):
+    if not isinstance(w_value, Stream):
+        raise Exception("%s is not a stream" % w_value.str())
+    w_value.check_open()
+    return w_value
+
+def io_wait(ctx, wait, suspendable):
+    """Run a stream operation, waiting for its descriptor if it would block."""
+    wait.start()
+    result = wait_for(ctx, wait, suspendable)
+    if result is None:
+        return Null.singleton()
+    return result
+
+def builtin_io_open(path, mode):
+    try:
+        return open_file(string_arg(path, "path"), string_arg(mode, "mode"))
+    except OSError as e:
+        raise Exception("cannot open %s: %s" % (path.str(), os.strerror(e.errno)))
+
+def builtin_io_pipe():
+    r, w = open_pipe()
+    return Array([r, w])
+
+def builtin_io_reader(path):
+    try:
+        return open_reader(string_arg(path, "path"))
+    except OSError as e:
+        raise Exception("cannot open %s: %s" % (path.str(), os.strerror(e.errno)))
+
+def builtin_io_stdin(sys):
+    if sys.stdin is None:
+        sys.stdin = Reader(0, 'stdin')
+    return sys.stdin
+
+def builtin_io_mmap(path):
+    try:
+        return MappedFile(string_arg(path, "path"))
+    except OSError as e:
+        raise Exception("cannot map %s: %s" % (path.str(), os.strerror(e.errno)))
+    except RMMapError as e:
+        raise Exception("cannot map %s: %s" % (path.str(), e.message))
+
+def reader_arg(w_value):
+    if not isinstance(w_value, Reader):
+        raise Exception("%s is not a reader" % w_value.str())
+    w_value.check_open()
+    return w_value
+
+def mapped_arg(w_value):
+    if not isinstance(w_value, MappedFile):
+        raise Exception("%s is not a mapped file" % w_value.str())
+    w_value.check_open()
+    return w_value
+
+def positive_arg(w_value, what):
+    value = int_arg(w_value, what)
+    if value <= 0:
+        raise Exception("%s must be positive" % what)
+    return value
+
+def builtin_io_sleep(ctx, ms, suspendable):
+    wait_for(ctx, SleepWait(event_loop(ctx.sys), int_arg(ms, "ms")), suspendable)
+    return Null.singleton()
+
+def wait_for(ctx, wait, suspendable):
+    """Complete ``wait`` and return its result.
+
+    If it is not ready and ``suspendable`` is set, the running task is
+    suspended instead: ``ctx.suspended`` is set and None returned, and the
+    interpreter loop hands the task back to the scheduler. Otherwise the
+    other tasks run until the wait is ready.
+    """
+    sched = ctx.sys.scheduler
+    if isinstance(wait, YieldWait):
+        if suspendable:
+            suspend_task(ctx, wait)
+        elif sched is not None:
+            run_round(ctx.sys)
+        return None
+    if wait.ready():
+        return wait.complete()
+    if suspendable:
+        suspend_task(ctx, wait)
+        return None
+    run_tasks(ctx.sys, wait)
+    return wait.complete()
+
+def suspend_task(ctx, wait):
+    task = ctx.sys.scheduler.current
+    assert task is not None
+    task.wait = wait
+    ctx.suspended = True
+
+def call_memo(ctx, memo, args):
+    key = MemoKey(args)
+    result = memo.lookup(key)
+    if result is not None:
+        return result
+    fn = memo.fn
+    bc = fn.get_bytecode()
+    if bc is not None and not fn.obj:
+        # Bind the function's own name to the memo so that recursive calls
+        # go through the cache too.
+        frame = new_call_frame(fn, bc, args, memo)
+        result = interpret_bytecode(ctx.sys, ctx.filename, frame, bc, ctx.frame_stack)
+    else:
+        result = ctx.call(fn, args)
+    memo.cache.put(key, result)
+    return result
+
+def call_builtin(ctx, name, args):
+    # only the builtin called straight from the task's interpreter loop may
+    # suspend it; builtins it calls in turn get a cleared flag
+    suspendable = ctx.suspendable
+    ctx.suspendable = False
+    if name == 'print':
+        return builtin_print(ctx.sys, args[0])
+    elif name == 'str':
+        return builtin_str(args[0])
+    elif name == 'id':
+        return builtin_id(args[0])
+    elif name == 'map':
+        return builtin_map(ctx, args[0], args[1])
+    elif name == 'filter':
+        return builtin_filter(ctx, args[0], args[1])
+    elif name == 'reduce':
+        initial = args[2] if len(args) > 2 else None
+        return builtin_reduce(ctx, args[0], args[1], initial)
+    elif name == 'each':
+        return builtin_each(ctx, args[0], args[1])
+    elif name == 'iter':
+        return builtin_iter(args[0])
+    elif name == 'collect':
+        return builtin_collect(ctx, args[0])
+    elif name == 'range':
+        if len(args) == 1:
+            return builtin_range(Integer(0), args[0])
+        return builtin_range(args[0], args[1])
+    elif name == 'memo':
+        capacity = args[1] if len(args) > 1 else Integer(128)
+        return builtin_memo(args[0], capacity)
+    elif name == 'sort':
+        key = args[1] if len(args) > 1 else None
+        return builtin_sort(ctx, args[0], key)
+    elif name == 'clock':
+        return builtin_clock()
+    elif name == 'monotonic_ns':
+        return builtin_monotonic_ns()
+    elif name == 'bench':
+        if len(args) > 2:
+            warmup = args[2]
+        elif isinstance(args[1], Integer):
+            warmup = Integer(args[1].intval / 10 + 1)
+        else:
+            warmup = Integer(0)
+        return builtin_bench(ctx, args[0], args[1], warmup)
+    elif name == 'spawn':
+        return builtin_spawn(ctx, args[0], args[1:])
+    elif name == 'yield':
+        wait_for(ctx, YieldWait(), suspendable)
+        return Null.singleton()
+    elif name == 'channel':
+        capacity = args[0] if len(args) > 0 else Integer(0)
+        return builtin_channel(capacity)
+    elif name == 'channel.send':
+        return builtin_send(ctx, args[0], args[1], suspendable)
+    elif name == 'channel.recv':
+        return builtin_recv(ctx, args[0], suspendable)
+    elif name == 'channel.close':
+        return builtin_close(args[0])
+    elif name == 'task.join':
+        return builtin_join(ctx, args[0], suspendable)
+    elif name == 'task.done':
+        task = args[0]
+        assert isinstance(task, Task)
+        return Boolean.from_raw(task.done)
+    elif name == 'io_open':
+        mode = args[1] if len(args) > 1 else String('r')
+        return builtin_io_open(args[0], mode)
+    elif name == 'io_pipe':
+        return builtin_io_pipe()
+    elif name == 'io_connect':
+        wait = connect_tcp(event_loop(ctx.sys), string_arg(args[0], "host"), int_arg(args[1], "port"))
+        return io_wait(ctx, wait, suspendable)
+    elif name == 'io_connect_unix':
+        wait = connect_unix(event_loop(ctx.sys), string_arg(args[0], "path"))
+        return io_wait(ctx, wait, suspendable)
+    elif name == 'io_listen':
+        return listen_tcp(string_arg(args[0], "host"), int_arg(args[1], "port"))
+    elif name == 'io_listen_unix':
+        return listen_unix(string_arg(args[0], "path"))
+    elif name == 'io_sleep':
+        return builtin_io_sleep(ctx, args[0], suspendable)
+    elif name == 'stream.read':
+        size = int_arg(args[1], "size") if len(args) > 1 else 65536
+        return io_wait(ctx, ReadWait(event_loop(ctx.sys), stream_arg(args[0]), size), suspendable)
+    elif name == 'stream.write':
+        data = string_arg(args[1], "data")
+        return io_wait(ctx, WriteWait(event_loop(ctx.sys), stream_arg(args[0]), data), suspendable)
+    elif name == 'stream.accept':
+        return io_wait(ctx, AcceptWait(event_loop(ctx.sys), stream_arg(args[0])), suspendable)
+    elif name == 'stream.close':
+        stream = args[0]
+        assert isinstance(stream, Stream)
+        stream.close()
+        return Null.singleton()
+    elif name == 'stream.port':
+        return Integer(stream_arg(args[0]).port())
+    elif name == 'io_reader':
+        return builtin_io_reader(args[0])
+    elif name == 'io_stdin':
+        return builtin_io_stdin(ctx.sys)
+    elif name == 'io_mmap':
+        return builtin_io_mmap(args[0])
+    elif name == 'reader.lines':
+        return LineIterator(reader_arg(args[0]))
+    elif name == 'reader.chunks':
+        return ChunkIterator(reader_arg(args[0]), positive_arg(args[1], "chunk size"))
+    elif name == 'reader.read':
+        data = reader_arg(args[0]).read(positive_arg(args[1], "size"))
+        return String(data if data is not None else '')
+    elif name == 'reader.read_line':
+        line = reader_arg(args[0]).read_line()
+        if line is None:
+            return Null.singleton()
+        return String(line)
+    elif name == 'reader.close':
+        reader = args[0]
+        assert isinstance(reader, Reader)
+        reader.close()
+        return Null.singleton()
+    elif name == 'mapped.size':
+        return Integer(mapped_arg(args[0]).size())
+    elif name == 'mapped.read':
+        return String(mapped_arg(args[0]).read(int_arg(args[1], "offset"), int_arg(args[2], "length")))
+    elif name == 'mapped.find':
+        start = int_arg(args[2], "start") if len(args) > 2 else 0
+        return Integer(mapped_arg(args[0]).find(string_arg(args[1], "needle"), start))
+    elif name == 'mapped.lines':
+        return MappedLineIterator(mapped_arg(args[0]))
+    elif name == 'mapped.close':
+        mapped = args[0]
+        assert isinstance(mapped, MappedFile)
+        mapped.close()
+        return Null.singleton()
+    else:
+        raise Exception("Unresolved variable %s" % name)
+
+def call_instancefunc(w_func, args):
+    if len(args) == 0 and w_func.instancefunc_0:
+        return w_func.instancefunc_0()
+    elif len(args) == 1 and w_func.instancefunc_1:
+        return w_func.instancefunc_1(args[0])
+    elif len(args) == 2 and w_func.instancefunc_2:
+        return w_func.instancefunc_2(args[0], args[1])
+    elif len(args) == 3 and w_func.instancefunc_3:
+        return w_func.instancefunc_3(args[0], args[1], args[2])
+    else:
+        raise Exception("oops.")
+
 def printable_loc(pc, code, bc):
-    return "%d %d" % (pc, code[pc])
+    """Where a loop is in the source: file, line, function, pc and opcode."""
+    return "%s:%d %s %d %s" % (bc.filename, bc.line_at(pc), bc.name, pc, Code.pretty(code[pc]))
 
+# Every variable that is live across the merge point has to be listed as a
+# green or a red, integers first. Frame is not virtualizable: its value
+# stack is resizable.
 driver = jit.JitDriver(greens = ['pc', 'bytecode', 'bc'],
-                       reds = ['frame'],
-                       virtualizables=['frame'],
+                       reds = ['base', 'frame', 'frame_stack', 'ctx', 'sys', 'filename'],
                        get_printable_location=printable_loc)
 
 
+class LazyModule(LazyImport):
+    """A module imported in --lazy-imports mode, loaded when first resolved."""
+
+    def __init__(self, sys, path):
+        LazyImport.__init__(self, None, None)
+        self.sys = sys
+        self.path = path
+        self.loaded = None
+
+    def resolve(self):
+        if self.loaded is None:
+            self.loaded = import_module(self.sys, self.path)
+        return self.loaded
+
+    def get(self, key):
+        return LazyImport(self, key)
+
+    def str(self):
+        return '<module %s>' % self.path
+
 class Frame(object):
     #_virtualizable_ = ['valuestack[*]', 'valuestack_pos', 'vars[*]']
 
-    def __init__(self, bc):
+    def __init__(self, bc, globals=None):
         #self = jit.hint(self, fresh_virtualizable=True, access_directly=True)
+        count_alloc('Frame')
         self.bytecode = bc
         self.vars = [None] * bc.numvars
         self.valuestack = []
+        # Only module code has an export table. The variables of a module
+        # frame are the module globals seen by the functions it defines.
+        self.owns_globals = bc.exports is not None
+        if self.owns_globals:
+            self.globals = Globals(bc.vars, self.vars)
+        else:
+            self.globals = globals
 
     def load_var(self, index):
+        self.push(self.vars[index])
+
+    def resolve_var(self, index):
+        """The variable at ``index``, loading the import it is bound to if that is still lazy."""
         val = self.vars[index]
-        self.push(val)
+        if isinstance(val, LazyImport):
+            val = val.resolve()
+            self.set_var(index, val)
+        return val
+
+    def set_var(self, index, val):
+        if self.owns_globals:
+            self.globals.store(index, val)
+        else:
+            self.vars[index] = val
 
     def store_var(self, index):
-        val = self.pop()
-        self.vars[index] = val
+        self.set_var(index, self.pop())
 
     def push(self, v):
         self.valuestack.append(v)
@@ -55,38 +576,147 @@ class Frame(object):
     def top(self):
         return self.valuestack[len(self.valuestack) - 1] if len(self.valuestack) >= 1 else None
 
-def interpret_bytecode(sys, filename, frame, bc):
+def new_call_frame(w_func, bc, args, w_self=None):
+    frame = Frame(bc, w_func.globals)
+    for index, arg in enumerate(args):
+        frame.vars[index] = arg
+    if len(args) != len(frame.vars): # recursion
+        frame.vars[len(args)] = w_self or Function(bc, None, globals=w_func.globals)
+    return frame
+
+def load_dynamic(frame_stack, name, callers=None):
+    """Resolve ``name`` in the callers' frames, innermost first, then as a builtin.
+
+    In a task, ``callers`` holds the frames it was spawned from, which are
+    searched after the task's own.
+    """
+    frames = frame_stack
+    while frames is not None:
+        idx = len(frames) - 1
+        while idx >= 0:
+            var_idx = frames[idx][1].vars.get(name)
+            if var_idx != -1:
+                return frames[idx][0].resolve_var(var_idx)
+            idx -= 1
+        frames = callers
+        callers = None
+    return Function(None, name, None)
+
+def call_function(sys, filename, frame_stack, w_func, args):
+    """Call ``w_func`` with ``args`` from native code and return its result.
+
+    The caller is expected to be on top of ``frame_stack`` already, so that
+    the callee resolves globals exactly as if it were called from bytecode.
+    """
+    if not isinstance(w_func, Function):
+        raise Exception("%s is not callable" % w_func.str())
+    if w_func.obj:
+        args = [w_func.obj] + args
+    if isinstance(w_func, Memo):
+        return call_memo(ExecutionContext(sys, filename, frame_stack), w_func, args)
+    elif w_func.is_instancefunc():
+        return call_instancefunc(w_func, args)
+    elif w_func.interpfunc:
+        return call_builtin(ExecutionContext(sys, filename, frame_stack), w_func.interpfunc, args)
+    bc = w_func.get_bytecode()
+    frame = new_call_frame(w_func, bc, args)
+    if allocstats.ENABLED and alloc_stats.enabled:
+        # charge the caller's remaining allocations to the caller's opcode
+        opcode = alloc_stats.opcode
+        retval = interpret_bytecode(sys, filename, frame, bc, frame_stack)
+        alloc_stats.opcode = opcode
+        return retval
+    return interpret_bytecode(sys, filename, frame, bc, frame_stack)
+
+class ExecutionContext(object):
+    """Lets native builtins call back into Moha functions.
+
+    ``task_level`` is set for the outermost interpreter loop of a task, the
+    only one that can suspend it; ``suspendable`` marks the call it is making
+    right now, and ``suspended`` reports back that the call suspended the task.
+    """
+
+    def __init__(self, sys, filename, frame_stack, task_level=False):
+        self.sys = sys
+        self.filename = filename
+        self.frame_stack = frame_stack
+        self.callers = task_callers(sys, frame_stack)
+        self.task_level = task_level
+        self.suspendable = False
+        self.suspended = False
+
+    def call(self, w_func, args):
+        return call_function(self.sys, self.filename, self.frame_stack, w_func, args)
+
+    def receive(self, channel):
+        """Next value of a channel iterated by a ``for`` loop, None once it is closed and empty."""
+        suspendable = self.suspendable
+        self.suspendable = False
+        return wait_for(self, RecvWait(channel), suspendable)
+
+def task_callers(sys, frame_stack):
+    """The frames the running task was spawned from if ``frame_stack`` is its stack, else None."""
+    sched = sys.scheduler
+    if sched is not None and sched.current is not None and sched.current.frame_stack is frame_stack:
+        return sched.current.callers
+    return None
+
+def interpret_bytecode(sys, filename, frame, bc, frame_stack=None, pc=0, base=-1):
+    """Run ``bc`` in ``frame`` until it finishes or returns.
+
+    ``frame_stack`` holds the caller frames. Native code re-enters the loop
+    with the stack it was called from, and the loop returns once ``frame``
+    itself returns, leaving the caller frames untouched. A resumed task
+    passes its ``pc`` and a ``base`` of 0, so that it returns through the
+    frames saved in its stack; if the task is suspended again the loop
+    returns None.
+    """
+    if frame_stack is None:
+        frame_stack = []
+    if base < 0:
+        base = len(frame_stack)
+    sched = sys.scheduler
+    task_level = (base == 0 and sched is not None and sched.current is not None
+                  and sched.current.frame_stack is frame_stack)
+    ctx = ExecutionContext(sys, filename, frame_stack, task_level)
     bytecode = bc.code
-    pc = 0
-    frame_stack = []
     while True:
-        driver.jit_merge_point(pc=pc, bytecode=bytecode, bc=bc, frame=frame)
+        driver.jit_merge_point(pc=pc, bytecode=bytecode, bc=bc, frame=frame,
+                               frame_stack=frame_stack, base=base, ctx=ctx,
+                               sys=sys, filename=filename)
         if pc >= len(bytecode):
             break
+        if sys.profiler is not None:
+            sys.profiler.tick(frame_stack, bc, pc)
         c = bytecode[pc]
         arg = bytecode[pc + 1]
+        if tracer.ENABLED and sys.tracer is not None:
+            sys.tracer.trace(bc, pc, c)
+        if allocstats.ENABLED and alloc_stats.enabled:
+            alloc_stats.opcode = c
         pc += 2
-        # print pc - 2, Code.pretty(c), arg
         if c == Code.POP:
             frame.pop();
         elif c == Code.LOAD_GLOBAL:
-            name = bc.names.keys[arg]
-            idx = len(frame_stack) - 1
-            while idx >= 0:
-                var_idx = frame_stack[idx][1].vars.get(name)
-                if var_idx == -1:
-                    idx -= 1
-                else:
-                    frame.push(frame_stack[idx][0].vars[var_idx])
-                    break
-            else:
-                if idx < 0:
-                    # builtin function
-                    frame.push(Function(None, name, None))
-                else:
-                    raise Exception('Unresolved variable: %s' % name)
+            val = None
+            if frame.globals is not None:
+                val = bc.load_global(pc - 2, frame.globals)
+                if isinstance(val, LazyImport):
+                    slot = frame.globals.names.get(bc.name_at(arg))
+                    val = val.resolve()
+                    frame.globals.store(slot, val)
+            if val is None:
+                val = load_dynamic(frame_stack, bc.name_at(arg), ctx.callers)
+            frame.push(val)
+        elif c == Code.LOAD_NONLOCAL:
+            frame.push(load_dynamic(frame_stack, bc.name_at(arg), ctx.callers))
+        elif c == Code.MAKE_FUNCTION:
+            template = frame.pop()
+            frame.push(Function(template.bytecode, body=template.body, globals=frame.globals))
         elif c == Code.LOAD_VAR:
             frame.load_var(arg)
+        elif c == Code.LOAD_IMPORT:
+            frame.push(frame.resolve_var(arg))
         elif c == Code.STORE_VAR:
             frame.store_var(arg)
         elif c == Code.DEL_VAR:
@@ -96,6 +726,16 @@ def interpret_bytecode(sys, filename, frame, bc):
         elif c == Code.BUILD_MAP:
             map = Object()
             frame.push(map)
+        elif c == Code.BUILD_OBJECT:
+            template = bc.constants[arg]
+            assert isinstance(template, ObjectTemplate)
+            obj = template.instantiate()
+            # keys are unique, so the values can be popped in reverse
+            idx = len(template.keys) - 1
+            while idx >= 0:
+                obj.dictionary[template.keys[idx]] = frame.pop()
+                idx -= 1
+            frame.push(obj)
         elif c == Code.BUILD_ARRAY:
             array = Array()
             idx = 0
@@ -114,10 +754,17 @@ def interpret_bytecode(sys, filename, frame, bc):
         elif c == Code.MAP_GETITEM:
             attr = frame.pop()
             obj = frame.pop()
-            val = obj.get(attr)
-            if isinstance(val, Function):
-                val.obj = obj
-            frame.push(val)
+            frame.push(get_item(bc, pc - 2, obj, attr))
+        elif c == Code.LOAD_METHOD:
+            attr = frame.pop()
+            obj = frame.pop()
+            method = obj.method(attr)
+            if method is not None:
+                frame.push(obj)
+                frame.push(method)
+            else:
+                frame.push(None)
+                frame.push(get_item(bc, pc - 2, obj, attr))
         elif c == Code.MAP_SETITEM:
             attr = frame.pop()
             obj = frame.pop()
@@ -133,54 +780,54 @@ def interpret_bytecode(sys, filename, frame, bc):
             map = frame.pop()
             map.set(key, value)
             frame.push(map)
-        elif c == Code.CALL_FUNC:
+        elif c == Code.CALL_FUNC or c == Code.CALL_METHOD:
             idx = 0
+            count_alloc('args')
             args = []
             while idx < arg:
                 args.append(frame.pop())
                 idx += 1
 
             w_func_bc = frame.pop()
-            if w_func_bc.obj:
+            receiver = None
+            if c == Code.CALL_METHOD:
+                receiver = frame.pop()
+            if receiver is not None:
+                args.insert(0, receiver)
+            elif w_func_bc.obj:
                 args = [w_func_bc.obj] + args
 
-            if w_func_bc.instancefunc_0 or w_func_bc.instancefunc_1 or w_func_bc.instancefunc_2 or w_func_bc.instancefunc_3:
-                # interp
-                if len(args) == 0 and w_func_bc.instancefunc_0:
-                    retval = w_func_bc.instancefunc_0()
-                elif len(args) == 1 and w_func_bc.instancefunc_1:
-                    retval = w_func_bc.instancefunc_1(args[0])
-                elif len(args) == 2 and w_func_bc.instancefunc_2:
-                    retval = w_func_bc.instancefunc_2(args[0], args[1])
-                elif len(args) == 3 and w_func_bc.instancefunc_3:
-                    retval = w_func_bc.instancefunc_3(args[0], args[1], args[2])
-                else:
-                    raise Exception("oops.")
+            if isinstance(w_func_bc, Memo):
+                frame_stack.append((frame, bc, pc))
+                retval = call_memo(ctx, w_func_bc, args)
+                frame_stack.pop()
                 frame.push(retval)
+            elif w_func_bc.is_instancefunc():
+                frame.push(call_instancefunc(w_func_bc, args))
             elif w_func_bc.interpfunc:
-                func_interp = w_func_bc.interpfunc
-                if func_interp == 'print':
-                    retval = builtin_print(args[0])
-                elif func_interp == 'str':
-                    retval = builtin_str(args[0])
-                elif func_interp == 'id':
-                    retval = builtin_id(args[0])
-                else:
-                    raise Exception("Unresolved variable %s" % func_interp)
+                frame_stack.append((frame, bc, pc))
+                ctx.suspendable = ctx.task_level
+                retval = call_builtin(ctx, w_func_bc.interpfunc, args)
+                frame_stack.pop()
+                if ctx.suspended:
+                    ctx.suspended = False
+                    sys.scheduler.current.suspend(frame, bc, pc, RESUME_CALL, 0)
+                    return None
                 frame.push(retval)
             else:
-                func_bc = w_func_bc.bytecode
                 frame_stack.append((frame, bc, pc))
-                bc = func_bc
-                frame = Frame(bc)
+                bc = w_func_bc.get_bytecode()
+                frame = new_call_frame(w_func_bc, bc, args)
                 pc = 0
                 bytecode = bc.code
-                for index, arg in enumerate(args):
-                    frame.vars[index] = arg
-                if len(args) != len(frame.vars): # recursion
-                    frame.vars[len(args)] = Function(bc, None)
+                # function entry
+                driver.can_enter_jit(pc=pc, bytecode=bytecode, bc=bc, frame=frame,
+                                     frame_stack=frame_stack, base=base, ctx=ctx,
+                                     sys=sys, filename=filename)
         elif c == Code.RETURN_VALUE:
             retval = frame.pop()
+            if len(frame_stack) == base:
+                return retval
             frame, bc, pc = frame_stack.pop()
             bytecode = bc.code
             frame.push(retval)
@@ -200,7 +847,35 @@ def interpret_bytecode(sys, filename, frame, bc):
                 pc = arg
                 frame.push(top)
         elif c == Code.JMP:
-            pc = arg
+            if arg < pc:
+                # backward jump: the target is a loop header
+                pc = arg
+                if sys.output is not None:
+                    sys.output.tick()
+                driver.can_enter_jit(pc=pc, bytecode=bytecode, bc=bc, frame=frame,
+                                     frame_stack=frame_stack, base=base, ctx=ctx,
+                                     sys=sys, filename=filename)
+            else:
+                pc = arg
+        elif c == Code.GET_ITER:
+            frame.push(frame.pop().iter())
+        elif c == Code.FOR_ITER:
+            it = frame.top()
+            assert isinstance(it, Iterator)
+            frame_stack.append((frame, bc, pc))
+            ctx.suspendable = ctx.task_level and isinstance(it, ChannelIterator)
+            elem = it.next(ctx)
+            ctx.suspendable = False
+            frame_stack.pop()
+            if ctx.suspended:
+                ctx.suspended = False
+                sys.scheduler.current.suspend(frame, bc, pc, RESUME_ITER, arg)
+                return None
+            if elem is None:
+                frame.pop()
+                pc = arg
+            else:
+                frame.push(elem)
         elif c == Code.BINARY_ADD:
             right = frame.pop()
             left = frame.pop()
@@ -253,53 +928,78 @@ def interpret_bytecode(sys, filename, frame, bc):
                 pval = Boolean.from_raw(True)
             frame.push(pval)
         elif c == Code.ABORT:
-            top = frame.pop()
-            print('Error: %s' % top)
-            exit(1)
+            raise AbortError(frame.pop().str())
         elif c == Code.NOOP:
             pass
         elif c == Code.IMPORT_MODULE:
             module_name = frame.pop()
             path = find_module(sys, filename, module_name)
-            module = load_module(sys, path)
-            frame.push(module)
+            if sys.lazy_imports:
+                frame.push(LazyModule(sys, path))
+            else:
+                module = import_module(sys, path)
+                bc.link_members(pc - 2, module.exports)
+                frame.push(module)
         elif c == Code.IMPORT_MEMBER:
             member_name = frame.pop()
             module = frame.pop()
-            member = module.get(member_name)
-            frame.vars[arg] = member
+            if isinstance(module, Module):
+                frame.set_var(arg, module.member(bc.member_slot(pc - 2, module.exports, member_name)))
+            else:
+                frame.set_var(arg, module.get(member_name))
             frame.push(module)
 
 
+def get_item(bc, pc, obj, attr):
+    """Member ``attr`` of ``obj`` read by the instruction at ``pc``."""
+    if isinstance(obj, Module):
+        return obj.member(bc.member_slot(pc, obj.exports, attr))
+    val = obj.get(attr)
+    if isinstance(val, Function):
+        val.obj = obj
+    return val
+
 def find_module(sys, filename, module_name):
     if module_name.strval.startswith('./'):
         idx = len(filename) - 1
         while idx >= 0 and filename[idx] != '/':
             idx -= 1
-        cwd = filename[0:idx] if idx >= 0 else filename
-        return '%s/%s.mo' % (cwd, module_name.strval[2:len(module_name.strval)])
+        cwd = filename[0:idx] if idx >= 0 else '.'
+        return rnormpath('%s/%s.mo' % (cwd, module_name.strval[2:len(module_name.strval)]))
     else:
-        return '%s/%s.mo' % (sys.get_libs_path(), module_name.strval)
+        return rnormpath('%s/%s.mo' % (sys.get_libs_path(), module_name.strval))
 
 def read_source(filename):
-    f = open_file_as_stream(filename)
-    source = f.readall()
-    f.close()
-    sources = source.splitlines()
-    sources = [line for line in sources if not line.strip().startswith('#')]
-    source = '\n'.join(sources)
-    return source
+    """Read a source file in one pass; comments are left to the lexer."""
+    return read_file(filename)
 
-def compile_source(filename, source):
-    bnf_node = parse_source(filename, source)
+class CompileError(Exception):
+    """A module that does not parse, with the error message."""
+    def __init__(self, message):
+        self.message = message
+
+def parse_module(sys, filename, source):
+    """Parse a module; the error is printed, or raised as a CompileError when ``sys.output`` is set."""
+    if sys.output is None:
+        return parse_source(filename, source)
+    try:
+        return parse(source)
+    except ParseError as e:
+        raise CompileError(e.nice_error_message(filename, source))
+    except LexerError as e:
+        raise CompileError(e.nice_error_message(filename))
+
+def compile_ast(filename, bnf_node):
     if not bnf_node:
         raise Exception("We cannot get source bnf node.")
-        return
 
-    compiler = Compiler()
+    compiler = Compiler(filename=filename)
     compiler.dispatch(bnf_node)
-    bc = compiler.create_bytecode()
-    return Frame(bc)
+    return compiler.create_bytecode(compiler.create_export_table())
+
+def compile_source(filename, source):
+    bnf_node = parse_source(filename, source)
+    return Frame(compile_ast(filename, bnf_node))
 
 def init_sys(executable):
     sys = Sys()
@@ -314,8 +1014,143 @@ def init_sys(executable):
         sys.set_cwd(os.getcwd())
     return sys
 
+def cached_bytecode(sys, filename):
+    """Bytecode of a module from the code cache or a precompiled artifact, or None."""
+    if sys.code_cache is not None:
+        bc = sys.code_cache.get(filename)
+        if bc is not None:
+            return bc
+    bc = load_artifact(filename)
+    if bc is not None and sys.code_cache is not None:
+        sys.code_cache.put(filename, bc)
+    return bc
+
 def load_module(sys, filename):
-    source = read_source(filename)
-    frame = compile_source(filename, source)
-    interpret_bytecode(sys, filename, frame, frame.bytecode)
-    return Module(frame)
+    timer = sys.timer
+    timings = None
+    if timer is not None:
+        timings = timer.start(filename)
+    # loading cached or precompiled bytecode is charged to reading
+    bc = cached_bytecode(sys, filename)
+    if bc is None:
+        source = read_source(filename)
+        if timings is not None:
+            timings.read = timings.lap()
+        bnf_node = parse_module(sys, filename, source)
+        if timings is not None:
+            timings.parse = timings.lap()
+        bc = compile_ast(filename, bnf_node)
+        if sys.code_cache is not None:
+            sys.code_cache.put(filename, bc)
+    elif timings is not None:
+        timings.read = timings.lap()
+    frame = Frame(bc)
+    if timings is not None:
+        timings.compile = timings.lap()
+    if sys.dump_bytecode:
+        print(frame.bytecode.dump_tree())
+    if allocstats.ENABLED and alloc_stats.enabled:
+        opcode = alloc_stats.opcode
+        interpret_bytecode(sys, filename, frame, frame.bytecode)
+        alloc_stats.opcode = opcode
+    else:
+        interpret_bytecode(sys, filename, frame, frame.bytecode)
+    if timings is not None:
+        timer.finish(timings)
+    exports = frame.bytecode.exports
+    values = [frame.vars[slot] for slot in exports.slots]
+    return Module(exports, values)
+
+def run_program(sys, filename):
+    """Run the main module, then the tasks it spawned, and return the module.
+
+    Tasks still waiting once no task can run, e.g. for a channel nobody
+    sends on any more, are dropped.
+    """
+    module = load_module(sys, filename)
+    run_tasks(sys)
+    return module
+
+def resume_task(sys, task):
+    """Run ``task`` until it finishes, returning its result, or is suspended again."""
+    if not task.started:
+        task.started = True
+        return call_function(sys, task.filename, task.frame_stack, task.fn, task.args)
+    wait = task.wait
+    task.wait = None
+    value = wait.complete()
+    frame = task.frame
+    pc = task.pc
+    if task.resume == RESUME_ITER and value is None:
+        # the channel was closed: leave the loop
+        frame.pop()
+        pc = task.jump
+    elif value is None:
+        frame.push(Null.singleton())
+    else:
+        frame.push(value)
+    return interpret_bytecode(sys, task.filename, frame, task.bc, task.frame_stack, pc, 0)
+
+def step_task(sys, task):
+    sched = sys.scheduler
+    previous = sched.current
+    sched.current = task
+    try:
+        result = resume_task(sys, task)
+    finally:
+        sched.current = previous
+    if task.wait is None:
+        task.finish(result if result is not None else Null.singleton())
+    else:
+        task.wait.park(task)
+
+def run_tasks(sys, until=None):
+    """Run tasks until ``until`` is ready, or without it until no task can run.
+
+    While tasks wait for I/O or sleep, the event loop is checked without
+    blocking once per round of the run queue, and blocked in when no task
+    can run.
+    """
+    # tasks to run before the event loop is checked again
+    round_left = 0
+    while until is None or not until.ready():
+        sched = sys.scheduler
+        loop = sys.event_loop
+        waiting = loop is not None and loop.pending()
+        task = None
+        if sched is not None and (round_left > 0 or not waiting):
+            task = sched.next_runnable()
+        if task is None:
+            if waiting:
+                block = sched is None or sched.runnable() == 0
+                if block and sys.output is not None:
+                    # the script may wait a while; show what it printed so far
+                    sys.output.flush()
+                loop.poll(block)
+                # let the tasks woken by the loop take their turn, then check ``until``
+                round_left = sched.runnable() if sched is not None else 0
+                continue
+            if until is None:
+                return
+            raise Exception("deadlock: every task is waiting")
+        if round_left > 0:
+            round_left -= 1
+        step_task(sys, task)
+
+def run_round(sys):
+    """Give every task that can run one turn."""
+    sched = sys.scheduler
+    for _ in range(sched.runnable()):
+        task = sched.next_runnable()
+        if task is None:
+            return
+        step_task(sys, task)
+
+def import_module(sys, path):
+    """Load the module at ``path`` unless it has been imported already."""
+    try:
+        return sys.modules[path]
+    except KeyError:
+        module = load_module(sys, path)
+        sys.modules[path] = module
+        return module
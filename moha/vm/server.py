@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""``moha serve``: run many scripts in one long-lived interpreter.
+
+The server listens on a Unix domain socket and runs one script per
+connection, one connection at a time. Every script gets a fresh ``Sys``,
+so it and the modules it imports start from a clean namespace, but the
+bytecode of every module is kept in a ``CodeCache`` shared by all
+requests and only recompiled when its source changes.
+
+A request is the command ``run`` and the path of the script, or ``stop``,
+encoded as artifact strings and ended by shutting down the client's
+write side. The server answers with messages made of a kind and a
+payload: ``o`` for printed output, ``e`` for an error and finally ``x``
+with the exit status. ``moha/client.py`` is the matching client.
+
+A client that stalls for ``CLIENT_TIMEOUT`` seconds while its request is
+received, or its output sent, is dropped, and requests larger than
+``MAX_REQUEST`` bytes are refused, so one client cannot hold up the ones
+queued behind it.
+"""
+
+import os
+
+from rpython.rlib import rsignal
+from rpython.rlib.objectmodel import we_are_translated
+from rpython.rlib.rsocket import RSocket, UNIXAddress, SocketError, AF_UNIX, SOCK_STREAM
+
+from moha.vm.artifact import Writer, Reader, source_stamp
+from moha.vm.runtime import init_sys, run_program, AbortError, CompileError
+from moha.vm.utils import monotonic_ns
+
+#: printed output is sent once this many bytes are buffered
+OUTPUT_BUFFER = 4096
+#: or once this many nanoseconds have passed since output was last sent
+OUTPUT_INTERVAL = 50 * 1000000
+#: loop iterations between checks of that interval while a script computes
+TICKS_PER_CHECK = 1000
+#: seconds a client may stall while the server receives or sends
+CLIENT_TIMEOUT = 10.0
+#: largest request accepted
+MAX_REQUEST = 65536
+
+class CachedBytecode(object):
+
+    def __init__(self, mtime, size, bytecode):
+        self.mtime = mtime
+        self.size = size
+        self.bytecode = bytecode
+
+class CodeCache(object):
+    """Module bytecode by path, valid while the source keeps its size and modification time."""
+
+    def __init__(self):
+        self.entries = {}
+
+    def get(self, filename):
+        entry = self.entries.get(filename, None)
+        if entry is None:
+            return None
+        try:
+            mtime, size = source_stamp(filename)
+        except OSError:
+            return None
+        if mtime != entry.mtime or size != entry.size:
+            return None
+        return entry.bytecode
+
+    def put(self, filename, bytecode):
+        try:
+            mtime, size = source_stamp(filename)
+        except OSError:
+            return
+        self.entries[filename] = CachedBytecode(mtime, size, bytecode)
+
+class Output(object):
+    """Destination of ``print`` set in ``sys.output``; this one writes to the process stdout unbuffered."""
+
+    def write(self, data):
+        while data:
+            written = os.write(1, data)
+            data = data[written:]
+
+    def flush(self):
+        pass
+
+    def tick(self):
+        """Called at every loop iteration of the script."""
+        pass
+
+class SocketOutput(Output):
+    """Streams printed output to a client as ``o`` messages.
+
+    Output is buffered, but sent once ``OUTPUT_INTERVAL`` has passed
+    since output was last sent, checked on writes and every
+    ``TICKS_PER_CHECK`` loop iterations, and whenever the script blocks
+    waiting for I/O.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.buffer = []
+        self.buffered = 0
+        self.broken = False
+        self.last_sent = monotonic_ns()
+        self.ticks = 0
+
+    def write(self, data):
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= OUTPUT_BUFFER or monotonic_ns() - self.last_sent >= OUTPUT_INTERVAL:
+            self.flush()
+
+    def tick(self):
+        if self.buffered > 0:
+            self.ticks += 1
+            if self.ticks >= TICKS_PER_CHECK:
+                self.ticks = 0
+                if monotonic_ns() - self.last_sent >= OUTPUT_INTERVAL:
+                    self.flush()
+
+    def flush(self):
+        if self.buffered > 0:
+            data = ''.join(self.buffer)
+            self.buffer = []
+            self.buffered = 0
+            self.send('o', data)
+            self.last_sent = monotonic_ns()
+
+    def send(self, kind, payload):
+        if self.broken:
+            return
+        w = Writer()
+        w.str(kind)
+        w.str(payload)
+        try:
+            self.conn.sendall(w.getvalue())
+        except SocketError:
+            # the client went away; the script still runs to completion
+            self.broken = True
+
+def recv_request(conn):
+    """The request, read until the client shuts down its write side; None if it is too large."""
+    chunks = []
+    size = 0
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > MAX_REQUEST:
+            return None
+        chunks.append(chunk)
+    return ''.join(chunks)
+
+def run_script(executable, cache, output, path):
+    """Run the script at ``path`` and return its exit status."""
+    # check the script itself up front, so that an OSError the script
+    # runs into is reported as its own error
+    try:
+        os.close(os.open(path, os.O_RDONLY, 0))
+    except OSError as e:
+        output.send('e', 'cannot read %s: %s' % (path, os.strerror(e.errno)))
+        return 1
+    sys = init_sys(executable)
+    sys.code_cache = cache
+    sys.output = output
+    status = 0
+    try:
+        run_program(sys, path)
+    except CompileError as e:
+        status = 1
+        output.flush()
+        output.send('e', e.message)
+    except AbortError as e:
+        status = 1
+        output.flush()
+        output.send('e', 'Error: %s' % e.message)
+    except Exception as e:
+        status = 1
+        output.flush()
+        if we_are_translated():
+            output.send('e', 'error while running %s' % path)
+        else:
+            output.send('e', '%s: %s' % (e.__class__.__name__, e))
+    output.flush()
+    return status
+
+def handle(executable, cache, conn):
+    """Serve one request; returns False if the client asked the server to stop."""
+    # a stalled client must not hold up the requests queued behind it
+    conn.settimeout(CLIENT_TIMEOUT)
+    output = SocketOutput(conn)
+    try:
+        data = recv_request(conn)
+    except SocketError:
+        return True
+    if data is None:
+        output.send('e', 'request larger than %d bytes' % MAX_REQUEST)
+        output.send('x', '2')
+        return True
+    r = Reader(data, 0)
+    command = r.str()
+    if command == 'stop':
+        output.send('x', '0')
+        return False
+    elif command == 'run':
+        path = r.str()
+        output.send('x', '%d' % run_script(executable, cache, output, path))
+    else:
+        output.send('e', 'unknown command %s' % command)
+        output.send('x', '2')
+    return True
+
+def serve(executable, path):
+    """Accept requests on the Unix socket ``path`` until one asks to stop."""
+    if we_are_translated():
+        # a client hanging up must not kill the server
+        rsignal.pypysig_ignore(rsignal.SIGPIPE)
+    # bound under a temporary name, so that clients never find a socket
+    # that does not accept connections yet
+    tmp = '%s.%d' % (path, os.getpid())
+    try:
+        os.unlink(tmp)
+    except OSError:
+        pass
+    server = RSocket(AF_UNIX, SOCK_STREAM)
+    server.bind(UNIXAddress(tmp))
+    server.listen(16)
+    os.rename(tmp, path)
+    print('moha: serving on %s' % path)
+    cache = CodeCache()
+    running = True
+    while running:
+        fd, _ = server.accept()
+        conn = RSocket(AF_UNIX, SOCK_STREAM, 0, fd)
+        try:
+            running = handle(executable, cache, conn)
+        except Exception:
+            # a malformed request only fails its own connection
+            running = True
+        conn.close()
+    server.close()
+    os.unlink(path)
+    return 0
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""Lightweight tasks, channels and their cooperative scheduler.
+
+A ``Task`` runs a Moha function on its own ``frame_stack``. When it waits
+(``yield()``, a channel operation or ``join``) from its outermost
+interpreter loop, the loop saves the task's frame and pc in it and returns
+to the scheduler, which later resumes it where it stopped. Code that
+cannot be suspended that way, the main script or a function called back
+from a native builtin, instead runs the other tasks until its wait is
+over. The loop that runs tasks is ``run_tasks`` in ``runtime``.
+
+The scheduler's run queue holds only tasks that can run. A task that
+waits is parked on what it waits for, a channel, another task or the
+event loop, which puts it back on the run queue once it may go on.
+"""
+
+from moha.vm.allocstats import count_alloc
+from moha.vm.objects import W_Root, Iterator, Function
+
+#: how a suspended task continues: push the result of the call it waited
+#: in, or go on with the ``for`` loop over a channel it waited in
+RESUME_CALL = 0
+RESUME_ITER = 1
+
+class Queue(object):
+    """A FIFO list that is consumed from a head index instead of with pop(0)."""
+
+    def __init__(self):
+        self.items = []
+        self.head = 0
+
+    def size(self):
+        return len(self.items) - self.head
+
+    def push(self, item):
+        self.items.append(item)
+
+    def pop(self):
+        """Remove and return the first item, or None if there is none."""
+        if self.head >= len(self.items):
+            return None
+        item = self.items[self.head]
+        self.items[self.head] = None
+        self.head += 1
+        if self.head == len(self.items):
+            self.items = []
+            self.head = 0
+        elif self.head >= 32 and self.head * 2 >= len(self.items):
+            # drop the consumed half so the list does not grow forever
+            self.items = self.items[self.head:]
+            self.head = 0
+        return item
+
+    def first(self):
+        if self.head >= len(self.items):
+            return None
+        return self.items[self.head]
+
+class Wait(object):
+    """Something a task waits for."""
+
+    def ready(self):
+        return True
+
+    def complete(self):
+        """Finish the wait once ``ready``; returns the result or None."""
+        return None
+
+    def park(self, task):
+        """Hold ``task`` until the wait may be ready, then ``wake`` it."""
+        task.wake()
+
+class YieldWait(Wait):
+    pass
+
+class SendWait(Wait):
+    """Waits for room in a buffered channel, then sends."""
+
+    def __init__(self, channel, value):
+        self.channel = channel
+        self.value = value
+
+    def ready(self):
+        return self.channel.closed or self.channel.buffer.size() < self.channel.capacity
+
+    def complete(self):
+        self.channel.put(self.value)
+        return None
+
+    def park(self, task):
+        self.channel.senders.push(task)
+
+class TakenWait(Wait):
+    """Waits until a receiver has taken the value sent on an unbuffered channel."""
+
+    def __init__(self, channel, ticket):
+        self.channel = channel
+        self.ticket = ticket
+
+    def ready(self):
+        return self.channel.received >= self.ticket
+
+    def park(self, task):
+        self.channel.senders.push(task)
+
+class RecvWait(Wait):
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def ready(self):
+        return self.channel.closed or self.channel.buffer.size() > 0
+
+    def complete(self):
+        return self.channel.take()
+
+    def park(self, task):
+        self.channel.receivers.push(task)
+
+class JoinWait(Wait):
+
+    def __init__(self, task):
+        self.task = task
+
+    def ready(self):
+        return self.task.done
+
+    def complete(self):
+        return self.task.result
+
+    def park(self, task):
+        self.task.joiners.append(task)
+
+class Channel(W_Root):
+    """A FIFO of values between tasks.
+
+    With a capacity of 0 a sender waits until its value is received,
+    otherwise only while the buffer is full. Receiving from a closed,
+    empty channel returns null, and ``for`` loops over a channel stop.
+    """
+
+    def __init__(self, capacity):
+        count_alloc('Channel')
+        self.capacity = capacity
+        self.buffer = Queue()
+        self.closed = False
+        self.sent = 0
+        self.received = 0
+        # tasks parked until they can send or receive
+        self.senders = Queue()
+        self.receivers = Queue()
+
+    def put(self, value):
+        if self.closed:
+            raise Exception("send on a closed channel")
+        self.buffer.push(value)
+        self.sent += 1
+        wake_first(self.receivers)
+        return self.sent
+
+    def take(self):
+        value = self.buffer.pop()
+        if value is None:
+            return None
+        self.received += 1
+        if self.capacity > 0:
+            wake_first(self.senders)
+        else:
+            # unbuffered senders are parked in the order they sent
+            while True:
+                task = self.senders.first()
+                if task is None or not (isinstance(task, Task) and task.wait.ready()):
+                    break
+                wake_first(self.senders)
+        return value
+
+    def close(self):
+        self.closed = True
+        while wake_first(self.senders):
+            pass
+        while wake_first(self.receivers):
+            pass
+
+    def get(self, key):
+        name = key.str()
+        if name not in ('send', 'recv', 'close'):
+            raise Exception("channel has no method %s" % name)
+        return Function(None, 'channel.' + name)
+
+    def iter(self):
+        return ChannelIterator(self)
+
+    def str(self):
+        return '<channel>'
+
+class ChannelIterator(Iterator):
+
+    def __init__(self, channel):
+        count_alloc('ChannelIterator')
+        self.channel = channel
+
+    def next(self, ctx):
+        return ctx.receive(self.channel)
+
+def wake_first(queue):
+    """Wake the first task parked in ``queue``; returns whether there was one."""
+    task = queue.pop()
+    if task is None:
+        return False
+    assert isinstance(task, Task)
+    task.wake()
+    return True
+
+class Task(W_Root):
+    """A function running as a cooperatively scheduled task."""
+
+    def __init__(self, fn, args, filename, callers=None):
+        count_alloc('Task')
+        self.fn = fn
+        self.args = args
+        self.filename = filename
+        # the frames it was spawned from, searched for names after its own
+        self.callers = callers
+        self.scheduler = None
+        self.frame_stack = []
+        self.started = False
+        self.done = False
+        self.result = None
+        self.wait = None
+        # where a suspended task continues
+        self.frame = None
+        self.bc = None
+        self.pc = 0
+        self.resume = RESUME_CALL
+        self.jump = 0
+        # tasks parked until this one is done
+        self.joiners = []
+
+    def suspend(self, frame, bc, pc, resume, jump):
+        self.frame = frame
+        self.bc = bc
+        self.pc = pc
+        self.resume = resume
+        self.jump = jump
+
+    def wake(self):
+        self.scheduler.run_queue.push(self)
+
+    def finish(self, result):
+        self.done = True
+        self.result = result
+        for joiner in self.joiners:
+            joiner.wake()
+        self.joiners = []
+
+    def get(self, key):
+        name = key.str()
+        if name == 'join':
+            return Function(None, 'task.join')
+        elif name == 'done':
+            return Function(None, 'task.done')
+        raise Exception("task has no method %s" % name)
+
+    def str(self):
+        return '<task>'
+
+class Scheduler(object):
+    """FIFO queue of the tasks that can run, and the task running now (None for the main script)."""
+
+    def __init__(self):
+        self.run_queue = Queue()
+        self.current = None
+
+    def spawn(self, task):
+        task.scheduler = self
+        self.run_queue.push(task)
+
+    def next_runnable(self):
+        """Remove and return the first task that can run, or None."""
+        while True:
+            task = self.run_queue.pop()
+            if task is None:
+                return None
+            assert isinstance(task, Task)
+            wait = task.wait
+            if wait is None or wait.ready():
+                return task
+            # woken, but another task took what it waited for first
+            wait.park(task)
+
+    def runnable(self):
+        return self.run_queue.size()
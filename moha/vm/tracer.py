@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+
+from rpython.rlib.listsort import make_timsort_class
+from rpython.rlib.streamio import open_file_as_stream
+
+from moha.vm import code as Code
+
+#: Whether opcode tracing is compiled into the interpreter loop. This is
+#: read as a constant during translation, so with the default the tracing
+#: code is folded away entirely. ``rpython targetmoha.py --opcode-tracer``
+#: and untranslated runs turn it on.
+ENABLED = False
+
+class Count(object):
+
+    def __init__(self, label, count):
+        self.label = label
+        self.count = count
+
+def _count_lt(a, b):
+    if a.count != b.count:
+        return a.count > b.count
+    return a.label < b.label
+
+CountSort = make_timsort_class(lt=_count_lt)
+
+def json_string(s):
+    return '"%s"' % s.replace('\\', '\\\\').replace('"', '\\"')
+
+class OpcodeTracer(object):
+    """Counts executed opcodes, consecutive opcode pairs and code sites.
+
+    A site is an instruction at a given pc of a given Bytecode.
+    """
+
+    def __init__(self):
+        self.opcodes = {}
+        self.pairs = {}
+        self.sites = {}
+        self.previous = -1
+
+    def trace(self, bc, pc, opcode):
+        self.opcodes[opcode] = self.opcodes.get(opcode, 0) + 1
+        if self.previous != -1:
+            pair = self.previous * 256 + opcode
+            self.pairs[pair] = self.pairs.get(pair, 0) + 1
+        self.previous = opcode
+        try:
+            counts = self.sites[bc]
+        except KeyError:
+            counts = {}
+            self.sites[bc] = counts
+        counts[pc] = counts.get(pc, 0) + 1
+
+    def opcode_counts(self):
+        counts = [Count(Code.pretty(opcode), count) for opcode, count in self.opcodes.iteritems()]
+        CountSort(counts).sort()
+        return counts
+
+    def pair_counts(self):
+        counts = []
+        for pair, count in self.pairs.iteritems():
+            label = '%s %s' % (Code.pretty(pair / 256), Code.pretty(pair % 256))
+            counts.append(Count(label, count))
+        CountSort(counts).sort()
+        return counts
+
+    def site_counts(self):
+        counts = []
+        for bc, pcs in self.sites.iteritems():
+            for pc, count in pcs.iteritems():
+                label = '%s:%d %s %d %s' % (bc.filename, bc.line_at(pc), bc.name,
+                                            pc, Code.pretty(bc.code[pc]))
+                counts.append(Count(label, count))
+        CountSort(counts).sort()
+        return counts
+
+    def report(self, limit=20):
+        lines = ['opcodes:']
+        for entry in self.opcode_counts():
+            lines.append('  %10d  %s' % (entry.count, entry.label))
+        lines.append('pairs:')
+        for entry in self.pair_counts()[:limit]:
+            lines.append('  %10d  %s' % (entry.count, entry.label))
+        lines.append('sites:')
+        for entry in self.site_counts()[:limit]:
+            lines.append('  %10d  %s' % (entry.count, entry.label))
+        return '\n'.join(lines)
+
+    def to_json(self):
+        opcodes = ['%s: %d' % (json_string(e.label), e.count) for e in self.opcode_counts()]
+        pairs = ['%s: %d' % (json_string(e.label), e.count) for e in self.pair_counts()]
+        sites = []
+        for bc, pcs in self.sites.iteritems():
+            for pc, count in pcs.iteritems():
+                sites.append('{"file": %s, "function": %s, "line": %d, "pc": %d, "opcode": %s, "count": %d}' % (
+                    json_string(bc.filename), json_string(bc.name), bc.line_at(pc), pc,
+                    json_string(Code.pretty(bc.code[pc])), count))
+        return '{"opcodes": {%s}, "pairs": {%s}, "sites": [%s]}\n' % (
+            ', '.join(opcodes), ', '.join(pairs), ', '.join(sites))
+
+    def write_json(self, path):
+        f = open_file_as_stream(path, 'w')
+        f.write(self.to_json())
+        f.close()
@@ -1,3 +1,6 @@
 # -*- coding: utf-8 -*-
 
 from .sorted_set import SortedSet, NOT_FOUND
+from .lru import LRUCache
+from .clock import monotonic_ns
+from .files import read_file, write_file
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from rpython.rlib import rtime
+from rpython.rtyper.lltypesystem import lltype, rffi
+
+def monotonic_ns():
+    """Nanoseconds from a monotonic clock with an arbitrary origin.
+
+    Platforms without clock_gettime fall back to the wall clock.
+    """
+    if rtime.HAS_CLOCK_GETTIME:
+        with lltype.scoped_alloc(rtime.TIMESPEC) as ts:
+            if rtime.c_clock_gettime(rtime.CLOCK_MONOTONIC, ts) == 0:
+                return (rffi.getintfield(ts, 'c_tv_sec') * 1000000000 +
+                        rffi.getintfield(ts, 'c_tv_nsec'))
+    return int(time.time() * 1000000000)
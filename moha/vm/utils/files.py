@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+def read_file(path):
+    """Read a whole file with one read sized by fstat."""
+    fd = os.open(path, os.O_RDONLY, 0)
+    try:
+        size = os.fstat(fd).st_size
+        chunks = []
+        while True:
+            # files whose size is not known up front, e.g. pipes, take more reads
+            chunk = os.read(fd, max(size, 65536))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size = 0
+    finally:
+        os.close(fd)
+    if len(chunks) == 1:
+        return chunks[0]
+    return ''.join(chunks)
+
+def write_file(path, data):
+    """Write ``data`` to a temporary file renamed over ``path``, so readers never see it partly written."""
+    tmp = '%s.%d.tmp' % (path, os.getpid())
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        written = 0
+        while written < len(data):
+            written += os.write(fd, data[written:len(data)])
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
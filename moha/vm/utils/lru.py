@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from rpython.rlib.objectmodel import r_dict
+
+class LRUNode(object):
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.prev = self
+        self.next = self
+
+class LRUCache(object):
+    """Bounded mapping that evicts the least recently used entry.
+
+    Keys are compared with ``key_eq`` and hashed with ``key_hash``. Entries
+    form a doubly linked list ordered from most to least recently used.
+    """
+
+    def __init__(self, capacity, key_eq, key_hash):
+        self.capacity = capacity
+        self.entries = r_dict(key_eq, key_hash)
+        self.root = LRUNode(None, None)
+
+    def get(self, key):
+        node = self.entries.get(key, None)
+        if node is None:
+            return None
+        self._unlink(node)
+        self._link_front(node)
+        return node.value
+
+    def put(self, key, value):
+        node = self.entries.get(key, None)
+        if node is not None:
+            node.value = value
+            self._unlink(node)
+            self._link_front(node)
+            return
+        node = LRUNode(key, value)
+        self.entries[key] = node
+        self._link_front(node)
+        if len(self.entries) > self.capacity:
+            last = self.root.prev
+            self._unlink(last)
+            del self.entries[last.key]
+
+    def size(self):
+        return len(self.entries)
+
+    def clear(self):
+        self.entries.clear()
+        self.root.prev = self.root
+        self.root.next = self.root
+
+    def _unlink(self, node):
+        node.prev.next = node.next
+        node.next.prev = node.prev
+
+    def _link_front(self, node):
+        node.prev = self.root
+        node.next = self.root.next
+        self.root.next.prev = node
+        self.root.next = node
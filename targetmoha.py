@@ -1,26 +1,145 @@
 # -*- coding: utf-8 -*-
 
+import os
 import sys
 
-from rpython.rlib.streamio import open_file_as_stream
+from rpython.rlib.rpath import rnormpath
 from rpython.jit.codewriter.policy import JitPolicy
 
-from moha.vm.main import interpret_source
-from moha.vm.runtime import init_sys, load_module
+from moha.vm.runtime import init_sys, run_program, AbortError
+from moha.vm.image import read_image, write_image
+from moha.vm.server import serve
+from moha.vm.jitstats import jit_stats, jit_hooks
+from moha.vm.profiler import Profiler
+from moha.vm.phases import PhaseTimer
+from moha.vm import tracer, allocstats
+from moha.vm.allocstats import alloc_stats
+from moha.vm.tracer import OpcodeTracer
 
+USAGE = """usage: moha [options] <file>
+       moha serve <socket>       run scripts sent by moha-client over a Unix socket
+
+options:
+  --jit-stats                report compiled traces, bridges and aborts per loop at exit
+  --time-phases              report read/parse/compile/execute time per module at exit
+  --lazy-imports             load imported modules when one of their members is first used
+  --dump-bytecode            print the bytecode of every loaded module and its functions
+  --snapshot=<image>         run <file> as a warm-up script, then write the loaded modules to <image>
+  --image=<image>            start with the modules of <image> already imported
+  --profile=<file>           sample the call stack and write collapsed stacks for flamegraph tools
+  --profile-interval=<n>     instructions between two samples (default: 1000)
+  --alloc-stats              report allocations per object type and opcode, and peak memory at exit
+                             (translated binaries need: rpython targetmoha.py --alloc-stats)
+  --opcode-stats             report executed opcodes, opcode pairs and hot sites at exit
+  --opcode-stats=<file>      write the same counts as JSON
+                             (translated binaries need: rpython targetmoha.py --opcode-tracer)
+"""
 
 def main(argv):
-    executable, filename = argv[0], argv[1]
+    executable = argv[0]
+    if len(argv) > 1 and argv[1] == 'serve':
+        if len(argv) != 3:
+            print(USAGE)
+            return 1
+        return serve(executable, argv[2])
+    filename = None
+    profile = None
+    profile_interval = 1000
+    opcode_stats = False
+    opcode_stats_path = None
+    time_phases = False
+    dump_bytecode = False
+    lazy_imports = False
+    snapshot = None
+    image = None
+    for arg in argv[1:]:
+        if arg == '--jit-stats':
+            jit_stats.enabled = True
+        elif arg == '--time-phases':
+            time_phases = True
+        elif arg == '--dump-bytecode':
+            dump_bytecode = True
+        elif arg == '--lazy-imports':
+            lazy_imports = True
+        elif arg.startswith('--snapshot='):
+            snapshot = arg[len('--snapshot='):]
+        elif arg.startswith('--image='):
+            image = arg[len('--image='):]
+        elif arg.startswith('--profile='):
+            profile = arg[len('--profile='):]
+        elif arg.startswith('--profile-interval='):
+            try:
+                profile_interval = int(arg[len('--profile-interval='):])
+            except ValueError:
+                profile_interval = 0
+            if profile_interval <= 0:
+                print(USAGE)
+                return 1
+        elif arg == '--alloc-stats':
+            if not allocstats.ENABLED:
+                print('moha was built without --alloc-stats')
+                return 1
+            alloc_stats.enabled = True
+        elif arg == '--opcode-stats' or arg.startswith('--opcode-stats='):
+            if not tracer.ENABLED:
+                print('moha was built without --opcode-tracer')
+                return 1
+            opcode_stats = True
+            if arg.startswith('--opcode-stats='):
+                opcode_stats_path = arg[len('--opcode-stats='):]
+        elif arg.startswith('--'):
+            print(USAGE)
+            return 1
+        else:
+            filename = arg
+            break
+    if filename is None:
+        print(USAGE)
+        return 1
     sys = init_sys(executable)
-    load_module(sys, filename)
+    sys.dump_bytecode = dump_bytecode
+    sys.lazy_imports = lazy_imports
+    if time_phases:
+        sys.timer = PhaseTimer()
+    if profile is not None:
+        sys.profiler = Profiler(profile_interval)
+    if opcode_stats:
+        sys.tracer = OpcodeTracer()
+    if image is not None and not read_image(sys, image):
+        os.write(2, 'moha: %s cannot be used, starting without it\n' % image)
+    try:
+        module = run_program(sys, filename)
+    except AbortError as e:
+        print('Error: %s' % e.message)
+        return 1
+    if snapshot is not None:
+        sys.modules[rnormpath(filename)] = module
+        write_image(sys, snapshot)
+    if sys.tracer is not None:
+        if opcode_stats_path is not None:
+            sys.tracer.write_json(opcode_stats_path)
+        else:
+            print(sys.tracer.report())
+    if sys.profiler is not None:
+        sys.profiler.write(profile)
+    if sys.timer is not None:
+        print(sys.timer.report())
+    if alloc_stats.enabled:
+        print(alloc_stats.report())
+    if jit_stats.enabled:
+        print(jit_stats.report())
     return 0
 
 def target(driver, args):
     driver.exe_name = 'bin/moha'
+    tracer.ENABLED = '--opcode-tracer' in args
+    allocstats.ENABLED = '--alloc-stats' in args
     return main, None
 
 def jitpolicy(driver):
-    return JitPolicy()
+    return JitPolicy(jit_hooks)
 
 if __name__ == '__main__':
-    main(sys.argv)
+    tracer.ENABLED = True
+    allocstats.ENABLED = True
+    sys.exit(main(sys.argv))
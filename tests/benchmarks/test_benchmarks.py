@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import sys
+
+import pytest
+from moha.vm.runtime import init_sys, load_module
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+import run
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(root, 'benchmarks', '*.mo'))))
+def test_benchmark_runs(path):
+    load_module(init_sys('moha'), path)
+
+def test_compare_flags_regressions():
+    baseline = {'python': {'fib': {'status': 'ok', 'time': 1.0, 'maxrss_kb': 1000}}}
+    results = {'python': {
+        'fib': {'status': 'ok', 'time': 1.5, 'maxrss_kb': 1050},
+        'occur': {'status': 'failed', 'exit': 1},
+        'new': {'status': 'ok', 'time': 9.0, 'maxrss_kb': 9000},
+    }}
+    regressions = run.compare(results, baseline, 0.1)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('python/fib: time')
+    assert regressions[1] == 'python/occur: failed with exit status 1'
+    assert run.compare({'python': {'fib': results['python']['fib']}}, baseline, 0.6) == []
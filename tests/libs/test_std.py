@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import pytest
+from moha.vm.runtime import init_sys, load_module
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+@pytest.mark.parametrize('path', sorted(glob.glob(os.path.join(root, 'std', 'test_*.mo'))))
+def test_std(path):
+    sys = init_sys('moha')
+    load_module(sys, path)
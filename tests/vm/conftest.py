@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from moha.vm.runtime import init_sys, run_program
+
+@pytest.fixture
+def run(tmpdir, capsys):
+    """Run a Moha source string and return the printed lines."""
+    def _run(source):
+        path = tmpdir.join('main.mo')
+        path.write(source)
+        sys = init_sys('moha')
+        run_program(sys, str(path))
+        out, _ = capsys.readouterr()
+        return out.splitlines()
+    return _run
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from moha.vm import allocstats
+from moha.vm.allocstats import AllocStats, read_proc_status
+from moha.vm.runtime import init_sys, load_module
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = AllocStats()
+    stats.enabled = True
+    monkeypatch.setattr(allocstats, 'ENABLED', True)
+    monkeypatch.setattr(allocstats, 'alloc_stats', stats)
+    monkeypatch.setattr('moha.vm.runtime.alloc_stats', stats)
+    return stats
+
+def test_allocations_per_type_and_opcode(tmpdir, stats):
+    path = tmpdir.join('main.mo')
+    path.write('def f(n) { return [n + 1]; }\nf(1);\nf(2);\n')
+    load_module(init_sys('moha'), str(path))
+    assert stats.types['Array'] == 2
+    assert stats.types['Frame'] == 3
+    assert stats.sites[allocstats.Code.BINARY_ADD]['Integer'] == 2
+    assert stats.sites[allocstats.Code.CALL_FUNC]['Frame'] == 2
+    report = stats.report()
+    assert 'BUILD_ARRAY Array' in report
+    assert 'peak rss' in report
+
+def test_disabled_by_default(tmpdir):
+    stats = allocstats.alloc_stats
+    total = stats.total
+    path = tmpdir.join('main.mo')
+    path.write('print(1 + 2);\n')
+    load_module(init_sys('moha'), str(path))
+    assert stats.total == total
+
+def test_read_proc_status():
+    assert read_proc_status('NoSuchField') == 'unknown'
+
+def test_method_calls_do_not_bind(tmpdir, stats):
+    path = tmpdir.join('main.mo')
+    path.write('a = [];\nfor (i in range(100)) { a.push(i); }\nprint(a.length());\n')
+    load_module(init_sys('moha'), str(path))
+    assert stats.sites.get(allocstats.Code.LOAD_METHOD, {}).get('Function', 0) == 0
+    assert stats.types.get('Function', 0) < 10
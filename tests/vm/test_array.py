@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+def test_range(run):
+    assert run('print(range(4)); print(range(2, 5)); print(range(3, 1));') == ['[0,1,2,3]', '[2,3,4]', '[]']
+
+def test_sum(run):
+    assert run('print(range(101).sum()); print([].sum());') == ['5050', '0']
+
+def test_sum_of_strings_falls_back_to_add(run):
+    assert run('print(["a", "b"].sum());') == ['ab']
+
+def test_min_max(run):
+    assert run('a = [3, 1, 4, 1, 5]; print(a.min()); print(a.max());') == ['1', '5']
+
+def test_min_max_strings(run):
+    assert run('a = ["b", "a", "c"]; print(a.min()); print(a.max());') == ['a', 'c']
+
+def test_dot(run):
+    assert run('print([1, 2, 3].dot([4, 5, 6]));') == ['32']
+
+def test_elementwise_with_scalar(run):
+    assert run('print([1, 2].add(10)); print([1, 2].mul(3));') == ['[11,12]', '[3,6]']
+
+def test_elementwise_with_array(run):
+    assert run('print([1, 2].add([10, 20])); print([1, 2].mul([3, 4]));') == ['[11,22]', '[3,8]']
+
+def test_fill(run):
+    assert run('a = range(3); a.fill(7); print(a);') == ['[7,7,7]']
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from moha.vm import artifact
+from moha.vm.runtime import init_sys, load_module
+from moha.precompile import Precompiler, main
+
+LIB = '''
+def double(x) { return x * 2; }
+def point(x) { return {"x": x, y: def(p) { return p; }}; }
+flag = true;
+nothing = null;
+export double, point, flag, nothing as "lib";
+'''
+
+MAIN = '''
+import double, point, flag, nothing from "./lib";
+print(double(21));
+print(point(1).x);
+print(flag);
+print(nothing);
+'''
+
+def write_tree(tmpdir):
+    tmpdir.join('lib.mo').write(LIB)
+    main = tmpdir.join('main.mo')
+    main.write(MAIN)
+    return str(main)
+
+def run_module(path, capsys):
+    load_module(init_sys('moha'), path)
+    out, _ = capsys.readouterr()
+    return out.splitlines()
+
+def test_precompile_follows_imports(tmpdir, capsys):
+    path = write_tree(tmpdir)
+    expected = run_module(path, capsys)
+    precompiler = Precompiler(str(tmpdir), 1)
+    results = precompiler.run([path])
+    assert [os.path.basename(r.path) for r in results] == ['lib.mo', 'main.mo']
+    assert all(r.error is None for r in results)
+    assert precompiler.graph[path] == [str(tmpdir.join('lib.mo'))]
+    bc = artifact.load_artifact(path)
+    assert bc is not None and bc.exports is not None
+    assert artifact.load_artifact(str(tmpdir.join('lib.mo'))).constants[0].bytecode is not None
+    assert run_module(path, capsys) == expected == ['42', '1', 'true', 'null']
+
+def test_stale_artifacts_are_ignored(tmpdir, capsys):
+    path = write_tree(tmpdir)
+    assert main(['-q', '-j', '1', str(tmpdir)]) == 0
+    assert artifact.is_fresh(path)
+    tmpdir.join('main.mo').write('print(1);\n')
+    assert not artifact.is_fresh(path)
+    assert artifact.load_artifact(path) is None
+    assert run_module(path, capsys) == ['1']
+    results = Precompiler(str(tmpdir), 1).run([path])
+    assert [r.fresh for r in results] == [False]
+
+def test_parallel_compile_reports_failures(tmpdir, capsys):
+    write_tree(tmpdir)
+    tmpdir.join('broken.mo').write('x = ;\n')
+    assert main(['-j', '2', '--force', str(tmpdir)]) == 1
+    out, _ = capsys.readouterr()
+    assert 'FAILED' in out and 'broken.mo, line 1' in out
+    assert '2 compiled, 0 up to date, 1 failed' in out
+    assert not tmpdir.join('broken.moc').check()
+
+def test_damaged_artifact_is_ignored(tmpdir, capsys):
+    path = write_tree(tmpdir)
+    assert main(['-q', '-j', '1', str(tmpdir)]) == 0
+    moc = tmpdir.join('main.moc')
+    data = moc.read()
+    moc.write(data[:-8])
+    assert artifact.load_artifact(path) is None
+    assert run_module(path, capsys) == ['42', '1', 'true', 'null']
+    moc.write(data.replace(':', 'x:', 3))
+    assert artifact.load_artifact(path) is None
+    # the precompiler writes it again
+    results = Precompiler(str(tmpdir), 1).run([path])
+    assert [(r.fresh, r.error) for r in results if r.path == path] == [(False, None)]
+    assert artifact.load_artifact(path) is not None
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import pytest
-from moha.vm.grammar.v0_2_0 import parse_source
+from moha.vm.grammar.parser import parse_source
 
 def statement(source):
     tree = parse_source('test', source)
@@ -101,6 +101,14 @@ def test_statement_do():
     assert tree.children[0].children[1].symbol == 'block'
     assert tree.children[1].symbol == 'guardcommand'
 
+def test_statement_for():
+    tree = statement('for (e in [1, 2]) { print(e); }')
+    assert tree.symbol == 'for'
+    assert tree.children[0].symbol == 'IDENTIFIER'
+    assert tree.children[0].additional_info == 'e'
+    assert tree.children[1].symbol == 'array_literal'
+    assert tree.children[2].symbol == 'block'
+
 def test_statement_def():
     tree = statement('def test() { return null; }')
     assert tree.symbol == 'def'
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+def test_map(run):
+    assert run('print(map(def(e) { return e * 2; }, [1, 2, 3]));') == ['[2,4,6]']
+
+def test_map_empty_array(run):
+    assert run('print(map(def(e) { return e; }, []));') == ['[]']
+
+def test_filter(run):
+    assert run('print(filter(def(e) { return e > 1; }, [1, 2, 3]));') == ['[2,3]']
+
+def test_reduce(run):
+    assert run('print(reduce(def(a, b) { return a + b; }, [1, 2, 3], 10));') == ['16']
+
+def test_reduce_without_initial_value(run):
+    assert run('print(reduce(def(a, b) { return a * b; }, [2, 3, 4]));') == ['24']
+
+def test_each(run):
+    assert run('each(def(e) { print(e); }, [1, 2]);') == ['1', '2']
+
+def test_callback_resolves_globals_of_caller(run):
+    source = '''
+    def double(n) { return n * 2; }
+    def apply(array) { return map(def(e) { return double(e); }, array); }
+    print(apply([1, 2]));
+    '''
+    assert run(source) == ['[2,4]']
+
+def test_nested_native_calls(run):
+    source = '''
+    print(map(def(row) { return reduce(def(a, b) { return a + b; }, row, 0); }, [[1, 2], [3, 4]]));
+    '''
+    assert run(source) == ['[3,7]']
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+from moha.vm.runtime import compile_source, init_sys, interpret_bytecode, load_module
+
+def test_rebinding_a_global_invalidates_caches(run):
+    source = '''
+    x = 1;
+    def get() { return x; }
+    print(get());
+    x = 2;
+    print(get());
+    '''
+    assert run(source) == ['1', '2']
+
+def test_functions_resolve_globals_of_their_module(tmpdir, capsys):
+    tmpdir.join('lib.mo').write('''scale = 10;
+def helper(x) { return x * scale; }
+def apply(x) { return helper(x) + 1; }
+''')
+    path = tmpdir.join('main.mo')
+    path.write('''import apply from "./lib";
+scale = 1000;
+def helper(x) { return 0; }
+print(apply(2));
+''')
+    load_module(init_sys('moha'), str(path))
+    assert capsys.readouterr()[0] == '21\n'
+
+def test_enclosing_function_variables_are_nonlocal(run):
+    source = '''
+    x = "global";
+    def outer() {
+        x = "outer";
+        f = def(y) { return x; };
+        return f(1);
+    }
+    print(outer());
+    '''
+    assert run(source) == ['outer']
+
+def test_unbound_global_falls_back_to_builtins(run):
+    source = '''
+    def show(v) { print(v); }
+    show(1);
+    '''
+    assert run(source) == ['1']
+
+def test_global_slot_is_cached_per_site():
+    frame = compile_source('main.mo', 'def f(n) { return n + k; }\nk = 1;\nf(1);\n')
+    interpret_bytecode(init_sys('moha'), 'main.mo', frame, frame.bytecode)
+    f = frame.vars[frame.bytecode.vars.get('f')]
+    caches = [cache for cache in f.get_bytecode().global_caches if cache is not None]
+    assert len(caches) == 1
+    assert caches[0].globals is frame.globals
+    assert caches[0].slot == frame.bytecode.vars.get('k')
+    version = frame.globals.versions[caches[0].slot]
+    frame.globals.store(caches[0].slot, frame.vars[caches[0].slot])
+    assert frame.globals.versions[caches[0].slot] == version
+
+def test_rebinding_a_global_keeps_other_caches():
+    source = 'def f(n) { return n + k; }\nk = 1;\nfor (i in range(5)) { f(i); }\n'
+    frame = compile_source('main.mo', source)
+    interpret_bytecode(init_sys('moha'), 'main.mo', frame, frame.bytecode)
+    globals = frame.globals
+    assert globals.versions[frame.bytecode.vars.get('i')] > 1
+    assert globals.versions[frame.bytecode.vars.get('k')] == 1
+    f = frame.vars[frame.bytecode.vars.get('f')]
+    cache, = [cache for cache in f.get_bytecode().global_caches if cache is not None]
+    assert cache.version == 1
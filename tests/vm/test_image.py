@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from moha.vm.image import read_image, write_image
+from moha.vm.phases import PhaseTimer
+from moha.vm.runtime import init_sys, load_module
+
+WARMUP = '''
+import list from "std/data";
+counter = {"n": 0};
+shared = [counter, counter];
+def bump() { counter.n = counter.n + 1; return counter.n; }
+printer = print;
+'''
+
+MAIN = '''
+import list from "std/data";
+import bump, shared, printer from "./warmup";
+l = list();
+l.push(1);
+printer(l.size());
+print(bump());
+print(bump());
+print(shared[1].n);
+'''
+
+def snapshot(tmpdir, source=WARMUP):
+    warmup = tmpdir.join('warmup.mo')
+    warmup.write(source)
+    sys = init_sys('moha')
+    sys.modules[str(warmup)] = load_module(sys, str(warmup))
+    image = str(tmpdir.join('warm.img'))
+    write_image(sys, image)
+    return image
+
+def test_start_from_image(tmpdir, capsys):
+    image = snapshot(tmpdir)
+    main = tmpdir.join('main.mo')
+    main.write(MAIN)
+    sys = init_sys('moha')
+    assert read_image(sys, image)
+    assert len(sys.modules) == 2
+    sys.timer = PhaseTimer()
+    load_module(sys, str(main))
+    assert [t.filename for t in sys.timer.modules] == [str(main)]
+    out, _ = capsys.readouterr()
+    assert out.splitlines() == ['1', '1', '2', '2']
+
+def test_stale_image_is_ignored(tmpdir):
+    image = snapshot(tmpdir)
+    tmpdir.join('warmup.mo').write(WARMUP + 'x = 1;\n')
+    sys = init_sys('moha')
+    assert not read_image(sys, image)
+    assert sys.modules == {}
+
+def test_missing_image_is_ignored(tmpdir):
+    sys = init_sys('moha')
+    assert not read_image(sys, str(tmpdir.join('missing.img')))
+    assert sys.modules == {}
+
+def test_damaged_image_is_ignored(tmpdir):
+    image = snapshot(tmpdir)
+    data = open(image).read()
+    for damaged in [data[:-8], data[:len(data) / 2], data.replace(':', 'x:', 5)]:
+        open(image, 'w').write(damaged)
+        sys = init_sys('moha')
+        assert not read_image(sys, image)
+        assert sys.modules == {}
+
+def test_native_state_cannot_be_snapshot(tmpdir):
+    with pytest.raises(Exception):
+        snapshot(tmpdir, 'def f(x) { return x; }\ncached = memo(f);\n')
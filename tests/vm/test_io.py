@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import time
+
+import pytest
+
+def test_file_write_and_read(run, tmpdir):
+    path = str(tmpdir.join('out.txt'))
+    source = '''
+    import "std/io";
+    f = io.open("%s", "w");
+    f.write("hello ");
+    f.close();
+    f = io.open("%s", "a");
+    f.write("world");
+    f.close();
+    print(io.read_all(io.open("%s")));
+    ''' % (path, path, path)
+    assert run(source) == ['hello world']
+
+def test_open_missing_file(run, tmpdir):
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; io.open("%s");' % tmpdir.join('missing'))
+    assert 'cannot open' in str(e.value)
+
+def test_pipe_between_tasks(run):
+    source = '''
+    import "std/io";
+    def writer(w) { w.write("hello "); io.sleep(10); w.write("world"); w.close(); }
+    p = io.pipe();
+    spawn(writer, p[1]);
+    print(io.read_all(p[0]));
+    '''
+    assert run(source) == ['hello world']
+
+def test_sleep_suspends_only_the_caller(run):
+    source = '''
+    import "std/io";
+    def sleeper(name, ms) { io.sleep(ms); print(name); }
+    spawn(sleeper, "slow", 60);
+    spawn(sleeper, "fast", 10);
+    spawn(def(name) { print(name); }, "busy");
+    '''
+    assert run(source) == ['busy', 'fast', 'slow']
+
+def test_tcp_echo(run):
+    source = '''
+    import "std/io";
+    def echo(server) {
+        conn = server.accept();
+        conn.write(conn.read(100) + "!");
+        conn.close();
+    }
+    server = io.listen("127.0.0.1", 0);
+    spawn(echo, server);
+    conn = io.connect("127.0.0.1", server.port());
+    conn.write("ping");
+    print(io.read_all(conn));
+    server.close();
+    '''
+    assert run(source) == ['ping!']
+
+def test_unix_socket_echo(run, tmpdir):
+    path = str(tmpdir.join('echo.sock'))
+    source = '''
+    import "std/io";
+    def echo(server, n) {
+        for (i in range(n)) {
+            conn = server.accept();
+            spawn(def(conn) { conn.write(conn.read(100)); conn.close(); }, conn);
+        }
+    }
+    def client(name) {
+        conn = io.connect_unix("%s");
+        conn.write(name);
+        print(io.read_all(conn));
+    }
+    server = io.listen_unix("%s");
+    spawn(echo, server, 2);
+    spawn(client, "a");
+    spawn(client, "b");
+    ''' % (path, path)
+    assert sorted(run(source)) == ['a', 'b']
+
+@pytest.fixture
+def delay_server():
+    """A loopback server that answers "delay:<seconds>" after that many seconds."""
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    def answer(conn):
+        request = conn.recv(100)
+        time.sleep(float(request.split(':')[1]))
+        conn.sendall('done ' + request)
+        conn.close()
+    def accept():
+        while True:
+            try:
+                conn, _ = listener.accept()
+            except socket.error:
+                return
+            threading.Thread(target=answer, args=(conn,)).start()
+    thread = threading.Thread(target=accept)
+    thread.daemon = True
+    thread.start()
+    yield listener.getsockname()[1]
+    listener.close()
+
+def test_waits_overlap(run, delay_server):
+    source = '''
+    import "std/io";
+    def request(delay) {
+        conn = io.connect("127.0.0.1", %d);
+        conn.write("delay:" + delay);
+        print(io.read_all(conn));
+    }
+    spawn(request, "0.5");
+    spawn(request, "0.5");
+    spawn(request, "0");
+    ''' % delay_server
+    start = time.time()
+    assert run(source) == ['done delay:0', 'done delay:0.5', 'done delay:0.5']
+    # the two slow requests waited at the same time
+    assert time.time() - start < 0.9
+
+def test_connect_refused(run):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; io.connect("127.0.0.1", %d);' % port)
+    assert 'cannot connect' in str(e.value)
+
+def test_closed_stream(run):
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; p = io.pipe(); p[0].close(); p[0].read(1);')
+    assert 'is closed' in str(e.value)
+
+def test_event_loop_is_checked_once_per_round(run, monkeypatch):
+    from moha.vm.eventloop import EventLoop
+    polls = []
+    poll = EventLoop.poll
+    def counting_poll(self, block):
+        polls.append(block)
+        return poll(self, block)
+    monkeypatch.setattr(EventLoop, 'poll', counting_poll)
+    source = '''
+    import "std/io";
+    def busy(n) { for (i in range(n)) { yield(); } }
+    spawn(def(ms) { io.sleep(ms); print("slept"); }, 100);
+    for (i in range(10)) { spawn(busy, 50); }
+    '''
+    assert run(source) == ['slept']
+    # ten tasks yielding 50 times each take about 50 rounds
+    assert polls.count(False) < 100
+
+def test_listen_errors(run, tmpdir):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    port = listener.getsockname()[1]
+    try:
+        with pytest.raises(Exception) as e:
+            run('import "std/io"; io.listen("127.0.0.1", %d);' % port)
+        assert str(e.value) == 'cannot listen on 127.0.0.1:%d: Address already in use' % port
+    finally:
+        listener.close()
+    path = tmpdir.join('missing', 'server.sock')
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; io.listen_unix("%s");' % path)
+    assert str(e.value).startswith('cannot listen on %s: ' % path)
+
+def test_connect_to_unknown_host(run):
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; io.connect("no-such-host.invalid", 80);')
+    assert str(e.value).startswith('cannot connect to no-such-host.invalid:80: ')
+
+def test_wait_for_a_ready_descriptor():
+    import os
+    from moha.vm.eventloop import EventLoop, IOWait
+    from rpython.rlib import rpoll
+    r, w = os.pipe()
+    try:
+        loop = EventLoop()
+        wait = IOWait(loop, r, rpoll.POLLIN)
+        wait.start()
+        assert not wait.ready()
+        os.write(w, 'x')
+        assert loop.poll(True)
+        assert wait.ready() and wait.complete().str() == 'null'
+        assert not loop.pending()
+    finally:
+        os.close(r)
+        os.close(w)
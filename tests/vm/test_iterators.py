@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+def test_for_array(run):
+    assert run('for (e in [1, 2]) { print(e); }') == ['1', '2']
+
+def test_for_string(run):
+    assert run('for (c in "ab") { print(c); }') == ['a', 'b']
+
+def test_for_object_keys(run):
+    assert run('for (k in {"key": 1}) { print(k); }') == ['key']
+
+def test_for_empty_array(run):
+    assert run('for (e in []) { print(e); } print("done");') == ['done']
+
+def test_return_from_for(run):
+    source = '''
+    def first(xs) { for (x in xs) { return x; } }
+    print(first([3, 4]));
+    '''
+    assert run(source) == ['3']
+
+def test_lazy_pipeline(run):
+    source = '''
+    it = iter([1, 2, 3, 4]).map(def(e) { return e * e; }).filter(def(e) { return e > 4; });
+    print(collect(it));
+    '''
+    assert run(source) == ['[9,16]']
+
+def test_lazy_pipeline_is_lazy(run):
+    source = '''
+    it = iter([1, 2]).map(def(e) { print(e); return e; });
+    print("built");
+    for (e in it) { pass; }
+    '''
+    assert run(source) == ['built', '1', '2']
+
+def test_builtins_accept_iterators(run):
+    source = '''
+    print(reduce(def(a, b) { return a + b; }, iter([1, 2, 3]).map(def(e) { return e * 2; }), 0));
+    print(map(def(c) { return c + c; }, "ab"));
+    '''
+    assert run(source) == ['12', '[aa,bb]']
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+
+from moha.vm import code
+from moha.vm.jitstats import JitStats
+from moha.vm.objects import Function
+from moha.vm.runtime import printable_loc, compile_source
+
+def functions(source):
+    bc = compile_source('loops.mo', source).bytecode
+    return [const.get_bytecode() for const in bc.constants if isinstance(const, Function)]
+
+def test_printable_loc_names_function_and_line():
+    f, g = functions('''
+def f(n) { t = 0; for (x in range(n)) { t = t + x; } return t; }
+
+def g(n) { t = 0; for (x in range(n)) { t = t + x; } return t; }
+''')
+    jump = f.code.index(code.JMP)
+    assert g.code[jump] == code.JMP
+    assert printable_loc(jump, f.code, f) == 'loops.mo:2 f %d JMP' % jump
+    assert printable_loc(jump, g.code, g) == 'loops.mo:4 g %d JMP' % jump
+    stats = JitStats()
+    stats.on_trace(1, printable_loc(jump, f.code, f))
+    stats.on_trace(2, printable_loc(jump, g.code, g))
+    assert len(stats.loops) == 2
+
+def test_bridges_are_attributed_to_their_loop():
+    stats = JitStats()
+    stats.on_trace(1, '4 LOAD_VAR')
+    stats.on_trace(2, '10 LOAD_CONST')
+    stats.on_bridge(1)
+    stats.on_bridge(1)
+    stats.on_abort('10 LOAD_CONST')
+    assert stats.traces == 2
+    assert stats.bridges == 2
+    assert stats.loops['4 LOAD_VAR'].bridges == 2
+    assert stats.loops['10 LOAD_CONST'].aborts == 1
+
+def test_report():
+    stats = JitStats()
+    stats.on_trace(1, '4 LOAD_VAR')
+    report = stats.report().splitlines()
+    assert report[0] == 'jit: 1 traces, 0 bridges, 0 aborts'
+    assert report[1] == '  4 LOAD_VAR: 1 traces, 0 bridges, 0 aborts'
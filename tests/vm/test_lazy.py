@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+from moha.vm.objects import Function
+from moha.vm.runtime import compile_source, init_sys, interpret_bytecode
+
+SOURCE = '''def used(n) { return n + 1; }
+def unused(n) { return n - 1; }
+methods = {"get": def(this) { return 1; }};
+print(used(1));
+'''
+
+def functions(bc):
+    return [const for const in bc.constants if isinstance(const, Function)]
+
+def test_function_bodies_compile_on_first_call():
+    frame = compile_source('main.mo', SOURCE)
+    used, unused, method = functions(frame.bytecode)
+    assert used.bytecode is None and unused.bytecode is None and method.bytecode is None
+    interpret_bytecode(init_sys('moha'), 'main.mo', frame, frame.bytecode)
+    assert used.body.bytecode is not None
+    assert unused.body.bytecode is None
+    assert method.body.bytecode is None
+
+def test_compiled_bytecode_is_cached():
+    frame = compile_source('main.mo', SOURCE)
+    used = functions(frame.bytecode)[0]
+    bc = used.get_bytecode()
+    assert used.get_bytecode() is bc
+    assert bc.name == 'used'
+    assert bc.vars.get('used') == 1
+
+def test_implicit_return_constant_belongs_to_the_function(run):
+    source = '''
+    x = 1;
+    def f() { y = 2; }
+    print(f());
+    '''
+    assert run(source) == ['null']
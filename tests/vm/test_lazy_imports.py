@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from moha.vm.runtime import init_sys, load_module
+
+LIB = '''print("loading lib");
+def double(x) { return x * 2; }
+def triple(x) { return x * 3; }
+'''
+
+def run_lazy(tmpdir, capsys, source):
+    tmpdir.join('lib.mo').write(LIB)
+    path = tmpdir.join('main.mo')
+    path.write(source)
+    sys = init_sys('moha')
+    sys.lazy_imports = True
+    load_module(sys, str(path))
+    out, _ = capsys.readouterr()
+    return out.splitlines()
+
+def test_module_loads_on_first_member_use(tmpdir, capsys):
+    source = '''import double, triple from "./lib";
+print("start");
+print(double(2));
+print(triple(2));
+'''
+    assert run_lazy(tmpdir, capsys, source) == ['start', 'loading lib', '4', '6']
+
+def test_unused_import_is_never_loaded(tmpdir, capsys):
+    source = '''import double from "./lib";
+print("done");
+'''
+    assert run_lazy(tmpdir, capsys, source) == ['done']
+
+def test_members_resolve_from_functions(tmpdir, capsys):
+    source = '''import double from "./lib";
+def quadruple(x) { return double(double(x)); }
+print(quadruple(1));
+print(quadruple(2));
+'''
+    assert run_lazy(tmpdir, capsys, source) == ['loading lib', '4', '8']
+
+def test_missing_member_fails_on_use(tmpdir, capsys):
+    source = '''import missing from "./lib";
+print("start");
+missing(1);
+'''
+    with pytest.raises(Exception):
+        run_lazy(tmpdir, capsys, source)
+
+def test_module_import_loads_on_first_use(tmpdir, capsys):
+    source = '''import "./lib";
+print("start");
+print(lib.double(2));
+'''
+    assert run_lazy(tmpdir, capsys, source) == ['start', 'loading lib', '4']
+
+def test_only_imported_names_are_resolved_on_load():
+    from moha.vm import code
+    from moha.vm.runtime import compile_source
+    bc = compile_source('main.mo', 'import double from "./lib";\nx = 1;\nprint(double(x));\n').bytecode
+    loads = [(bc.code[pc], bc.vars.keys[bc.code[pc + 1]]) for pc in range(0, len(bc.code), 2)
+             if bc.code[pc] in (code.LOAD_VAR, code.LOAD_IMPORT)]
+    assert loads == [(code.LOAD_IMPORT, 'double'), (code.LOAD_VAR, 'x')]
+
+def test_lazy_member_of_a_loaded_value():
+    from moha.vm.objects import LazyImport, Object, Integer, String
+    obj = Object()
+    obj.dictionary['n'] = Integer(3)
+    assert LazyImport(obj, String('n')).resolve().intval == 3
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+def test_memo_caches_results(run):
+    source = '''
+    def square(n) { print("computing"); return n * n; }
+    fast = memo(square, 8);
+    print(fast(3));
+    print(fast(3));
+    print(fast.hits());
+    print(fast.misses());
+    '''
+    assert run(source) == ['computing', '9', '9', '1', '1']
+
+def test_memo_recursion_goes_through_cache(run):
+    source = '''
+    def fib(n) {
+        if (n < 2) { return n; } (n >= 2) { return fib(n - 1) + fib(n - 2); }
+    }
+    fib = memo(fib, 100);
+    print(fib(60));
+    print(fib.misses());
+    '''
+    assert run(source) == ['1548008755920', '61']
+
+def test_memo_hashes_by_value(run):
+    source = '''
+    total = memo(def(xs) { return xs.length(); }, 8);
+    total([1, 2]);
+    total([1, 2]);
+    total("a" + "b");
+    total("ab");
+    print(total.hits());
+    '''
+    assert run(source) == ['2']
+
+def test_memo_evicts_least_recently_used(run):
+    source = '''
+    ident = memo(def(n) { return n; }, 2);
+    ident(1);
+    ident(2);
+    ident(1);
+    ident(3);
+    print(ident.size());
+    ident(1);
+    ident(2);
+    print(ident.hits());
+    print(ident.misses());
+    '''
+    assert run(source) == ['2', '2', '4']
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+from moha.vm import code
+from moha.vm.grammar.parser import parse_source
+from moha.vm.runtime import compile_ast, compile_source, init_sys, interpret_bytecode, load_module
+
+def load(tmpdir, lib, source):
+    tmpdir.join('lib.mo').write(lib)
+    path = tmpdir.join('main.mo')
+    path.write(source)
+    sys = init_sys('moha')
+    load_module(sys, str(path))
+    return sys
+
+def test_selected_exports(tmpdir, capsys):
+    lib = '''helper = 10;
+def add(x) { return x + 1; }
+def sub(x) { return x - 1; }
+export add, sub as "lib";
+'''
+    sys = load(tmpdir, lib, 'import add, sub from "./lib";\nprint(add(1) + sub(1));\n')
+    assert capsys.readouterr()[0] == '2\n'
+    module, = sys.modules.values()
+    assert module.exports.name == 'lib'
+    assert module.exports.names == ['add', 'sub']
+    assert len(module.values) == 2
+
+def test_unexported_member_cannot_be_imported(tmpdir):
+    lib = 'helper = 10;\nanswer = 42;\nexport answer as "lib";\n'
+    with pytest.raises(Exception) as e:
+        load(tmpdir, lib, 'import helper from "./lib";\n')
+    assert 'does not export' in str(e.value)
+
+def test_export_all(tmpdir, capsys):
+    lib = 'a = 1;\nb = 2;\nexport * as "lib";\n'
+    load(tmpdir, lib, 'import a, b from "./lib";\nprint(a + b);\n')
+    assert capsys.readouterr()[0] == '3\n'
+
+def test_exporting_undefined_variable_fails(tmpdir):
+    with pytest.raises(Exception):
+        load(tmpdir, 'a = 1;\nexport b as "lib";\n', 'import a from "./lib";\n')
+
+def test_module_member_access_is_cached_per_site(tmpdir, capsys):
+    lib = 'def twice(x) { return x * 2; }\nname = "lib";\n'
+    source = '''import "./lib";
+i = 0;
+do (i < 3) { print(lib.twice(i)); i = i + 1; }
+print(lib.name);
+'''
+    sys = load(tmpdir, lib, source)
+    assert capsys.readouterr()[0].splitlines() == ['0', '2', '4', 'lib']
+
+def test_modules_are_loaded_once(tmpdir, capsys):
+    tmpdir.join('other.mo').write('import a from "./lib";\nb = a + 1;\n')
+    lib = 'print("loading");\na = 1;\n'
+    load(tmpdir, lib, 'import a from "./lib";\nimport b from "./other";\nprint(a + b);\n')
+    assert capsys.readouterr()[0].splitlines() == ['loading', '3']
+
+def test_member_sites_are_linked_at_import(tmpdir, capsys):
+    tmpdir.join('lib.mo').write('def twice(x) { return x * 2; }\nanswer = 42;\n')
+    path = str(tmpdir.join('main.mo'))
+    source = '''import answer from "./lib";
+import "./lib";
+if (answer < 0) { print(lib.twice(answer)); } (answer > 0) { print(answer); }
+'''
+    frame = compile_source(path, source)
+    bc = frame.bytecode
+    interpret_bytecode(init_sys('moha'), path, frame, bc)
+    assert capsys.readouterr()[0] == '42\n'
+    linked = [pc for pc in range(0, len(bc.code), 2) if bc.member_tables[pc / 2] is not None]
+    assert [bc.code[pc] for pc in linked] == [code.IMPORT_MEMBER, code.LOAD_METHOD]
+    assert bc.member_slots[linked[0] / 2] == 1
+    assert bc.member_slots[linked[1] / 2] == 0
+
+def test_several_export_statements_are_rejected(tmpdir):
+    node = parse_source('lib.mo', 'a = 1;\nb = 2;\nexport a as "lib";\n')
+    node.children.append(parse_source('lib.mo', 'export b as "lib";\n').children[0])
+    with pytest.raises(Exception) as e:
+        compile_ast('lib.mo', node)
+    assert 'one export statement' in str(e.value)
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from moha.vm import code
+from moha.vm.objects import ObjectTemplate
+from moha.vm.runtime import compile_source
+
+def test_literal_compiles_to_one_build_instruction():
+    bc = compile_source('main.mo', 'o = {"a": 1, b: 2};\n').bytecode
+    assert code.BUILD_OBJECT in bc.code[::2]
+    assert code.STORE_MAP not in bc.code[::2]
+    templates = [const for const in bc.constants if isinstance(const, ObjectTemplate)]
+    assert [t.keys for t in templates] == [['a', 'b']]
+
+def test_literal_values(run):
+    source = '''
+    def point(x, y) { return {"x": x, "y": y, "sum": x + y}; }
+    p = point(1, 2);
+    q = point(3, 4);
+    print(p.x + p.y);
+    print(q.sum);
+    p.x = 10;
+    print(point(1, 2).x);
+    '''
+    assert run(source) == ['3', '7', '1']
+
+def test_empty_and_duplicate_keys(run):
+    source = '''
+    e = {};
+    e.a = 1;
+    print(e.a);
+    d = {"a": 1, "a": 2};
+    print(d.a);
+    '''
+    assert run(source) == ['1', '2']
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import sys
+
+import pytest
+from rpython.rlib.parsing.deterministic import LexerError
+from rpython.rlib.parsing.parsing import ParseError
+from rpython.rlib.parsing.tree import Symbol
+from moha.vm.grammar import parser, v0_2_0
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(root, 'benchmarks'))
+
+import parse as parse_benchmark
+
+def shape(node):
+    if isinstance(node, Symbol):
+        pos = node.token.source_pos
+        return (node.symbol, node.additional_info, pos.lineno, pos.columnno)
+    return (node.symbol, [shape(child) for child in node.children])
+
+def ebnf_shape(source):
+    return shape(v0_2_0.to_ast.transform(v0_2_0._parse(source)))
+
+def sources():
+    paths = []
+    for pattern in ('examples/*.mo', 'libs/*/*.mo', 'tests/*/*.mo', 'benchmarks/*.mo'):
+        paths.extend(glob.glob(os.path.join(root, pattern)))
+    return sorted(paths)
+
+@pytest.mark.parametrize('path', sources())
+def test_same_tree_as_ebnf_parser(path):
+    with open(path) as f:
+        source = f.read()
+    try:
+        expected = ebnf_shape(source)
+    except ParseError:
+        with pytest.raises(ParseError):
+            parser.parse(source)
+        return
+    assert shape(parser.parse(source)) == expected
+
+@pytest.mark.parametrize('source', [
+    'a = -1.5e3 + 0o17 - 0x1F * 0b101 / 2 % 3;',
+    'x = a | b ^ c & d << 1 >> 2 || !e && f != g;',
+    'o = {a: 1, "b": def(x) { return x; },};',
+    '{ a.b[c](1, 2)(); }',
+    '{a: 1};',
+    'del a.b["c"];',
+    'def f() { return; }',
+    'if (a in b) { pass; } (true) { abort null; }',
+    'print("multi\nline");\nx = (((1)));',
+    '# leading\na = 1; # trailing\n  # indented\nb = "# not a comment";#',
+    'a = 1;\r\nb = [a,\r\n a];\r\n',
+])
+def test_same_tree_for_snippets(source):
+    assert shape(parser.parse(source)) == ebnf_shape(source)
+
+def test_same_tree_for_generated_source():
+    source = parse_benchmark.generate(20)
+    assert shape(parser.parse(source)) == ebnf_shape(source)
+
+@pytest.mark.parametrize('source', [
+    'a = 1', 'a = [1,];', 'def f() {}', 'x = def() { pass; };', 'a < b < c;',
+    'print(1); import "io";', '{a: 1 b: 2};', 'x = 1 +;',
+])
+def test_rejects_what_ebnf_parser_rejects(source):
+    with pytest.raises(ParseError):
+        ebnf_shape(source)
+    with pytest.raises(ParseError):
+        parser.parse(source)
+
+def test_error_positions(capsys):
+    with pytest.raises(ParseError) as e:
+        parser.parse_source('main.mo', 'a = 1;\nb = 2 +;\n')
+    assert e.value.source_pos.lineno == 1
+    assert e.value.source_pos.columnno == 7
+    out, _ = capsys.readouterr()
+    assert 'line 2' in out
+    assert "ParseError: expected 'expression'" in out
+    with pytest.raises(LexerError):
+        parser.parse('s = "a\\b";')
+    with pytest.raises(LexerError):
+        parser.parse('a = 1 @ 2;')
+
+def test_comments(run):
+    source = '''# comment
+    a = 1; # after a statement
+    def f(x) { # after a brace
+        return x + a; # after return
+    }
+    print(f(1)); # print("not run");
+    '''
+    assert run(source) == ['2']
+
+def test_error_lines_count_comments(capsys):
+    with pytest.raises(ParseError) as e:
+        parser.parse_source('main.mo', '# one\n# two\nx = ;\n')
+    assert e.value.source_pos.lineno == 2
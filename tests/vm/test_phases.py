@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+from moha.vm.phases import PhaseTimer
+from moha.vm.runtime import init_sys, load_module
+
+def test_phases_are_timed_per_module(tmpdir):
+    tmpdir.join('lib.mo').write('def double(x) { return x * 2; }\nexport double as "lib";\n')
+    main = tmpdir.join('main.mo')
+    main.write('import double from "./lib";\nprint(double(21));\n')
+    sys = init_sys('moha')
+    sys.timer = PhaseTimer()
+    load_module(sys, str(main))
+    names = [t.filename for t in sys.timer.modules]
+    assert names[0] == str(main)
+    assert names[1].endswith('lib.mo')
+    for t in sys.timer.modules:
+        assert t.read >= 0 and t.parse >= 0 and t.compile >= 0 and t.execute >= 0
+    assert len(sys.timer.report().splitlines()) == 3
+
+def test_dump_bytecode_includes_functions(tmpdir, capsys):
+    main = tmpdir.join('main.mo')
+    main.write('def add(a, b) { return a + b; }\nprint(add(1, 2));\n')
+    sys = init_sys('moha')
+    sys.dump_bytecode = True
+    load_module(sys, str(main))
+    out, _ = capsys.readouterr()
+    assert '== <module> (%s:1) ==' % main in out
+    assert '== add (%s:1) ==' % main in out
+    assert 'RETURN_VALUE' in out
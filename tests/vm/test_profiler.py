@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from moha.vm.profiler import Profiler
+from moha.vm.runtime import init_sys, load_module
+
+SOURCE = '''def work(n) {
+    i = 0;
+    do (i < n) { i = i + 1; }
+    return i;
+}
+work(50);
+'''
+
+def profile(tmpdir, interval):
+    path = tmpdir.join('main.mo')
+    path.write(SOURCE)
+    sys = init_sys('moha')
+    sys.profiler = Profiler(interval)
+    load_module(sys, str(path))
+    return sys.profiler, str(path)
+
+def test_samples_are_attributed_to_functions_and_lines(tmpdir):
+    profiler, path = profile(tmpdir, 1)
+    stack = '<module> (%s:6);work (%s:3)' % (path, path)
+    assert stack in profiler.stacks
+
+def test_collapsed_output(tmpdir):
+    profiler, path = profile(tmpdir, 10)
+    out = tmpdir.join('out.folded')
+    profiler.write(str(out))
+    for line in out.read().splitlines():
+        stack, weight = line.rsplit(' ', 1)
+        assert stack.startswith('<module> (%s:' % path)
+        assert int(weight) > 0
+
+@pytest.mark.parametrize('value', ['abc', '0', '-5', ''])
+def test_bad_profile_interval_prints_usage(tmpdir, value):
+    path = tmpdir.join('main.mo')
+    path.write(SOURCE)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    proc = subprocess.Popen([sys.executable, os.path.join(root, 'targetmoha.py'),
+                             '--profile=%s' % tmpdir.join('out.folded'),
+                             '--profile-interval=%s' % value, str(path)],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=root)
+    out, err = proc.communicate()
+    assert proc.returncode == 1
+    assert out.startswith('usage:')
+    assert 'Traceback' not in err
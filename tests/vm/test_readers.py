@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+import errno
+import os
+import subprocess
+import sys
+
+import pytest
+
+from moha.vm.readers import Reader, MappedFile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def lines_file(tmpdir):
+    path = tmpdir.join('log.txt')
+    path.write('first\nsecond line\n\nlast without newline')
+    return str(path)
+
+def open_reader(path, block_size):
+    return Reader(os.open(path, os.O_RDONLY), path, block_size)
+
+@pytest.mark.parametrize('block_size', [1, 3, 7, 65536])
+def test_read_line_across_blocks(lines_file, block_size):
+    reader = open_reader(lines_file, block_size)
+    lines = []
+    while True:
+        line = reader.read_line()
+        if line is None:
+            break
+        lines.append(line)
+    assert lines == ['first', 'second line', '', 'last without newline']
+
+def test_buffer_holds_at_most_a_block(tmpdir):
+    path = tmpdir.join('big.txt')
+    path.write('x' * 10 + '\n' + 'y' * 100 + '\n' + 'z' * 50)
+    reader = open_reader(str(path), 16)
+    assert reader.read_line() == 'x' * 10
+    assert len(reader.buffer) <= 16
+    assert reader.read_line() == 'y' * 100
+    assert len(reader.buffer) <= 16
+    assert reader.read(40) == 'z' * 40
+    assert len(reader.buffer) <= 16
+
+def test_long_line_and_chunk(tmpdir):
+    path = tmpdir.join('long.txt')
+    line = ''.join(chr(ord('a') + i % 26) for i in range(1 << 20))
+    path.write(line + '\nend')
+    reader = open_reader(str(path), 4096)
+    assert reader.read_line() == line
+    assert reader.read_line() == 'end'
+    reader = open_reader(str(path), 4096)
+    assert reader.read(len(line) + 1) == line + '\n'
+    assert reader.read(len(line)) == 'end'
+
+def test_read_fixed_size(lines_file):
+    reader = open_reader(lines_file, 4)
+    assert reader.read(10) == 'first\nseco'
+    assert reader.read_line() == 'nd line'
+    data = open(lines_file).read()
+    assert reader.read(100) == data[data.index('\n\n') + 1:]
+    assert reader.read(100) is None
+
+def test_mapped_file(lines_file):
+    mapped = MappedFile(lines_file)
+    assert mapped.size() == os.path.getsize(lines_file)
+    assert mapped.read(6, 6) == 'second'
+    assert mapped.read(mapped.size() - 3, 100) == 'ine'
+    assert mapped.find('\n', 6) == 17
+    assert mapped.find('missing', 0) == -1
+    mapped.close()
+
+def test_mapped_empty_file(tmpdir):
+    path = tmpdir.join('empty')
+    path.write('')
+    mapped = MappedFile(str(path))
+    assert mapped.size() == 0
+    assert mapped.read(0, 10) == ''
+
+def test_for_over_reader(run, lines_file):
+    source = '''
+    import "std/io";
+    for (line in io.reader("%s")) { print("[" + line + "]"); }
+    ''' % lines_file
+    assert run(source) == ['[first]', '[second line]', '[]', '[last without newline]']
+
+def test_chunks(run, tmpdir):
+    path = tmpdir.join('data')
+    path.write('abcdefgh')
+    source = '''
+    import "std/io";
+    print(collect(io.reader("%s").chunks(3)));
+    ''' % path
+    assert run(source) == ['[abc,def,gh]']
+
+def test_lines_and_chunks_share_the_buffer(run, lines_file):
+    source = '''
+    import "std/io";
+    r = io.reader("%s");
+    print(r.read(2));
+    print(r.read_line());
+    for (line in r.lines().map(def(l) { return "<" + l + ">"; })) { print(line); }
+    print(r.read_line());
+    ''' % lines_file
+    assert run(source) == ['fi', 'rst', '<second line>', '<>', '<last without newline>', 'null']
+
+def test_mapped_lines(run, lines_file):
+    source = '''
+    import "std/io";
+    m = io.mmap("%s");
+    print(m.size());
+    print(m.read(m.find("second", 0), 6));
+    print(collect(m.lines()));
+    m.close();
+    ''' % lines_file
+    assert run(source) == ['39', 'second', '[first,second line,,last without newline]']
+
+def test_closed_reader(run, lines_file):
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; r = io.reader("%s"); r.close(); r.read_line();' % lines_file)
+    assert 'is closed' in str(e.value)
+
+def test_read_error(run, tmpdir):
+    with pytest.raises(Exception) as e:
+        run('import "std/io"; io.reader("%s").read_line();' % tmpdir)
+    assert str(e.value) == 'cannot read %s: %s' % (tmpdir, os.strerror(errno.EISDIR))
+
+def test_stdin(tmpdir):
+    script = tmpdir.join('count.mo')
+    script.write('''
+    import "std/io";
+    n = 0;
+    for (line in io.stdin()) { n = n + 1; }
+    print(n);
+    ''')
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'targetmoha.py'), str(script)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=ROOT)
+    out, _ = proc.communicate(''.join('line %d\n' % i for i in range(1000)))
+    assert proc.returncode == 0
+    assert out.splitlines()[-1] == '1000'
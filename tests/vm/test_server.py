@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import subprocess
+import sys
+import time
+from StringIO import StringIO
+
+import pytest
+from moha import client
+from moha.vm.phases import PhaseTimer
+from moha.vm.runtime import init_sys, load_module
+from moha.vm import server as moha_server
+from moha.vm.utils import monotonic_ns
+from moha.vm.server import CodeCache, Output, SocketOutput, OUTPUT_INTERVAL, TICKS_PER_CHECK
+from rpython.rlib.rsocket import RSocket, AF_UNIX, SOCK_STREAM
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def server(tmpdir):
+    path = str(tmpdir.join('moha.sock'))
+    proc = subprocess.Popen([sys.executable, os.path.join(root, 'targetmoha.py'), 'serve', path],
+                            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=root)
+    deadline = time.time() + 60
+    while not os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.05)
+    yield path
+    if proc.poll() is None:
+        client.stop(path)
+    proc.wait()
+
+def run(server, path):
+    out, err = StringIO(), StringIO()
+    status = client.run(server, path, out, err)
+    return status, out.getvalue(), err.getvalue()
+
+def test_scripts_run_in_fresh_namespaces(server, tmpdir):
+    tmpdir.join('counter.mo').write('state = {"n": 0};\nexport state as "counter";\n')
+    script = tmpdir.join('main.mo')
+    script.write('import state from "./counter";\nstate.n = state.n + 1;\nprint(state.n);\nprint("done");\n')
+    assert run(server, str(script)) == (0, '1\ndone\n', '')
+    assert run(server, str(script)) == (0, '1\ndone\n', '')
+
+def test_errors_are_reported(server, tmpdir):
+    script = tmpdir.join('bad.mo')
+    script.write('print(1);\nx = ;\n')
+    status, out, err = run(server, str(script))
+    assert status == 1 and out == ''
+    assert 'line 2' in err and "expected 'expression'" in err
+    status, _, err = run(server, str(tmpdir.join('missing.mo')))
+    assert status == 1 and 'cannot read' in err
+    # an error reading another file is not reported as one reading the script
+    script.write('import "std/io";\nio.reader("%s").read_line();\n' % tmpdir)
+    status, _, err = run(server, str(script))
+    assert status == 1 and 'cannot read %s: ' % tmpdir in err
+
+def test_abort_ends_only_its_script(server, tmpdir):
+    script = tmpdir.join('abort.mo')
+    script.write('print("before");\nabort "boom";\nprint("after");\n')
+    assert run(server, str(script)) == (1, 'before\n', 'Error: boom\n')
+    script = tmpdir.join('next.mo')
+    script.write('print("still serving");\n')
+    assert run(server, str(script)) == (0, 'still serving\n', '')
+
+def test_output_is_sent_while_the_script_waits(server, tmpdir):
+    path = str(tmpdir.join('wait.sock'))
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(1)
+    script = tmpdir.join('wait.mo')
+    script.write('import "std/io";\nprint("first");\nprint("second");\n'
+                 'print(io.read_all(io.connect_unix("%s")));\n' % path)
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.settimeout(10)
+    conn.connect(server)
+    conn.sendall(client.encode('run', str(script)))
+    conn.shutdown(socket.SHUT_WR)
+    try:
+        # the script is still waiting for its connection to be answered
+        reader, output = client.MessageReader(), ''
+        while output != 'first\nsecond\n':
+            for kind, payload in reader.feed(conn.recv(65536)):
+                assert kind == 'o'
+                output += payload
+        answer, _ = listener.accept()
+        answer.sendall('third')
+        answer.close()
+    finally:
+        # on failure this resets the script's connection so the server goes on
+        listener.close()
+    data = ''
+    while True:
+        chunk = conn.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    conn.close()
+    assert reader.feed(data) == [('o', 'third\n'), ('x', '0')]
+
+class Connection(object):
+
+    def __init__(self):
+        self.sent = []
+
+    def sendall(self, data):
+        self.sent.append(data)
+
+def test_output_is_sent_once_the_interval_has_passed():
+    conn = Connection()
+    output = SocketOutput(conn)
+    output.last_sent = monotonic_ns()
+    output.write('a\n')
+    assert conn.sent == []
+    output.last_sent -= OUTPUT_INTERVAL
+    output.write('b\n')
+    assert client.MessageReader().feed(''.join(conn.sent)) == [('o', 'a\nb\n')]
+
+def test_default_output_writes_to_stdout(tmpdir, capfd):
+    script = tmpdir.join('hello.mo')
+    script.write('print("hello");\n')
+    sys = init_sys('moha')
+    sys.output = Output()
+    load_module(sys, str(script))
+    out, _ = capfd.readouterr()
+    assert out == 'hello\n'
+
+def test_output_is_sent_while_the_script_computes():
+    conn = Connection()
+    output = SocketOutput(conn)
+    output.last_sent = monotonic_ns()
+    output.write('a\n')
+    output.last_sent -= OUTPUT_INTERVAL
+    for _ in range(TICKS_PER_CHECK - 1):
+        output.tick()
+    assert conn.sent == []
+    output.tick()
+    assert client.MessageReader().feed(''.join(conn.sent)) == [('o', 'a\n')]
+
+def test_output_is_flushed_by_a_long_loop(tmpdir):
+    script = tmpdir.join('loop.mo')
+    script.write('print("a");\nprint("b");\nfor (i in range(50000)) { x = i; }\nprint("c");\n')
+    conn = Connection()
+    assert moha_server.run_script('moha', CodeCache(), SocketOutput(conn), str(script)) == 0
+    messages = client.MessageReader().feed(''.join(conn.sent))
+    # "b" went out during the loop, not together with "c" at the end
+    assert messages[-1] == ('o', 'c\n')
+
+def test_parse_errors_are_only_sent_to_the_client(tmpdir, capsys):
+    tmpdir.join('lib.mo').write('x = ;\n')
+    script = tmpdir.join('main.mo')
+    script.write('import x from "./lib";\n')
+    conn = Connection()
+    status = moha_server.run_script('moha', CodeCache(), SocketOutput(conn), str(script))
+    messages = client.MessageReader().feed(''.join(conn.sent))
+    assert status == 1 and len(messages) == 1
+    assert messages[0][0] == 'e' and 'lib.mo, line 1' in messages[0][1]
+    out, _ = capsys.readouterr()
+    assert out == ''
+
+def serve_request(monkeypatch, send):
+    """Handle one request from a client that sends ``send`` and return the answer."""
+    monkeypatch.setattr(moha_server, 'CLIENT_TIMEOUT', 0.2)
+    ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn = RSocket(AF_UNIX, SOCK_STREAM, 0, os.dup(theirs.fileno()))
+    theirs.close()
+    send(ours)
+    try:
+        assert moha_server.handle('moha', CodeCache(), conn)
+    finally:
+        conn.close()
+    answer = ''
+    while True:
+        chunk = ours.recv(65536)
+        if not chunk:
+            break
+        answer += chunk
+    ours.close()
+    return client.MessageReader().feed(answer)
+
+def test_stalled_client_is_dropped(monkeypatch):
+    start = time.time()
+    # the client connects but never ends its request
+    assert serve_request(monkeypatch, lambda conn: conn.sendall('3:run')) == []
+    assert time.time() - start < 5
+
+def test_large_request_is_refused(monkeypatch):
+    def send(conn):
+        conn.sendall(client.encode('run', 'x' * moha_server.MAX_REQUEST))
+        conn.shutdown(socket.SHUT_WR)
+    messages = serve_request(monkeypatch, send)
+    assert messages == [('e', 'request larger than %d bytes' % moha_server.MAX_REQUEST), ('x', '2')]
+
+def test_code_cache_skips_compiling(tmpdir, capsys):
+    script = tmpdir.join('main.mo')
+    script.write('def f(x) { return x + 1; }\nprint(f(1));\n')
+    cache = CodeCache()
+    timers = []
+    for _ in range(2):
+        sys = init_sys('moha')
+        sys.code_cache = cache
+        sys.timer = PhaseTimer()
+        load_module(sys, str(script))
+        timers.append(sys.timer.modules[0])
+    assert timers[0].parse > 0 and timers[1].parse == 0
+    assert cache.get(str(script)) is not None
+    script.write('print(3);\n')
+    assert cache.get(str(script)) is None
+    out, _ = capsys.readouterr()
+    assert out.splitlines() == ['2', '2']
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+def test_sort_method_sorts_in_place(run):
+    assert run('a = [3, 1, 2]; a.sort(); print(a);') == ['[1,2,3]']
+
+def test_sort_strings(run):
+    assert run('print(sort(["b", "c", "a"]));') == ['[a,b,c]']
+
+def test_sort_returns_new_array(run):
+    assert run('a = [2, 1]; b = sort(a); print(a); print(b);') == ['[2,1]', '[1,2]']
+
+def test_sort_with_key(run):
+    source = '''
+    print(sort([3, 1, 2], def(e) { return 0 - e; }));
+    '''
+    assert run(source) == ['[3,2,1]']
+
+def test_sort_with_key_is_stable(run):
+    source = '''
+    people = [["bob", 2], ["amy", 1], ["cat", 2], ["dan", 1]];
+    print(map(def(p) { return p[0]; }, sort(people, def(p) { return p[1]; })));
+    '''
+    assert run(source) == ['[amy,dan,bob,cat]']
+
+def test_sort_evaluates_key_once_per_element(run):
+    source = '''
+    sort([3, 1, 2], def(e) { print(e); return e; });
+    '''
+    assert run(source) == ['3', '1', '2']
+
+def test_sort_empty_array(run):
+    assert run('print(sort([]));') == ['[]']
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from moha.vm.objects import Integer
+from moha.vm.tasks import Queue, Channel, Task, Scheduler, RecvWait, SendWait
+
+def test_spawned_tasks_run_after_main(run):
+    source = '''
+    spawn(def(name) { print(name); }, "task");
+    print("main");
+    '''
+    assert run(source) == ['main', 'task']
+
+def test_yield_interleaves_tasks(run):
+    source = '''
+    def worker(name, n) {
+        for (i in range(n)) { print(name + str(i)); yield(); }
+    }
+    spawn(worker, "a", 3);
+    spawn(worker, "b", 2);
+    '''
+    assert run(source) == ['a0', 'b0', 'a1', 'b1', 'a2']
+
+def test_yield_from_nested_call(run):
+    source = '''
+    def pause(name) { print(name); yield(); }
+    def twice(name) { pause(name + "1"); pause(name + "2"); }
+    spawn(twice, "a");
+    spawn(twice, "b");
+    '''
+    assert run(source) == ['a1', 'b1', 'a2', 'b2']
+
+def test_producer_consumer(run):
+    source = '''
+    def produce(ch) {
+        for (i in range(3)) { ch.send(i); print("sent " + str(i)); }
+        ch.close();
+    }
+    def consume(ch) {
+        for (v in ch) { print("got " + str(v)); }
+        print("closed");
+    }
+    ch = channel();
+    spawn(produce, ch);
+    spawn(consume, ch);
+    '''
+    assert run(source) == ['got 0', 'sent 0', 'got 1', 'sent 1', 'got 2', 'sent 2', 'closed']
+
+def test_buffered_channel_only_blocks_when_full(run):
+    source = '''
+    def produce(ch) {
+        for (i in range(3)) { ch.send(i); print("sent " + str(i)); }
+    }
+    def consume(ch) {
+        for (i in range(3)) { print("got " + str(ch.recv())); }
+    }
+    ch = channel(2);
+    spawn(produce, ch);
+    spawn(consume, ch);
+    '''
+    assert run(source) == ['sent 0', 'sent 1', 'got 0', 'got 1', 'sent 2', 'got 2']
+
+def test_recv_from_closed_channel(run):
+    source = '''
+    ch = channel(1);
+    ch.send(1);
+    ch.close();
+    print(ch.recv());
+    print(ch.recv());
+    '''
+    assert run(source) == ['1', 'null']
+
+def test_send_on_closed_channel(run):
+    with pytest.raises(Exception) as e:
+        run('ch = channel(1); ch.close(); ch.send(1);')
+    assert 'closed channel' in str(e.value)
+
+def test_main_waits_by_running_tasks(run):
+    source = '''
+    ch = channel();
+    spawn(def(ch) { ch.send(42); }, ch);
+    print(ch.recv());
+    '''
+    assert run(source) == ['42']
+
+def test_join(run):
+    source = '''
+    t = spawn(def(a, b) { yield(); return a + b; }, 1, 2);
+    print(t.done());
+    print(t.join());
+    print(t.done());
+    '''
+    assert run(source) == ['false', '3', 'true']
+
+def test_wait_inside_native_callback(run):
+    # the callback cannot suspend its task, so the other tasks run under it
+    source = '''
+    def scale(ch) { print(map(def(e) { return ch.recv() * e; }, [1, 2])); }
+    def send(ch) { ch.send(10); ch.send(20); }
+    ch = channel();
+    spawn(scale, ch);
+    spawn(send, ch);
+    '''
+    assert run(source) == ['[10,40]']
+
+def test_collect_channel(run):
+    source = '''
+    def send(ch) { ch.send(1); ch.send(2); ch.close(); }
+    ch = channel();
+    spawn(send, ch);
+    spawn(def(ch) { print(collect(ch)); }, ch);
+    '''
+    assert run(source) == ['[1,2]']
+
+def test_iterator_over_channel(run):
+    source = '''
+    def send(ch) { for (i in range(3)) { ch.send(i); } ch.close(); }
+    def double(ch) {
+        for (v in iter(ch).map(def(e) { return e * 2; })) { print(v); }
+    }
+    ch = channel();
+    spawn(send, ch);
+    spawn(double, ch);
+    '''
+    assert run(source) == ['0', '2', '4']
+
+def test_deadlock(run):
+    with pytest.raises(Exception) as e:
+        run('ch = channel(); ch.recv();')
+    assert 'deadlock' in str(e.value)
+
+def test_waiting_tasks_are_dropped_at_exit(run):
+    source = '''
+    ch = channel();
+    spawn(def(ch) { ch.recv(); print("never"); }, ch);
+    print("main");
+    '''
+    assert run(source) == ['main']
+
+def test_many_tasks(run):
+    source = '''
+    ch = channel(100);
+    for (i in range(1000)) { spawn(def(n) { ch.send(n); }, i); }
+    total = 0;
+    for (i in range(1000)) { total = total + ch.recv(); }
+    print(total);
+    '''
+    assert run(source) == ['499500']
+
+def test_unbuffered_senders_wake_in_order(run):
+    source = '''
+    ch = channel();
+    def consume(n) { total = 0; for (i in range(n)) { total = total + ch.recv(); } print(total); }
+    for (i in range(200)) { spawn(def(n) { ch.send(n); }, i); }
+    spawn(consume, 200);
+    '''
+    assert run(source) == ['19900']
+
+def test_queue_keeps_order_across_compaction():
+    queue = Queue()
+    popped = []
+    for i in range(100):
+        queue.push(i)
+        queue.push(i + 1000)
+        popped.append(queue.pop())
+    while queue.size():
+        popped.append(queue.pop())
+    assert queue.pop() is None
+    assert popped == [n for i in range(100) for n in (i, i + 1000)]
+    assert queue.items == []
+
+def test_waiting_tasks_are_parked_off_the_run_queue():
+    sched = Scheduler()
+    ch = Channel(1)
+    receivers = [Task(None, [], 'test') for _ in range(3)]
+    for task in receivers:
+        sched.spawn(task)
+        assert sched.next_runnable() is task
+        task.wait = RecvWait(ch)
+        task.wait.park(task)
+    assert sched.runnable() == 0
+    ch.put(Integer(1))
+    assert sched.runnable() == 1
+    assert sched.next_runnable() is receivers[0]
+    # a sender waiting for room is woken by the receive that makes some
+    sender = Task(None, [], 'test')
+    sched.spawn(sender)
+    sched.next_runnable()
+    sender.wait = SendWait(ch, Integer(2))
+    sender.wait.park(sender)
+    assert sched.runnable() == 0
+    ch.take()
+    assert sched.next_runnable() is sender
+    ch.close()
+    assert sched.runnable() == 2
+
+def test_spawned_function_sees_the_spawners_locals(run):
+    source = '''
+    def main(n) {
+        c2 = channel(1);
+        spawn(def(x) { c2.send(x); }, n);
+        return c2.recv();
+    }
+    print(main(42));
+    '''
+    assert run(source) == ['42']
+
+def test_task_spawned_from_a_task_sees_both_spawners(run):
+    source = '''
+    def outer(prefix) {
+        done = channel();
+        def inner(n) {
+            suffix = "!";
+            spawn(def(x) { done.send(prefix + str(x) + suffix); }, n);
+        }
+        spawn(inner, 7);
+        print(done.recv());
+    }
+    outer("got ");
+    '''
+    assert run(source) == ['got 7!']
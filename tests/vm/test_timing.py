@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+from moha.vm.runtime import percentile
+from moha.vm.utils import monotonic_ns
+
+def test_clocks_are_monotonic(run):
+    source = '''
+    a = monotonic_ns();
+    b = monotonic_ns();
+    print(b >= a);
+    t = clock();
+    print(clock() >= t);
+    '''
+    assert run(source) == ['true', 'true']
+
+def test_monotonic_ns_ignores_wall_clock_steps(monkeypatch):
+    before = monotonic_ns()
+    monkeypatch.setattr(time, 'time', lambda: 0.0)
+    assert monotonic_ns() >= before
+
+def test_bench_warms_up_and_reports(run):
+    source = '''
+    calls = [];
+    def work() { calls.push(1); }
+    stats = bench(work, 20, 5);
+    print(calls.length());
+    print(stats.iterations);
+    print(stats.min <= stats.p50 && stats.p50 <= stats.p90);
+    print(stats.p99 <= stats.max && stats.min <= stats.mean);
+    '''
+    assert run(source) == ['25', '20', 'true', 'true']
+
+def test_bench_default_warmup(run):
+    source = '''
+    calls = [];
+    def work() { calls.push(1); }
+    stats = bench(work, 30);
+    print(calls.length());
+    print(stats.warmup);
+    '''
+    assert run(source) == ['34', '4']
+
+def test_percentile():
+    samples = range(1, 101)
+    assert percentile(samples, 50) == 50
+    assert percentile(samples, 99) == 99
+    assert percentile([7], 90) == 7
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import json
+from moha.vm import tracer
+from moha.vm.tracer import OpcodeTracer
+from moha.vm.runtime import init_sys, load_module
+
+def trace(tmpdir, monkeypatch, source):
+    monkeypatch.setattr(tracer, 'ENABLED', True)
+    path = tmpdir.join('main.mo')
+    path.write(source)
+    sys = init_sys('moha')
+    sys.tracer = OpcodeTracer()
+    load_module(sys, str(path))
+    return sys.tracer
+
+def test_counts_opcodes_and_pairs(tmpdir, monkeypatch):
+    t = trace(tmpdir, monkeypatch, 'a = 1; b = 2;')
+    counts = dict((e.label, e.count) for e in t.opcode_counts())
+    assert counts == {'LOAD_CONST': 2, 'STORE_VAR': 2}
+    pairs = dict((e.label, e.count) for e in t.pair_counts())
+    assert pairs == {'LOAD_CONST STORE_VAR': 2, 'STORE_VAR LOAD_CONST': 1}
+
+def test_hot_sites_come_first(tmpdir, monkeypatch):
+    t = trace(tmpdir, monkeypatch, 'i = 0;\ndo (i < 10) { i = i + 1; }\n')
+    hottest = t.site_counts()[0]
+    assert hottest.count == 11
+    assert ':2 <module>' in hottest.label
+
+def test_json(tmpdir, monkeypatch):
+    t = trace(tmpdir, monkeypatch, 'a = 1;')
+    data = json.loads(t.to_json())
+    assert data['opcodes'] == {'LOAD_CONST': 1, 'STORE_VAR': 1}
+    assert data['sites'][0]['line'] == 1
+
+def test_disabled_tracer_is_not_called(tmpdir, monkeypatch):
+    monkeypatch.setattr(tracer, 'ENABLED', False)
+    path = tmpdir.join('main.mo')
+    path.write('a = 1;')
+    sys = init_sys('moha')
+    sys.tracer = OpcodeTracer()
+    load_module(sys, str(path))
+    assert sys.tracer.opcodes == {}